@@ -11,18 +11,27 @@
 # 2015 Feb
 # - added accumulated coverage
 # - added LCA
+# 2026 Oct
+# - classify contigs in a worker pool sharing one taxonomy (no SAM splitting/GNU parallel)
+# - stream bwa output (or a BAM/SAM file) through the classifier, no temporary SAM files
+# - merge the contig classification with the streaming merge_coverage.py
 
 import os
 import sys
 import subprocess
 import time
 import getopt
+import seq_coverage
+
+bin_dir = os.path.dirname(os.path.realpath(__file__))
+os.environ["PATH"] = f"{bin_dir}:{bin_dir}/../../bin/:{bin_dir}/../:{os.environ['PATH']}"
 
 def usage():
     """Print usage information"""
-    print("""Usage: contig_classifier.py -i <input_file> [-p <prefix>] [-t <threads>] [-d <database>] [--pacbio] [--debug] [--help]
+    print("""Usage: contig_classifier.py -i <input_file> [-p <prefix>] [-t <threads>] [-d <database>] [--bam <file>] [--pacbio] [--debug] [--help]
 Options:
-    -i, --input <input_file>      Input file in SAM format
+    -i, --input <input_file>      Input contigs in FASTA format
+    -b, --bam <file>             Classify the alignments of this BAM/SAM file instead of running BWA
     -p, --prefix <prefix>        Prefix for output files (default: 'output')
     -t, --threads <threads>      Number of threads to use (default: 2)
     -d, --db <database>          Database file for classification (default: '/opt/apps/edge/database/bwa_index/NCBI-Bacteria-Virus.fna')
@@ -31,9 +40,12 @@ Options:
     -h, --help                    Print this help message
 """)
 
-def execute_command(cmd):
+def execute_command(cmd, debug=False):
     """Execute a command in the shell"""
-    subprocess.run(cmd, shell=True, check=True)
+    if debug:
+        print(f"[DEBUG] {cmd}")
+    if subprocess.run(cmd, shell=True).returncode != 0:
+        sys.exit(f"COMMAND FAILED: {cmd}")
 
 def time_interval(start_time):
     """Calculate time interval since start time"""
@@ -49,7 +61,6 @@ def mem_usage():
 
 def count_result(file):
     """Count the number of contigs and bases in the result file"""
-    contigs_count = 0
     contigs_bases = 0
     classified_contigs_count = 0
     classified_contigs_bases = 0
@@ -57,20 +68,23 @@ def count_result(file):
     unclassified_contigs_bases = 0
     with open(file, 'r') as f:
         for line in f:
-            fields = line.strip().split('\t')
-            if len(fields) == 14:
-                contigs_count += 1
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            if fields[1] == 'superkingdom':
+                classified_contigs_bases += int(fields[-1])
+                classified_contigs_count += 1
+                contigs_bases += int(fields[5])
+            if fields[1] == 'unclassified' and fields[5] == fields[-1]:
+                unclassified_contigs_count += 1
+                unclassified_contigs_bases += int(fields[-1])
                 contigs_bases += int(fields[5])
-                if fields[3] != 'unclassified':
-                    classified_contigs_count += 1
-                    classified_contigs_bases += int(fields[5])
-                else:
-                    unclassified_contigs_count += 1
-                    unclassified_contigs_bases += int(fields[5])
+    contigs_count = classified_contigs_count + unclassified_contigs_count
     return contigs_count, contigs_bases, classified_contigs_count, classified_contigs_bases, unclassified_contigs_count, unclassified_contigs_bases
 
 def main(argv):
     input_file = ''
+    bam_file = ''
     pacbio = False
     threads = 2
     prefix = 'output'
@@ -79,16 +93,19 @@ def main(argv):
     help_flag = False
 
     try:
-        opts, args = getopt.getopt(argv, "hi:t:p:d:", ["input=", "pacbio", "threads=", "prefix=", "db=", "debug", "help"])
+        opts, args = getopt.getopt(argv, "hi:b:t:p:d:", ["input=", "bam=", "pacbio", "threads=", "prefix=", "db=", "debug", "help"])
     except getopt.GetoptError as e:
         print(str(e))
         usage()
+        sys.exit(1)
 
     for opt, arg in opts:
         if opt in ("-h", "--help"):
             help_flag = True
         elif opt in ("-i", "--input"):
             input_file = arg
+        elif opt in ("-b", "--bam"):
+            bam_file = arg
         elif opt == "--pacbio":
             pacbio = True
         elif opt in ("-t", "--threads"):
@@ -100,69 +117,61 @@ def main(argv):
         elif opt == "--debug":
             debug = True
 
-    if help_flag or not input_file:
+    if help_flag or not os.path.exists(bam_file or input_file):
         usage()
-
-    filename = os.path.basename(input_file)
-    basename, ext = os.path.splitext(filename)
+        sys.exit()
 
     # Initialize options
     threads = threads or 2
     prefix = prefix or 'output'
 
     start_time = time.time()
-    period = time_interval(start_time)
-    mem = mem_usage()
-    period_str = f"[{period}]"
-
-    mem = mem_usage()
-    print(f"{period_str} Running BWA")
-
-    if opt["pacbio"]:
-        execute_command(f"bwa mem -B5 -Q2 -E1 -a -M -t {threads} {db} temp$$/{filename} > temp$$/{filename}.sam 2>>{prefix}.log")
-    else:
-        execute_command(f"bwa mem -a -M -t {threads} {db} temp$$/{filename} > temp$$/{filename}.sam 2>>{prefix}.log")
-
-    period = time_interval(time)
-    print(f"{period_str} Filtering unmapped contigs")
-    execute_command(f"samtools view -F4 temp$$/{filename}.sam > temp$$/{filename}.mapped.sam 2>>{prefix}.log")
-
-    period = time_interval(time)
-    print(f"{period_str} Splitting SAM file")
-    execute_command(f"split_sam_by_lines.pl --line 20000 --input temp$$/{filename}.mapped.sam")
-
-    period = time_interval(time)
-    print(f"{period_str} Classifying contigs")
-    execute_command(f"cd temp$$; parallel --results {prefix}_para_log -j {threads} 'seq_coverage.pl --input {{}}' ::: *.part* > ../{prefix}.ctg_class.csv 2>>../{prefix}.log")
-
-    period = time_interval(time)
-    print(f"{period_str} Reporting unclassified contigs")
-    execute_command(f"samtools view -f4 -S temp$$/{filename}.sam 2>>{prefix}.log | awk -F\\\\t '{{print $1\"\\tunclassified\\tunclassified\\t\\t\\t\",length($10),\"\\t\\t\\t\\t\\t0\\t\\t0\\t\\t\\t\",length($10)}}' >> {prefix}.ctg_class.csv")
-    execute_command(f"samtools view -f4 -S temp$$/{filename}.sam 2>>{prefix}.log | awk '{{print \">\"$1\"\\n\"$10}}' > {prefix}.unclassified.fasta")
-
-    period = time_interval(time)
-    print(f"{period_str} Merging classification")
-    execute_command(f"merge_coverage.pl {prefix}.ctg_class.csv {prefix} > {prefix}.assembly_class.csv 2>>{prefix}.log")
-
-    period = time_interval(time)
-    print(f"{period_str} Reporting classification (BEST hit)")
-    execute_command(f"class_top_hit_summary.pl < {prefix}.assembly_class.csv > {prefix}.assembly_class.top.csv 2>>{prefix}.log")
-    execute_command(f"class_top_hit_summary.pl <
-
-    period = time_interval(time_start)
-    print(f"[{period}] Reporting classification (LCA)")
-    execute_command(f"report_LCA.pl < {PREFIX}.ctg_class.csv > {PREFIX}.ctg_class.LCA.csv 2>>{PREFIX}.log")
-    execute_command(f"(head -n 1 {PREFIX}.ctg_class.LCA.csv && tail -n +2 {PREFIX}.ctg_class.LCA.csv | sort -t '\t' -k6nr) > {PREFIX}.ctg_class.LCA.csv.sort")
-    execute_command(f"mv {PREFIX}.ctg_class.LCA.csv.sort {PREFIX}.ctg_class.LCA.csv")
-
-    tol_contigs_count, tol_contigs_bases, classified_contigs_count, classified_contigs_bases, unclassified_contigs_count, unclassified_contigs_bases = count_result(f"{PREFIX}.ctg_class.top.csv")
-    period = time_interval(time_start)
-    print(f"[{period}] Total Contigs: {tol_contigs_count} ({tol_contigs_bases} bp); Classified Contigs: {classified_contigs_count} ({classified_contigs_bases} bp); Unclassified Contigs: {unclassified_contigs_count} ({unclassified_contigs_bases} bp);")
-
-    if not opt['debug']:
-        period = time_interval(time_start)
-        print(f"[{period}] Cleaning temporary files")
-        execute_command(f"rm -rf temp$$/")
-
-period = time_interval(time_start)
-print(f"[{period}] Finished. Please find the result for contig in {PREFIX}.ctg_class.csv and {PREFIX}.assembly_class.csv")
+
+    def run(cmd):
+        execute_command(cmd, debug)
+
+    # bwa writes straight into the classifier; mapped and unmapped contigs are split in one
+    # pass, with the unclassified contigs reported and written to FASTA as they come
+    with open(f"{prefix}.log", 'a') as log, open(f"{prefix}.ctg_class.csv", 'w') as out, open(f"{prefix}.unclassified.fasta", 'w') as fasta:
+        bwa = None
+        if bam_file:
+            print(f"[{time_interval(start_time)}] Classifying contigs in {bam_file}")
+            source = bam_file
+        else:
+            print(f"[{time_interval(start_time)}] Running BWA and classifying contigs")
+            if pacbio:
+                cmd = ["bwa", "mem", "-B5", "-Q2", "-E1", "-a", "-M", f"-t{threads}", db, input_file]
+            else:
+                cmd = ["bwa", "mem", "-a", "-M", "-t", str(threads), db, input_file]
+            if debug:
+                print(f"[DEBUG] {' '.join(cmd)}")
+            log.flush()
+            bwa = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log)
+            source = bwa.stdout
+
+        seq_coverage.classify_sam(seq_coverage.sam_lines(source, fasta), out, threads)
+
+        if bwa:
+            bwa.stdout.close()
+            if bwa.wait() != 0:
+                sys.exit(f"COMMAND FAILED: {' '.join(cmd)}")
+
+    print(f"[{time_interval(start_time)}] Merging classification")
+    run(f"merge_coverage.py {prefix}.ctg_class.csv {prefix} > {prefix}.assembly_class.csv 2>>{prefix}.log")
+
+    print(f"[{time_interval(start_time)}] Reporting classification (BEST hit)")
+    run(f"class_top_hit_summary.pl < {prefix}.assembly_class.csv > {prefix}.assembly_class.top.csv 2>>{prefix}.log")
+    run(f"class_top_hit_summary.pl < {prefix}.ctg_class.csv > {prefix}.ctg_class.top.csv 2>>{prefix}.log")
+
+    print(f"[{time_interval(start_time)}] Reporting classification (LCA)")
+    run(f"report_LCA.pl < {prefix}.ctg_class.csv > {prefix}.ctg_class.LCA.csv 2>>{prefix}.log")
+    run(f"(head -n 1 {prefix}.ctg_class.LCA.csv && tail -n +2 {prefix}.ctg_class.LCA.csv | sort -t '\t' -k6nr) > {prefix}.ctg_class.LCA.csv.sort")
+    run(f"mv {prefix}.ctg_class.LCA.csv.sort {prefix}.ctg_class.LCA.csv")
+
+    tol_contigs_count, tol_contigs_bases, classified_contigs_count, classified_contigs_bases, unclassified_contigs_count, unclassified_contigs_bases = count_result(f"{prefix}.ctg_class.top.csv")
+    print(f"[{time_interval(start_time)}] Total Contigs: {tol_contigs_count} ({tol_contigs_bases} bp); Classified Contigs: {classified_contigs_count} ({classified_contigs_bases} bp); Unclassified Contigs: {unclassified_contigs_count} ({unclassified_contigs_bases} bp);")
+
+    print(f"[{time_interval(start_time)}] Finished. Please find the result for contig in {prefix}.ctg_class.csv and {prefix}.assembly_class.csv")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -8,6 +8,12 @@
 # 04/2013 v0.1
 #
 # Changes log:
+# 10/2026    - Compatibility layer over microbial_profiling/script/taxonomy.py: the
+#              taxonomy (taxonomy.tsv or its compiled snapshot), the accession
+#              lookups and their caches are shared with taxonomy.py, loaded once
+#              per process. ktGetLibPath and taxonomy.tab are no longer used.
+# 10/2026    - GI to taxID lookups on a memory-mapped uint32 table (gi_taxid.dat)
+#              built by compile_gi_taxid(); add gis2taxID for numpy arrays of GIs
 # 04/07/2017 - Add getAccFromSeqID, getTaxIDFromAcc acc2taxID acc2name acc2rank acc2lineage
 # 04/04/2014 - Add taxid2lineage method
 #
@@ -19,7 +25,20 @@
 #              (eg: /users/218817/scratch/opt/src/krona/taxonomy/gi_updated.tab).
 
 import os
+import re
+import sys
 import csv
+import mmap
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# accession lookups are shared with microbial_profiling/script/taxonomy.py
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'microbial_profiling', 'script'))
+import taxonomy
 
 #############
 # Exported #
@@ -41,36 +60,37 @@ __all__ = [
     'taxid2lineage',
     'gi2lineage',
     'getTaxRank',
+    'getTaxNormRank',
     'getTaxName',
     'getTaxDepth',
     'getTaxIDFromGI',
+    'gis2taxID',
     'getTaxIDFromAcc',
     'getAccFromSeqID',
     'getTaxParent',
+    'tax_contains',
     'loadTaxonomy',
-    'loadUpdatedGI'
+    'loadUpdatedGI',
+    'set_cache_limits',
+    'cache_stats',
+    'print_cache_stats'
 ]
 
 ####################
 # Global constants #
 ####################
 
-libPath = os.popen('ktGetLibPath').read().strip()
-taxonomyDir = os.path.join(libPath, '..', 'taxonomy')
-fileTaxByAcc = 'all.accession2taxid.sorted'
+taxonomyDir = taxonomy.taxonomyDir
+fileTaxByGI = 'gi_taxid.dat'
 DEBUG = 0
 
 #################
 # Lookup tables #
 #################
-taxDepths = []
-taxParents = []
-taxRanks = []
-taxNames = []
+# the taxonomy itself, the accession lookups and their caches live in taxonomy.py
 updatedGI = {}
-taxIDByAcc = {}
-taxIDByGI = {}
-taxIDByGIStr = ''
+taxIDByGIStr = None
+taxIDByGITable = None
 invalidAccs = {}
 missingAccs = {}
 
@@ -347,13 +367,13 @@ def taxid2rank_taxid(id, r):
 #################################################################
 
 def taxid2lineage(id, print_all_rank=1, print_strain=0, replace_space2underscore=1):
-    id2lineage(id, print_all_rank, print_strain, replace_space2underscore, "taxid")
+    return id2lineage(id, print_all_rank, print_strain, replace_space2underscore, "taxid")
 
 def gi2lineage(id, print_all_rank=1, print_strain=0, replace_space2underscore=1):
-    id2lineage(id, print_all_rank, print_strain, replace_space2underscore, "gi")
+    return id2lineage(id, print_all_rank, print_strain, replace_space2underscore, "gi")
 
 def acc2lineage(id, print_all_rank=1, print_strain=0, replace_space2underscore=1):
-    id2lineage(id, print_all_rank, print_strain, replace_space2underscore, "acc")
+    return id2lineage(id, print_all_rank, print_strain, replace_space2underscore, "acc")
 
 def id2lineage(id, print_all_rank=None, print_strain=None, replace_space2underscore=None, input_type=None):
     # Check if taxonomy data is available
@@ -434,100 +454,169 @@ def id2lineage(id, print_all_rank=None, print_strain=None, replace_space2undersc
     # Join the rank list with '|' separator
     return '|'.join(rank_list)
 
+#################################################################
+# getTax* read the shared taxonomy. Taxonomy IDs are returned as
+# integers (custom IDs like "562.1" as strings). Unknown IDs have
+# no name or rank (""), no depth (None) and parent 0.
+#################################################################
 def getTaxDepth(taxID):
-    return taxDepths[taxID]
+    taxID = str(taxID)
+    if taxonomy.taxidStatus(taxID) == 'invalid':
+        return None
+    return int(taxonomy.taxid2depth(taxID))
 
 def getTaxName(taxID):
-    return taxNames[taxID]
+    taxID = str(taxID)
+    if taxonomy.taxidStatus(taxID) == 'invalid':
+        return ''
+    return taxonomy.taxid2name(taxID)
 
+#################################################################
+# Function: getTaxParent
+# Description: The closest ancestor that has a rank (or the root).
+#################################################################
 def getTaxParent(taxID):
-    while taxID > 1 and taxRanks[taxID] == 'no rank':
-        taxID = taxParents[taxID] or 1
-    return taxID
+    taxID = str(taxID)
+    if taxonomy.taxidStatus(taxID) == 'invalid':
+        return 0
+    return _taxid(taxonomy.taxid2parent(taxID))
 
 def getTaxRank(taxID):
-    return taxRanks[taxID]
+    taxID = str(taxID)
+    if taxonomy.taxidStatus(taxID) == 'invalid':
+        return ''
+    return taxonomy.taxid2rank(taxID, guess_strain=False)
+
+#################################################################
+# Function: getTaxNormRank
+# Description: The rank as the report converters list it, from
+# the precomputed table of taxonomy.py ("strain" for a deep
+# "no rank" node, "unclassified" for unknown IDs, "other rank"
+# for unlisted ranks such as clade, which are not reported). The
+# report order is taxonomy.rankLevel, the major report rank of a
+# minor rank is taxonomy.normRank2major.
+#################################################################
+def getTaxNormRank(taxID):
+    return taxonomy.taxid2normRank(str(taxID))
 
 def getTaxIDFromGI(gi):
-    gi = updatedGI[gi] if gi in updatedGI else gi
-    taxID = None
-
-    if gi in taxIDByGI:
-        return taxIDByGI[gi]
-    elif taxIDByGIStr is not None:
-        pos = gi * 4
-        try:
-            # the last one x2147483636L (2GB limitation)
-            # taxID = unpack("x${pos}L", taxIDByGIStr)
-            data = taxIDByGIStr[pos:pos+4]
-            taxID = struct.unpack("L", data)[0]
-        except:
-            raise Exception("ERROR: GI to TaxID table is out of date.\n")
-    elif gi not in taxIDByGI:
-        with open(f"{taxonomyDir}/gi_taxid.dat", "rb") as gi_file:
-            gi_file.seek(gi * 4)
-            data = gi_file.read(4)
-            taxID = struct.unpack("L", data)[0]
-    # make sure taxID is in database
-    if taxID is not None and taxRanks[taxID] is not None:
-        taxIDByGI[gi] = taxID
-
-    return taxIDByGI[gi]
+    gi = int(updatedGI.get(str(gi), gi))
+
+    if taxIDByGIStr is None:
+        open_gi_taxid()
+
+    # the table holds one little-endian uint32 taxID per GI (0: unknown GI)
+    pos = gi * 4
+    if gi < 0 or pos + 4 > len(taxIDByGIStr):
+        return 0
+    return struct.unpack_from('<I', taxIDByGIStr, pos)[0]
+
+#################################################################
+# Function: gis2taxID
+# Description: Vectorized getTaxIDFromGI for many GI numbers.
+# Arguments: gis - sequence or numpy array of GI numbers
+# Returns: numpy uint32 array of taxonomy IDs (0: unknown GI)
+#################################################################
+def gis2taxID(gis):
+    if np is None:
+        raise Exception('gis2taxID requires numpy.')
+
+    if taxIDByGIStr is None:
+        open_gi_taxid()
+
+    gis = np.asarray(gis)
+    if updatedGI:
+        gis = np.array([int(updatedGI.get(str(gi), gi)) for gi in gis.tolist()])
+    gis = gis.astype(np.int64)
+
+    inside = (gis >= 0) & (gis < len(taxIDByGITable))
+    return np.where(inside, taxIDByGITable[np.where(inside, gis, 0)], 0).astype(np.uint32)
+
+#################################################################
+# Function: open_gi_taxid
+# Description: Memory-map a GI to taxID table written by
+#              compile_gi_taxid(). Pages are shared between processes
+#              and loaded on demand, so lookups allocate nothing.
+# Arguments: gi_taxid_file - table (default: taxonomyDir/gi_taxid.dat)
+#################################################################
+def open_gi_taxid(gi_taxid_file=None):
+    global taxIDByGIStr, taxIDByGITable
+
+    gi_taxid_file = gi_taxid_file or f"{taxonomyDir}/{fileTaxByGI}"
+    if not os.path.exists(gi_taxid_file):
+        raise Exception(f"ERROR: GI to TaxID table {gi_taxid_file} not found. Build it with compile_gi_taxid().")
+
+    with open(gi_taxid_file, 'rb') as f:
+        if os.path.getsize(gi_taxid_file):
+            taxIDByGIStr = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            taxIDByGIStr = b''
+
+    taxIDByGITable = np.frombuffer(taxIDByGIStr, dtype='<u4') if np is not None else None
+
+#################################################################
+# Function: compile_gi_taxid
+# Description: Build the memory-mapped GI to taxID table from a
+#              "GI<TAB>taxID" dump (e.g. NCBI gi_taxid_nucl.dmp).
+#              Entry i of the table is the taxID of GI i.
+# Arguments: gi_taxid_dump - dump file
+#            gi_taxid_file - table (default: taxonomyDir/gi_taxid.dat)
+# Returns: path of the table
+#################################################################
+def compile_gi_taxid(gi_taxid_dump, gi_taxid_file=None, chunk_size=64*1024*1024):
+    if np is None:
+        raise Exception('compile_gi_taxid requires numpy.')
+
+    gi_taxid_file = gi_taxid_file or f"{taxonomyDir}/{fileTaxByGI}"
+    tmp_file = f"{gi_taxid_file}.tmp{os.getpid()}"
+
+    with open(gi_taxid_dump, 'rb') as dump, open(tmp_file, 'wb') as table:
+        size = 0
+        rest = b''
+        while True:
+            block = dump.read(chunk_size)
+            eof = not block
+            # parse whole lines only; carry the partial last line over
+            block = rest + block
+            if not eof:
+                cut = block.rfind(b'\n') + 1
+                block, rest = block[:cut], block[cut:]
+            if not block.strip():
+                if eof:
+                    break
+                continue
+
+            pairs = np.array(block.split(), dtype=np.int64).reshape(-1, 2)
+            gis, taxids = pairs[:, 0], pairs[:, 1]
+
+            # grow the (sparse) table to the largest GI seen so far
+            if gis.max() + 1 > size:
+                size = int(gis.max()) + 1
+                table.truncate(size * 4)
+
+            mapped = np.memmap(tmp_file, dtype='<u4', mode='r+', shape=(size,))
+            mapped[gis] = taxids
+            mapped.flush()
+            del mapped
+
+            if eof:
+                break
+
+    os.rename(tmp_file, gi_taxid_file)
+
+    return gi_taxid_file
 
 def getTaxIDFromAcc(acc):
-    if acc.isdigit():
-        return acc
+    if str(acc).isdigit():
+        return int(acc)
 
-    acc = acc.split('.')[0]
-    
-    if acc in taxIDByAcc:
-        return taxIDByAcc[acc]
-    
-    size = os.path.getsize(f"{taxonomyDir}/{fileTaxByAcc}")
-    accCur = ""
-    taxID = None
-    
-    with open(f"{taxonomyDir}/{fileTaxByAcc}", "r") as ACC:
-        if not ACC:
-            print("ERROR: Sorted accession to taxID list not found. Was updateAccessions.sh run?")
-            exit(1)
-        
-        min_pos = 0
-        max_pos = size
-        while acc != accCur and min_pos < max_pos:
-            pos_new = int((min_pos + max_pos) / 2)
-            
-            ACC.seek(pos_new, 0)
-            
-            if pos_new != min_pos:
-                ACC.readline()  # eat up to newline
-            
-            line = ACC.readline()
-            
-            acc_new, taxID = line.split('\t')
-            
-            if acc > acc_new and accCur != acc_new and acc_new:
-                if acc_new:
-                    pos_new = ACC.tell()
-                
-                min_pos = pos_new
-                
-                if min_pos >= max_pos:
-                    max_pos = min_pos + 1
-            else:
-                max_pos = pos_new
-            
-            accCur = acc_new
-        
-        ACC.close()
-    
-    if accCur != acc:
-        missingAccs[acc] = 1
-        taxID = 0
-    
-    taxIDByAcc[acc] = taxID
-    
-    return taxIDByAcc[acc]
+    taxID = taxonomy.acc2taxid(acc)
+
+    if not taxID:
+        missingAccs[acc.split('.')[0]] = 1
+        return 0
+
+    return _taxid(taxID)
 
 def getAccFromSeqID(seqID):
     acc = seqID.split()[0]
@@ -550,43 +639,67 @@ def load_updated_gi(gi_updated_file):
             updated_gi[old_gi] = new_gi
     return updated_gi
 
-def load_taxonomy(gi_tax_file=None):
-    taxParents = []
-    taxDepths = []
-    taxRanks = []
-    taxNames = []
-    taxonomy_file = f"{taxonomyDir}/taxonomy.tab" 
-    with open(taxonomy_file, 'r') as info:
-        for line in info:
-            line = line.strip()
-            id, depth, parent, rank, name = line.split('\t')
-            taxParents.append(parent)
-            taxDepths.append(depth)
-            taxRanks.append(rank)
-            taxNames.append(name)
-    print("Done parsing taxonomy.tab")  # Replace with appropriate debug statement
-
-    if taxParents[2] == 1:
-        print("Local taxonomy database is out of date. Update using updateTaxonomy.sh.")  # Replace with appropriate error message
-
-    if gi_tax_file and os.path.exists(gi_tax_file):
-        with open(gi_tax_file, 'rb') as f:
-            tax_id_by_gi = pickle.load(f)
-    elif gi_tax_file and not os.path.exists(gi_tax_file) and 'load' in gi_tax_file.lower():
-        gi_tax_data_file = f"{taxonomyDir}/gi_taxid.dat" 
-        with open(gi_tax_data_file, 'rb') as f:
-            tax_id_by_gi = pickle.load(f)
-    return taxParents, taxDepths, taxRanks, taxNames, tax_id_by_gi
+#################################################################
+# Function: loadTaxonomy
+# Description: Load the taxonomy of taxonomyDir (or dbpath) through
+#              taxonomy.py, unless this process has it loaded already.
+# Arguments: gi_tax_file - GI to taxID table to map up front, or
+#                          "preload" for taxonomyDir/gi_taxid.dat
+#            dbpath - taxonomy directory (default: taxonomyDir)
+#################################################################
+def loadTaxonomy(gi_tax_file=None, dbpath=None):
+    global taxonomyDir
+
+    taxonomyDir = dbpath or taxonomyDir
+
+    if not _taxonomyLoaded() or os.path.realpath(taxonomy.taxonomyDir) != os.path.realpath(taxonomyDir):
+        taxonomy.loadTaxonomy(taxonomyDir)
+
+    if gi_tax_file:
+        gi_tax_file = gi_tax_file if os.path.exists(gi_tax_file) else None
+        if gi_tax_file or os.path.exists(f"{taxonomyDir}/{fileTaxByGI}"):
+            open_gi_taxid(gi_tax_file)
+
+load_taxonomy = loadTaxonomy
+
+#################################################################
+# Function: loadUpdatedGI
+# Description: Map old GIs to updated GIs before looking them up.
+# Arguments: gi_updated_file - "old GI<TAB>new GI" table
+#################################################################
+def loadUpdatedGI(gi_updated_file):
+    updatedGI.update(load_updated_gi(gi_updated_file))
 
 def tax_contains(parent, child):
     # Determines if parent is an ancestor of (or equal to) child
+    return taxonomy.taxidContains(str(parent), str(child))
 
-    depth_parent = taxDepths[parent]
+#################################################################
+# Function: set_cache_limits
+# Description: Bound the shared lookup caches (LRU eviction).
+# Arguments: max_entries - maximum number of items per cache
+#            max_bytes - approximate maximum size per cache
+#            (None for both: unbounded)
+#################################################################
+def set_cache_limits(max_entries=None, max_bytes=None):
+    taxonomy.setCacheLimits(max_entries, max_bytes)
 
-    while taxDepths[child] > taxDepths[parent]:
-        child = taxParents[child]
+#################################################################
+# Function: cache_stats
+# Description: Report the shared lookup cache counters.
+# Returns: dict of cache name => entries/bytes/hits/misses/evictions
+#################################################################
+def cache_stats():
+    return taxonomy.cacheStats()
 
-    return parent == child
+#################################################################
+# Function: print_cache_stats
+# Description: Print cache_stats() one line per cache, e.g. at the
+#              end of a run to tune the cache size.
+# Arguments: out - output handle (default: STDERR)
+#################################################################
+def print_cache_stats(out=sys.stderr):
+    taxonomy.printCacheStats(out)
 
 
 ################
@@ -598,8 +711,18 @@ def kt_die(error):
 
 
 def check_taxonomy():
-    if not taxParents:
-        raise Exception('Taxonomy not loaded. "load_taxonomy()" must be called first.')
+    if not _taxonomyLoaded():
+        raise Exception('Taxonomy not loaded. "loadTaxonomy()" must be called first.')
+
+checkTaxonomy = check_taxonomy
+
+
+def _taxonomyLoaded():
+    return taxonomy.taxDaemon is not None or len(taxonomy.taxParents) > 0
+
+
+def _taxid(taxID):
+    return int(taxID) if str(taxID).isdigit() else taxID
 
 
 def taxon_link(tax_id):
@@ -607,8 +730,9 @@ def taxon_link(tax_id):
 
 
 # Usage of the functions
-# load_taxonomy() # Call this function to load the taxonomy data into the global variables
+# loadTaxonomy() # Call this function to load the taxonomy (shared with taxonomy.py)
 # tax_contains(parent, child) # Call this function to check if parent is an ancestor of child
 # kt_die(error) # Call this function to print an error message and exit with error code 1
 # check_taxonomy() # Call this function to check if the taxonomy data has been loaded
 # taxon_link(tax_id) # Call this function to get a link for a given taxon ID
+# compile_gi_taxid(dump) # Call this function once to build gi_taxid.dat from a "GI<TAB>taxID" dump
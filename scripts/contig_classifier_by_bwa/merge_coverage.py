@@ -1,74 +1,44 @@
 #!/usr/bin/env python
 
-# Import required module
+# Merge the classification of sequences (seq_coverage.py report rows, e.g. of the CDS of
+# contigs) into one classification per contig.
+#
+#   merge_coverage.py <ctg_class.csv|-> <contig>
+#   merge_coverage.py -d <delimiter> <ctg_class.csv|->
+#
+# With a contig name, all sequences are merged into it. With a delimiter, the contig of a
+# sequence is its name up to the last delimiter (e.g. "_" for <contig>_<number> CDS names);
+# a sequence name without the delimiter is an error. The rows are merged in one pass, so the
+# input has to be grouped by contig, as seq_coverage.py writes it; only the contig being
+# merged is kept in memory.
+
+# Import required modules
 import sys
+import argparse
+from itertools import groupby
 
-# Define dictionaries to hold the data
-cov = {}      # Dictionary to store coverage data
-length = {}   # Dictionary to store length data
-old_contig = None  # Variable to store the previous contig
+ranks = ("superkingdom", "phylum", "class", "order", "family", "genus", "species", "strain")
+header = "##SEQ\tRANK\tORGANISM\tTAX_ID\tPARENT\tLENGTH\tNUM_HIT\tTOL_HIT_LEN\tTOL_MISM\tAVG_IDT\tLINEAR_LEN\tRANK_LINEAR_LEN\tCOV\tSCALED_COV\tNUM_MERGED\tACC_COV_LEN"
 
-# Get input file and contig from command line arguments
-input_file = sys.argv[1]
-contig = sys.argv[2]
+def contig_of(seq, delimiter):
+    """Contig of a sequence named <contig><delimiter><anything without delimiter>."""
+    contig, sep, rest = seq.rpartition(delimiter)
+    if not sep or not contig:
+        sys.exit(f"[ERROR] Sequence name {seq} has no contig before a \"{delimiter}\".")
+    return contig
 
-# Print header line
-print("##SEQ\tRANK\tORGANISM\tTAX_ID\tPARENT\tLENGTH\tNUM_HIT\tTOL_HIT_LEN\tTOL_MISM\tAVG_IDT\tLINEAR_LEN\tRANK_LINEAR_LEN\tCOV\tSCALED_COV\tNUM_MERGED\tACC_COV_LEN\n")
+def num(value):
+    """Numeric value of a report field; empty fields count as 0."""
+    return int(value) if value else 0
 
-# Open input file for reading
-with open(input_file, 'r') as infile:
-    # Loop through each line in the input file
+def read_rows(infile):
+    """Yield the split report rows of infile, skipping comments."""
+    #SEQ    RANK    ORGANISM    TAX_ID  PARENT  LENGTH  NUM_HIT TOL_HIT_LEN TOL_MISM    AVG_IDT LINEAR_LEN  RANK_LINEAR_LEN COV SCALED_COV  ACC_COV_RGN  ACC_COV_LEN
+    # 0       1        2           3      4       5        6         7         8           9        10              11       12     13           14           15
     for line in infile:
-        # Skip lines starting with '#' (comments)
         if line.startswith('#'):
             continue
-
-    #SEQ    RANK    ORGANISM    TAX_ID  PARENT  LENGTH  NUM_HIT TOL_HIT_LEN TOL_MISM    AVG_IDT LINEAR_LEN  RANK_LINEAR_LEN COV SCALED_COV  ACC_COV_RGN  ACC_COV_LEN
-    # 0       1        2           3      4       5        6         7         8           9        10              11       12     13           14           15
-    
-        # Split the line by tab ('\t') to get individual fields
-        line = line.strip().split('\t')
-        # Extract relevant fields from the line
-        id = line[0]
-        # Create nested dictionaries to store the data
-        cov[contig] = {
-            id: {
-                line[1]: {
-                    line[2]: {
-                        'TAXA_ID': line[3],
-                        'PARENT': line[4],
-                        'LENGTH': line[5],
-                        'NUM_HIT': line[6],
-                        'TOL_HIT_LEN': line[7],
-                        'TOL_MISM': line[8],
-                        'LINEAR_LEN': line[10],
-                        'ACC_COV_LEN': line[15]
-                    }
-                }
-            }
-        }
-        length[contig] = {
-            id: {
-                'LENGTH': line[5]
-            }
-        }
-
-        # Set old_contig to current contig if it's None (i.e., first iteration)
-        if old_contig is None:
-            old_contig = contig
-
-        # Merge coverage data when old_contig is not the same as current contig
-        if old_contig != contig:
-            covergeMerger(old_contig)
-            del cov[old_contig]
-            del length[contig]
-            old_contig = contig
-
-# Close input file
-infile.close()
-
-# Merge coverage data for the last contig
-covergeMerger(old_contig)
+        yield line.rstrip('\r\n').split('\t')
 
 # 1   SEQ = query sequence name
 # 2   RANK = rank name
@@ -86,72 +56,103 @@ covergeMerger(old_contig)
 # 14  SCALED_COV = LINEAR_LEN/RANK_LINEAR_LEN
 # 15  NUM_MERGED = number of sequences merged
 
-def covergeMerger(contig, cov, length):
+def coverage_merger(contig, rows):
+    """
+    Merged report lines of one contig. rows are its split report rows, with the rows of
+    each sequence together; they are added up as they are read.
+    """
     cds_len = 0
     ctg_cov = {}
     r = {}
+    last_id = None
+
+    for temp in rows:
+        # each row of a sequence repeats its length
+        if temp[0] != last_id:
+            cds_len += num(temp[5])
+            last_id = temp[0]
+
+        rank, name = temp[1], temp[2]
+        if (rank, name) not in ctg_cov:
+            ctg_cov[(rank, name)] = {
+                'NUM_CDS': 0,
+                'NUM_HIT': 0,
+                'TOL_HIT_LEN': 0,
+                'LINEAR_LEN': 0,
+                'TOL_MISM': 0,
+                'ACC_COV_LEN': 0
+            }
 
-    for id in cov[contig]:
-        cds_len += length[contig][id]['LENGTH']
-
-        for rank in cov[contig][id]:
-            for name in cov[contig][id][rank]:
-                if contig not in ctg_cov:
-                    ctg_cov[contig] = {}
-                if rank not in ctg_cov[contig]:
-                    ctg_cov[contig][rank] = {}
-                if name not in ctg_cov[contig][rank]:
-                    ctg_cov[contig][rank][name] = {
-                        'NUM_CDS': 0,
-                        'NUM_HIT': 0,
-                        'TOL_HIT_LEN': 0,
-                        'LINEAR_LEN': 0,
-                        'TOL_MISM': 0
-                    }
-
-                cov_ctg_ref = ctg_cov[contig][rank][name]
-                cov_ctg_ref['NUM_CDS'] += 1
-                cov_ctg_ref['PARENT'] = cov[contig][id][rank][name]['PARENT']
-                cov_ctg_ref['TAXA_ID'] = cov[contig][id][rank][name]['TAXA_ID']
-                cov_ctg_ref['NUM_HIT'] += cov[contig][id][rank][name]['NUM_HIT'] or 0
-                cov_ctg_ref['TOL_HIT_LEN'] += cov[contig][id][rank][name]['TOL_HIT_LEN'] or 0
-                cov_ctg_ref['LINEAR_LEN'] += cov[contig][id][rank][name]['LINEAR_LEN']
-                cov_ctg_ref['TOL_MISM'] += cov[contig][id][rank][name]['TOL_MISM'] or 0
-                cov_ctg_ref['ACC_COV_LEN'] += cov[contig][id][rank][name]['ACC_COV_LEN']
-                r[rank] = r.get(rank, 0) + cov[contig][id][rank][name]['LINEAR_LEN']
-
-    rank_order = ["superkingdom", "phylum", "class", "order", "family", "genus", "species", "strain"]
-    for rank in rank_order:
-        for name in sorted(ctg_cov[contig][rank], key=lambda a: ctg_cov[contig][rank][a]["ACC_COV_LEN"], reverse=True):
-            cov_ctg_ref = ctg_cov[contig][rank][name]
-            print("%s\t%s\t%s\t%s\t%s\t%d\t%d\t%d\t%d\t%.4f\t%d\t%d\t%.4f\t%.4f\t%d\t%d" %
+        cov_ctg_ref = ctg_cov[(rank, name)]
+        cov_ctg_ref['NUM_CDS'] += 1
+        cov_ctg_ref['PARENT'] = temp[4]
+        cov_ctg_ref['TAXA_ID'] = temp[3]
+        cov_ctg_ref['NUM_HIT'] += num(temp[6])
+        cov_ctg_ref['TOL_HIT_LEN'] += num(temp[7])
+        cov_ctg_ref['LINEAR_LEN'] += num(temp[10])
+        cov_ctg_ref['TOL_MISM'] += num(temp[8])
+        cov_ctg_ref['ACC_COV_LEN'] += num(temp[15])
+        r[rank] = r.get(rank, 0) + num(temp[10])
+
+    lines = []
+    for rank in ranks:
+        names = [name for (rk, name) in ctg_cov if rk == rank]
+        for name in sorted(names, key=lambda a: ctg_cov[(rank, a)]["ACC_COV_LEN"], reverse=True):
+            cov_ctg_ref = ctg_cov[(rank, name)]
+            lines.append("%s\t%s\t%s\t%s\t%s\t%d\t%d\t%d\t%d\t%.4f\t%d\t%d\t%.4f\t%.4f\t%d\t%d" %
                 (
-                  contig,                                              # 1   SEQ = query sequence name                                        
-                  rank,                                                # 2   RANK = rank name                                                 
-                  name,                                                # 3   ORGANISM = taxonomy name                                         
-                  cov_ctg_ref["TAXA_ID"],                              # 4   TAX_ID = taxonomy id                                             
-                  cov_ctg_ref["PARENT"],                               # 5   PARENT = parent taxonomy name                                    
-                  cds_len,                                             # 6   LENGTH = query sequence name                                     
-                  cov_ctg_ref["NUM_HIT"],                              # 7   NUM_HIT = number of hits                                         
-                  cov_ctg_ref["TOL_HIT_LEN"],                          # 8   TOL_HIT_LEN = total bases of hits                                
-                  cov_ctg_ref["TOL_MISM"],                             # 9   TOL_MISM = total bases of mismatches                             
-                  (cov_ctg_ref["TOL_HIT_LEN"]-cov_ctg_ref["TOL_MISM"])/cov_ctg_ref["TOL_HIT_LEN"],  # 10  AVG_IDT = average hit identity                                   
-                  cov_ctg_ref["LINEAR_LEN"],                           # 11  LINEAR_LEN = linear length of hits                               
+                  contig,                                              # 1   SEQ = query sequence name
+                  rank,                                                # 2   RANK = rank name
+                  name,                                                # 3   ORGANISM = taxonomy name
+                  cov_ctg_ref["TAXA_ID"],                              # 4   TAX_ID = taxonomy id
+                  cov_ctg_ref["PARENT"],                               # 5   PARENT = parent taxonomy name
+                  cds_len,                                             # 6   LENGTH = query sequence name
+                  cov_ctg_ref["NUM_HIT"],                              # 7   NUM_HIT = number of hits
+                  cov_ctg_ref["TOL_HIT_LEN"],                          # 8   TOL_HIT_LEN = total bases of hits
+                  cov_ctg_ref["TOL_MISM"],                             # 9   TOL_MISM = total bases of mismatches
+                  (cov_ctg_ref["TOL_HIT_LEN"]-cov_ctg_ref["TOL_MISM"])/cov_ctg_ref["TOL_HIT_LEN"] if cov_ctg_ref["TOL_HIT_LEN"] else 0,  # 10  AVG_IDT = average hit identity
+                  cov_ctg_ref["LINEAR_LEN"],                           # 11  LINEAR_LEN = linear length of hits
                   r[rank],                                             # 12  RANK_LINEAR_LEN = total linear length of hits in the certain rank
-                  cov_ctg_ref["LINEAR_LEN"]/cds_len,                    # 13  COV = LINEAR_LEN/LENGTH
-                  cov_ctg_ref["LINEAR_LEN"]/r[rank],                     # 14  SCALED_COV = LINEAR_LEN/RANK_LINEAR_LEN
+                  cov_ctg_ref["LINEAR_LEN"]/cds_len if cds_len else 0, # 13  COV = LINEAR_LEN/LENGTH
+                  cov_ctg_ref["LINEAR_LEN"]/r[rank] if r[rank] else 0, # 14  SCALED_COV = LINEAR_LEN/RANK_LINEAR_LEN
                   cov_ctg_ref["NUM_CDS"],                              # 15  NUM_MERGED = number of sequences merged
                   cov_ctg_ref["ACC_COV_LEN"]                           # 16  ACC_COV_LEN = number of merged ACC_COV_LEN
               )
         )
 
-    cov_ctg_ref = ctg_cov[contig]["unclassified"]["unclassified"]
-    print("%s\t%s\t%s\t\t\t%d\t\t\t\t\t%d\t\t%.4f\t\t\t%d" % (
+    cov_ctg_ref = ctg_cov.get(("unclassified", "unclassified"), {'LINEAR_LEN': 0, 'ACC_COV_LEN': 0})
+    lines.append("%s\t%s\t%s\t\t\t%d\t\t\t\t\t%d\t\t%.4f\t\t\t%d" % (
         contig,
         "unclassified",
         "unclassified",
         cds_len,
         cov_ctg_ref['LINEAR_LEN'],
-        cov_ctg_ref['LINEAR_LEN']/cds_len,
+        cov_ctg_ref['LINEAR_LEN']/cds_len if cds_len else 0,
         cov_ctg_ref['ACC_COV_LEN']
     ))
+    return lines
+
+def merge_coverage(infile, out, contig=None, delimiter=None):
+    """
+    Write the merged report of the report rows in infile to out, one contig at a time: all
+    rows into contig, or into the contig named by each sequence (see contig_of) with delimiter.
+    """
+    out.write(header + "\n")
+    for (ctg, rows) in groupby(read_rows(infile), key=lambda temp: contig or contig_of(temp[0], delimiter)):
+        out.writelines(line + "\n" for line in coverage_merger(ctg, rows))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge the classification of sequences into one per contig.")
+    parser.add_argument("input", help="seq_coverage.py report (ctg_class.csv), - for STDIN")
+    parser.add_argument("contig", nargs="?", help="merge all sequences into this contig")
+    parser.add_argument("-d", "--delimiter", help="the contig of a sequence is its name up to the last delimiter")
+    args = parser.parse_args()
+
+    if bool(args.contig) == bool(args.delimiter):
+        parser.error("give either a contig name or a delimiter (-d)")
+
+    if args.input == "-":
+        merge_coverage(sys.stdin, sys.stdout, args.contig, args.delimiter)
+    else:
+        with open(args.input, 'r') as infile:
+            merge_coverage(infile, sys.stdout, args.contig, args.delimiter)
@@ -1,49 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
-from os.path import exists
-from gi2lineage import loadTaxonomy
-import sys
+import os
 import re
-
-def usage():
-    print("""Usage: python gi2lineage.py -i input -t type -p orig_seq
-
-Options:
-  -i, --input=input   input file (required)
-  -t, --type=type     input format: last, blast, sam (default: guess)
-  -p, --orig_seq=file original query sequence file
-  -h, --help          show this help message and exit""").format(sys.argv[0])
-  sys.exit()
-
-parser = argparse.ArgumentParser(description="Process GI to lineage information")
-parser.add_argument("-i", "--input", dest="input", required=True,
-                    help="input file")
-parser.add_argument("-t", "--type", dest="type", default="guess",
-                    help="input format: last, blast, sam (default: guess)")
-parser.add_argument("-p", "--orig_seq", dest="orig_seq",
-                    help="original query sequence file")
-parser.add_argument("-?", "--help", dest="help", action='store_true',
-                    help="show this help message and exit")
-
-args = parser.parse_args()
-
-if args.help or not exists(args.input):
-    usage()
-    exit()
-
-print("Input file: " + args.input)
-
-# Preload taxonomy data
-# loadTaxonomy("preload")
-loadTaxonomy()
-print("Done loading taxonomy data.")
-
-input_file = args.input
-input_format = args.type
-file = args.orig_seq
-
-input_format = "guess" if not input_format else input_format
+import sys
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+from itertools import groupby
+from heapq import heappush, heappop
+from gi2lineage import loadTaxonomy, acc2taxID, getAccFromSeqID, taxid2rank, taxid2rank_taxid
+import taxonomy
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+ranks = ("superkingdom", "phylum", "class", "order", "family", "genus", "species", "strain")
+report_header = "##SEQ\tRANK\tORGANISM\tTAX_ID\tPARENT\tLENGTH\tNUM_HIT\tTOL_HIT_LEN\tTOL_MISM\tAVG_IDT\tLINEAR_LEN\tRANK_LINEAR_LEN\tCOV\tSCALED_COV\tACC_COV_RGN\tACC_COV_LEN"
 
 #############################################################################################################
 ## Support 3 alignment format:
@@ -71,275 +46,452 @@ input_format = "guess" if not input_format else input_format
 #
 #############################################################################################################
 
-seq = {}
-cov = {}
-cnt = 0
-length = {}
+def guess_format(temp):
+    input_type = "guess"
+    if len(temp) == 12 and temp[0].isdigit():
+        input_type = "last"
+    if len(temp) >= 12 and temp[8].isdigit():
+        input_type = "blast"
+    if len(temp) > 13:
+        input_type = "sam"
+    if input_type == "guess":
+        sys.exit("ERROR: Can not recognize input format!")
+    return input_type
+
+def input_format(input_file, input_type="guess"):
+    """
+    input_type, or if it is "guess" the format of the first alignment line of input_file
+    (see guess_format); "bam" for a BGZF-compressed file.
+    """
+    if input_type.lower() != "guess":
+        return input_type
+    with open(input_file, 'rb') as f:
+        if f.peek(2)[:2] == b'\x1f\x8b':
+            return "bam"
+        for line in f:
+            line = line.decode()
+            if line.startswith('#') or line.startswith('@'):
+                continue
+            return guess_format(line.rstrip('\r\n').split('\t'))
+    return input_type
+
+def parse_hit(line, temp, input_type, length):
+    """Return (sid, qid, qlen, qstart, qend, dist) of one alignment line."""
+    if input_type.lower().startswith("last"):
+        qlen = length[temp[6]] if temp[6] in length else int(temp[10])
+        # LAST use 0-based position
+        return temp[1], temp[6], qlen, int(temp[7]) + 1, int(temp[7]) + int(temp[8]), 1
+    elif input_type.lower().startswith("blast"):
+        if temp[0] in length:
+            qlen = length[temp[0]]
+        elif len(temp) > 12:
+            qlen = int(temp[12])
+        else:
+            sys.exit("No query sequence found.")
+        return temp[1], temp[0], qlen, int(temp[6]), int(temp[7]), int(temp[4]) + int(temp[5])
+    elif input_type.lower().startswith("sam"):
+        nm = re.search(r'NM:i:(\d+)', line)
+        if not length.get(temp[0]):
+            length[temp[0]] = len(temp[9])
+        qlen = length[temp[0]]
+        clip5 = re.search(r'^(\d+)[SH]', temp[5])
+        clip3 = re.search(r'(\d+)[SH]$', temp[5])
+        clip5 = int(clip5.group(1)) if clip5 else 0
+        clip3 = int(clip3.group(1)) if clip3 else 0
+
+        if 'r' in temp[5]:
+            clip5, clip3 = clip3, clip5
+
+        return temp[2], temp[0], qlen, clip5 + 1, qlen - clip3, int(nm.group(1)) if nm else 0
+    else:
+        sys.exit("ERROR: unknown input format.")
+
+def load_hits(lines, input_type, length):
+    """
+    Read alignment lines. Returns (seq, cov, cnt, input_type): the hits as
+    seq[qid][taxid]["qstart..qend"] = distance and, in input order, cov[qid][cnt][taxid] =
+    "qstart..qend". length is updated with the query lengths.
+    """
+    seq = {}
+    cov = {}
+    cnt = 0
+
+    for line in lines:
+        if line.startswith('#') or line.startswith('@'):
+            continue
+        temp = line.rstrip('\r\n').split('\t')
 
-if os.path.exists(file):
-    length = readFastaSeq(file)
+        if input_type == "guess":
+            input_type = guess_format(temp)
+            print("Guess input format: " + input_type + ".", file=sys.stderr)
+
+        sid, qid, qlen, qstart, qend, dist = parse_hit(line, temp, input_type, length)
 
-    print("Done loading original " + str(len(length.keys())) + " sequences.")
-    
-with open(input_file, 'r') as input:
-    for line in input:
-        if line.startswith('#'):
-            continue
-        
-        temp = line.rstrip().split('\t')
-        
-        if type == "guess":
-            if len(temp) == 12 and temp[0].isdigit():
-                type = "last"
-            elif len(temp) >= 12 and temp[8].isdigit():
-                type = "blast"
-            elif len(temp) > 13:
-                type = "sam"
-            else:
-                raise ValueError("ERROR: Can not recognize input format!")
-            
-            print("Guess input format: " + type + ".")
-        
-        sid, qid, qlen, qstart, qend, dist = "", "", 0, 0, 0, 1
-        
-        if type.lower().startswith("last"):
-            if temp[6] in length:
-                len = length[temp[6]]
-            else:
-                len = temp[10]
-            
-            # LAST use 0-based position
-            sid = temp[1]
-            qid = temp[6]
-            qlen = len
-            qstart = int(temp[7]) + 1
-            qend = int(temp[7]) + int(temp[8])
-        elif type.lower().startswith("blast"):
-            if temp[0] in length:
-                len = length[temp[0]]
-            else:
-                raise ValueError("No query sequence found.")
-            
-            sid = temp[1]
-            qid = temp[0]
-            qlen = len
-            qstart = int(temp[6])
-            qend = int(temp[7])
-            dist = int(temp[4]) + int(temp[5])
-        elif type.lower().startswith("sam"):
-            nm = re.search(r'NM:i:(\d+)', line)
-            if nm:
-                nm = int(nm.group(1))
-            length.setdefault(temp[0], len(temp[9]))
-            len = length[temp[0]]
-            clip5 = int(re.findall(r'^(\d+)[SH]', temp[5])[0]) if re.findall(r'^(\d+)[SH]', temp[5]) else 0
-            clip3 = int(re.findall(r'(\d+)[SH]$', temp[5])[0]) if re.findall(r'(\d+)[SH]$', temp[5]) else 0
-            
-            if 'r' in temp[5]:
-                clip5, clip3 = clip3, clip5
-            
-            sid = temp[2]
-            qid = temp[0]
-            qlen = len
-            qstart = clip5 + 1
-            qend = len - clip3
-            dist = nm
-        else:
-            raise ValueError("ERROR: unknown input format.")
-        
         acc = getAccFromSeqID(sid)
         taxid = acc2taxID(acc)
         length[qid] = qlen
-        seq.setdefault(qid, {}).setdefault(taxid, {}).setdefault(str(qstart) + ".." + str(qend), dist)
-        cov.setdefault(qid, {}).setdefault(cnt, {}).setdefault(taxid, str(qstart) + ".." + str(qend))
-        
+        seq.setdefault(qid, {}).setdefault(taxid, {})[f"{qstart}..{qend}"] = dist
+        cov.setdefault(qid, {})[cnt] = {taxid: f"{qstart}..{qend}"}
+
         cnt += 1
 
-print("##SEQ\tRANK\tORGANISM\tTAX_ID\tPARENT\tLENGTH\tNUM_HIT\tTOL_HIT_LEN\tTOL_MISM\tAVG_IDT\tLINEAR_LEN\tRANK_LINEAR_LEN\tCOV\tSCALED_COV\tACC_COV_RGN\tACC_COV_LEN")
-
-# 1  SEQ = query sequence name
-# 2  RANK = rank name
-# 3  ORGANISM = taxonomy name
-# 4  TAX_ID = taxonomy id
-# 5  PARENT = parent taxonomy name
-# 6  LENGTH = query sequence name
-# 7  NUM_HIT = number of hits
-# 8  TOL_HIT_LEN = total bases of hits
-# 9  TOL_MISM = total bases of mismatches
-# 10 AVG_IDT = average hit identity
-# 11 LINEAR_LEN = linear length of hits
-# 12 RANK_LINEAR_LEN = total linear length of hits in the certain rank
-# 13 COV = LINEAR_LEN/LENGTH
-# 14 SCALED_COV = LINEAR_LEN/RANK_LINEAR_LEN
-
-# Loop over the ranks
-for rank in ["superkingdom","phylum","class","order","family","genus","species","strain"]:
-    for pname in sorted(seq.keys()):
-        for taxid in seq[pname].keys():
-            name = taxid2rank(taxid, rank)
-
-            # Upper taxa
-            upname = taxid2rank(taxid, upper_level)
-            upname = "NA" if upname is None else upname
-            name = f"{upname} {rank}" if name is None else name
-
-            if rank == "strain":
-                p[rank][name] = {}
-                p[rank][name]["UP_RANK"] = upname
-                p[rank][name]["TAXO_ID"] = taxid
-            else:
-                p[rank][name] = {}
-                p[rank][name]["UP_RANK"] = upname
-                p[rank][name]["TAXO_ID"] = taxid2rank_taxid(taxid, rank)
-
-            pcov = p[rank][name].get("LINEAR_LEN", "0" * length[pname])
-
-            for region in seq[pname][taxid].keys():
-                qs, qe = map(int, region.split(".."))
-                end = len(pcov)
-                nm = seq[pname][taxid][region]
-
-                # Update linear length
-                str_ = "0" * (qs - 1) + "1" * (qe - qs + 1) + "0" * (end - qe)
-                pcov = "".join(["1" if c1 == "1" or c2 == "1" else "0" for c1, c2 in zip(pcov, str_)])
-                # Total mapped
-                p[rank][name].setdefault("TOL_HIT_LEN", 0)
-                p[rank][name]["TOL_HIT_LEN"] += qe - qs + 1
-                # Number of hits
-                p[rank][name].setdefault("NUM_HIT", 0)
-                p[rank][name]["NUM_HIT"] += 1
-                # Distance
-                p[rank][name].setdefault("TOL_MISM", 0)
-                p[rank][name]["TOL_MISM"] += nm
-
-            p[rank][name]["AVG_IDT"] = (p[rank][name]["TOL_HIT_LEN"] - p[rank][name]["TOL_MISM"]) / p[rank][name]["TOL_HIT_LEN"]
-            p[rank][name]["LINEAR_LEN"] = pcov
-
-            for name in p[rank].keys():
-                p[rank][name]['LINEAR_LEN'] = p[rank][name]['LINEAR_LEN'].replace('0', '')
-                sum = len(p[rank][name]['LINEAR_LEN'])
-
-                p[rank][name]['LINEAR_LEN'] = sum
-                r[rank]['TOL_LINEAR_LEN'] = r[rank].get('TOL_LINEAR_LEN', 0)
-                r[rank]['TOL_LINEAR_LEN'] += sum
-
-            # accumulated coverage
-            acc_cov = '0' * length[pname]
-            map = {}
-            map[48] = 'unclassified'
-            mid_ascii = 49
-
-            for cnt in sorted(cov[pname].keys()):
-                for taxid in cov[pname][cnt].keys():
-                    name = taxid2rank(taxid, rank)
-                    # upper taxa
-                    upname = taxid2rank(taxid, upper_level)
-                    upname = 'NA' unless upname
-                    name = f'{upname} {rank}' unless name
-
-                    if name not in map:
-                        map[name] = mid_ascii
-                        map[mid_ascii] = name
-                        mid_ascii += 1
-
-                    region = cov[pname][cnt][taxid]
-                    acc_cov = accCov(acc_cov, chr(map[name]), region)
-
-            csum = accCovSummary(acc_cov, map)
-            for name in csum.keys():
-                p[rank][name]['ACC_COV_RGN'] = ';'.join(csum[name])
-                len = 0
-                for rgn in csum[name]:
-                    qs, qe = map(int, rgn.split('..'))
-                    len += qe - qs + 1
-                p[rank][name]['ACC_COV_LEN'] = len
-
-            upper_level = rank
-
-            for rank in ("superkingdom","phylum","class","order","family","genus","species","strain"):
-                for name in sorted(p[rank], key=lambda x: p[rank][x]['ACC_COV_LEN'], reverse=True):
-                    if name == "unclassified":
-                        continue
-                    pref = p[rank][name]
-                    #sequence rank orig taxid parent #hit tol_mapped_len linear_len tol_linear_len coverage prob
-                    print("%s\t%s\t%s\t%s\t%s\t%d\t%d\t%d\t%d\t%.4f\t%d\t%d\t%.4f\t%.4f\t%s\t%d" % (
-                        pname,
-                        rank,
-                        name,
-                        pref['TAXO_ID'],
-                        pref['UP_RANK'],
-                        length[pname],
-                        pref['NUM_HIT'],
-                        pref['TOL_HIT_LEN'],
-                        pref['TOL_MISM'],
-                        pref['AVG_IDT'],
-                        pref['LINEAR_LEN'],
-                        r[rank]['TOL_LINEAR_LEN'],
-                        pref['LINEAR_LEN']/length[pname],
-                        pref['LINEAR_LEN']/r[rank]['TOL_LINEAR_LEN'],
-                        pref['ACC_COV_RGN'],
-                        pref['ACC_COV_LEN']
-                    ))
-                pref = p["superkingdom"]["unclassified"]
-                print("%s\t%s\t%s\t\t\t%d\t\t\t\t\t%d\t\t%.4f\t\t%s\t%d" % (
-                    pname,
-                    "unclassified",
-                    "unclassified",
-                    length[pname],
-                    pref['ACC_COV_LEN'],
-                    pref['ACC_COV_LEN']/length[pname],
-                    pref['ACC_COV_RGN'],
-                    pref['ACC_COV_LEN']
-                ))
-
-def acc_cov(acc_cov, id, region):
-    qs, qe = map(int, region.split('..'))
-    while '0' in acc_cov:
-        us = acc_cov.index('0') + 1
-        ue = us + acc_cov[us:].index('1') - 1
-        if us > qe:
-            break
-        if qs >= us and qe <= ue:
-            # whole overlapping
-            length = qe - qs + 1
-            acc_cov = acc_cov[:qs-1] + id * length + acc_cov[qe:]
-        elif us >= qs and qe >= us and ue >= qe:
-            # cov overlapping 3" 0s
-            length = ue - qs + 1
-            acc_cov = acc_cov[:qs-1] + id * length + acc_cov[ue:]
-        elif qs >= us and qs <= ue and qe > ue:
-            # overlapping 5"
-            length = qe - us + 1
-            acc_cov = acc_cov[:us-1] + id * length + acc_cov[qe:]
-    return acc_cov
-
-
-def acc_cov_summary(acc_cov, tax_map):
-    c = {}
+    return seq, cov, cnt, input_type
+
+def merge_intervals(regions):
+    """Union of 1-based, inclusive (start, end) regions as sorted, disjoint [start, end] lists."""
+    merged = []
+    for (qs, qe) in sorted(regions):
+        if qe < qs:
+            continue
+        if merged and qs <= merged[-1][1] + 1:
+            if qe > merged[-1][1]:
+                merged[-1][1] = qe
+        else:
+            merged.append([qs, qe])
+    return merged
+
+def linear_length(regions):
+    """Number of bases covered by at least one of regions."""
+    return sum(qe - qs + 1 for (qs, qe) in merge_intervals(regions))
+
+# the same taxa come back for contig after contig: walk each lineage once per process
+@lru_cache(maxsize=None)
+def rank_name(taxid, rank, upper_level):
+    """Name of taxid on rank ("<upper name> <rank>" if the lineage has no such rank) and the upper name."""
+    name = taxid2rank(taxid, rank)
+    # upper taxa
+    upname = taxid2rank(taxid, upper_level) or "NA"
+    return name or f"{upname} {rank}", upname
+
+@lru_cache(maxsize=None)
+def rank_taxid(taxid, rank):
+    return taxid if rank == "strain" else taxid2rank_taxid(taxid, rank)
+
+def classify_seq(pname, hits, cov_hits, seq_len):
+    """
+    Coverage of sequence pname (seq_len bp) on each rank by its hits (seq[pname]) and ordered
+    hit list (cov[pname]). Returns the report lines.
+    """
+    p = {}
+    r = {}
+    upper_level = "root"
+
+    # which hit painted which bases does not depend on the rank: paint once
+    painted_hits = [hit for cnt in sorted(cov_hits) for hit in cov_hits[cnt].items()]
+    segments = acc_cov([tuple(map(int, region.split('..'))) for (taxid, region) in painted_hits], seq_len)
+
+    for rank in ranks:
+        p[rank] = {}
+        regions = {}
+        for taxid in hits:
+            name, upname = rank_name(taxid, rank, upper_level)
+
+            pref = p[rank].setdefault(name, {"NUM_HIT": 0, "TOL_HIT_LEN": 0, "TOL_MISM": 0})
+            pref["UP_RANK"] = upname
+            pref["TAXO_ID"] = rank_taxid(taxid, rank)
+
+            for (region, nm) in hits[taxid].items():
+                qs, qe = map(int, region.split('..'))
+                # linear length: the union of the regions, taken once all hits are in
+                regions.setdefault(name, []).append((qs, qe))
+                # total mapped
+                pref["TOL_HIT_LEN"] += qe - qs + 1
+                # number of hits
+                pref["NUM_HIT"] += 1
+                # distance
+                pref["TOL_MISM"] += nm or 0
+            pref["AVG_IDT"] = (pref["TOL_HIT_LEN"] - pref["TOL_MISM"]) / pref["TOL_HIT_LEN"] if pref["TOL_HIT_LEN"] else 0
+
+        r[rank] = 0
+        for name in p[rank]:
+            p[rank][name]["LINEAR_LEN"] = linear_length(regions[name])
+            r[rank] += p[rank][name]["LINEAR_LEN"]
+
+        # accumulated coverage: each base goes to the first hit covering it
+        rank_names = dict((taxid, rank_name(taxid, rank, upper_level)[0]) for taxid in hits)
+        names = [rank_names[taxid] for (taxid, region) in painted_hits]
+        csum = acc_cov_summary(segments, names)
+        for name in csum:
+            pref = p[rank].setdefault(name, {})
+            pref["ACC_COV_RGN"] = ";".join(f"{qs}..{qe}" for (qs, qe) in csum[name])
+            pref["ACC_COV_LEN"] = sum(qe - qs + 1 for (qs, qe) in csum[name])
+
+        upper_level = rank
+
+    lines = []
+    for rank in ranks:
+        for name in sorted(p[rank], key=lambda x: p[rank][x].get("ACC_COV_LEN", 0), reverse=True):
+            if name == "unclassified":
+                continue
+            pref = p[rank][name]
+            # sequence rank orig taxid parent #hit tol_mapped_len linear_len tol_linear_len coverage prob
+            lines.append("%s\t%s\t%s\t%s\t%s\t%d\t%d\t%d\t%d\t%.4f\t%d\t%d\t%.4f\t%.4f\t%s\t%d" % (
+                pname,
+                rank,
+                name,
+                pref["TAXO_ID"],
+                pref["UP_RANK"],
+                seq_len,
+                pref["NUM_HIT"],
+                pref["TOL_HIT_LEN"],
+                pref["TOL_MISM"],
+                pref["AVG_IDT"],
+                pref["LINEAR_LEN"],
+                r[rank],
+                pref["LINEAR_LEN"] / seq_len if seq_len else 0,
+                pref["LINEAR_LEN"] / r[rank] if r[rank] else 0,
+                pref.get("ACC_COV_RGN", ""),
+                pref.get("ACC_COV_LEN", 0)
+            ))
+
+    pref = p["superkingdom"].get("unclassified", {})
+    lines.append("%s\t%s\t%s\t\t\t%d\t\t\t\t\t%d\t\t%.4f\t\t%s\t%d" % (
+        pname,
+        "unclassified",
+        "unclassified",
+        seq_len,
+        pref.get("ACC_COV_LEN", 0),
+        pref.get("ACC_COV_LEN", 0) / seq_len if seq_len else 0,
+        pref.get("ACC_COV_RGN", ""),
+        pref.get("ACC_COV_LEN", 0)
+    ))
+
+    return lines
+
+def acc_cov(regions, seq_len):
+    """
+    Paint bases 1..seq_len first come, first painted: each base goes to the first of regions
+    (1-based, inclusive (start, end) hits in input order) that covers it. Returns the painted
+    segments as (start, end, k), k the index of the painting region or -1 for unpainted bases,
+    sorted by start and tiling 1..seq_len. One sweep over the hit starts with a heap of the
+    hits covering the current base, O(hits log hits) however the hits overlap.
+    """
+    starts = sorted((max(qs, 1), k, min(qe, seq_len)) for (k, (qs, qe)) in enumerate(regions) if min(qe, seq_len) >= max(qs, 1))
+    covering = []
+    segments = []
+    pos = 1
+    i = 0
+
+    while pos <= seq_len:
+        while i < len(starts) and starts[i][0] <= pos:
+            heappush(covering, (starts[i][1], starts[i][2]))
+            i += 1
+        # hits that ended before pos
+        while covering and covering[0][1] < pos:
+            heappop(covering)
+
+        # the first hit covering pos paints until it ends or an earlier hit starts
+        next_start = starts[i][0] if i < len(starts) else seq_len + 1
+        if covering:
+            k, end = covering[0]
+            end = min(end, next_start - 1)
+        else:
+            k, end = -1, next_start - 1
+
+        if segments and segments[-1][2] == k:
+            segments[-1] = (segments[-1][0], end, k)
+        else:
+            segments.append((pos, end, k))
+        pos = end + 1
+
+    return segments
+
+def acc_cov_summary(segments, names):
+    """
+    Run-length encode painted segments (see acc_cov) by the names of their hits (names[k];
+    "unclassified" for unpainted bases) in one pass. Returns {name: [(start, end), ...]}.
+    """
     csum = {}
-    for match in re.findall(r'(.)\1*', acc_cov):
-        qs, qe = acc_cov.index(match) + 1, acc_cov.index(match) + len(match)
-        tax = tax_map[ord(match)]
-        prev_end = int(csum[tax][-1].split('..')[1]) if csum.get(tax) else None
-        if prev_end is not None and prev_end + 1 == qs:
-            csum[tax][-1] = csum[tax][-1].replace('..' + str(prev_end), '..' + str(qe))
+    last = None
+    for (qs, qe, k) in segments:
+        name = names[k] if k >= 0 else "unclassified"
+        if name == last:
+            csum[name][-1] = (csum[name][-1][0], qe)
         else:
-            csum.setdefault(tax, []).append(str(qs) + '..' + str(qe))
+            csum.setdefault(name, []).append((qs, qe))
+        last = name
     return csum
 
+#############################################################################################################
+## Parallel classification of SAM files
+#############################################################################################################
+#
+# classify_sam() reads a SAM file once (bwa writes the hits of a contig together) and cuts it into
+# shards of about shard_lines lines that never split a contig. A pool of worker processes classifies
+# the shards; they share the one taxonomy loaded in the parent (taxonomy.TaxonomyDB). Reports are
+# written in input contig order while the workers run, with a bounded number of shards in flight.
+
+def sam_lines(source, fasta=None):
+    """
+    Yield the alignment lines of SAM or BAM source: a file name, "-" for STDIN or a binary
+    stream such as the stdout of bwa mem. Unmapped queries are written to fasta as they
+    pass, if given. SAM text (with or without a header) is read as is; BAM files are read
+    through pysam.
+    """
+    f = source if not isinstance(source, str) else sys.stdin.buffer if source == "-" else open(source, 'rb')
+    try:
+        if f.peek(2)[:2] == b'\x1f\x8b':
+            yield from bam_lines(source, fasta)
+            return
+        for line in f:
+            line = line.decode()
+            if line.startswith('@'):
+                continue
+            if fasta:
+                temp = line.rstrip('\r\n').split('\t', 11)
+                if int(temp[1]) & 4:
+                    fasta.write(f">{temp[0]}\n{temp[9]}\n")
+            yield line
+    finally:
+        if f is not source and f is not sys.stdin.buffer:
+            f.close()
+
+def bam_lines(bam_file, fasta=None):
+    """sam_lines() of a BAM file."""
+    if pysam is None:
+        sys.exit("[ERROR] BAM input requires pysam.")
+    if not isinstance(bam_file, str) or bam_file == "-":
+        sys.exit("[ERROR] BAM input has to be a file, not a stream.")
+    with pysam.AlignmentFile(bam_file, 'rb', check_sq=False) as bam:
+        for rec in bam:
+            if rec.is_unmapped and fasta:
+                fasta.write(f">{rec.query_name}\n{rec.query_sequence or '*'}\n")
+            yield rec.to_string() + "\n"
+
+def sam_shards(lines, shard_lines=20000):
+    """Yield SAM lines in lists of about shard_lines lines, keeping the lines of a contig together."""
+    shard = []
+    ctg = None
+    for line in lines:
+        if line.startswith('@') or line.startswith('#'):
+            continue
+        name = line.split('\t', 1)[0]
+        if name != ctg and len(shard) >= shard_lines:
+            yield shard
+            shard = []
+        ctg = name
+        shard.append(line)
+    if shard:
+        yield shard
+
+def unclassified_line(name, seq_len):
+    """Report line of a contig without hits."""
+    return f"{name}\tunclassified\tunclassified\t\t\t{seq_len}\t\t\t\t\t0\t\t0\t\t\t{seq_len}"
+
+def classify_shard(lines):
+    """
+    Report lines of the contigs in a shard of SAM lines, in input order. Unmapped contigs
+    are reported as unclassified.
+    """
+    report = []
+    for (name, group) in groupby(lines, key=lambda line: line.split('\t', 1)[0]):
+        group = list(group)
+        mapped = [line for line in group if not int(line.split('\t', 2)[1]) & 4]
+        if not mapped:
+            report.append(unclassified_line(name, len(group[0].split('\t', 10)[9].rstrip('\r\n'))))
+            continue
+        length = {}
+        seq, cov, cnt, input_type = load_hits(mapped, "sam", length)
+        for pname in seq:
+            report.extend(classify_seq(pname, seq[pname], cov[pname], length[pname]))
+    return report
+
+def classify_sam(lines, out, threads=1, dbpath=None, shard_lines=20000):
+    """
+    Classify the contigs of SAM lines (a file, a pipe or sam_lines()) and write the report,
+    header first, to out. Unmapped contigs are reported as unclassified. With threads > 1 the shards go to a pool of that many worker processes.
+    """
+    out.write(report_header + "\n")
+    shards = sam_shards(lines, shard_lines)
+
+    if threads <= 1:
+        loadTaxonomy(dbpath=dbpath)
+        for shard in shards:
+            out.writelines(line + "\n" for line in classify_shard(shard))
+        return
+
+    db = taxonomy.TaxonomyDB(dbpath or taxonomy.taxonomyDir, freeze=True)
+    with multiprocessing.Pool(threads, initializer=db.initWorker) as pool:
+        pending = deque()
+        for shard in shards:
+            pending.append(pool.apply_async(classify_shard, (shard,)))
+            if len(pending) >= 2 * threads:
+                out.writelines(line + "\n" for line in pending.popleft().get())
+        while pending:
+            out.writelines(line + "\n" for line in pending.popleft().get())
 
 def read_fasta_seq(seq_file):
-    hash = {}
+    lengths = {}
+    seq_id = None
     with open(seq_file) as fh:
         for line in fh:
             line = line.strip()
-            if not line:
-                continue
             if line.startswith('>'):
-                id = line[1:].split()[0]
-                seq = next(fh).strip()
-                length = len(seq)
-                hash[id] = length
-    return hash
-
-
+                seq_id = line[1:].split()[0] if len(line) > 1 else None
+                if seq_id:
+                    lengths[seq_id] = 0
+            elif seq_id:
+                lengths[seq_id] += len(line)
+    return lengths
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the coverage of each query sequence by the taxa of its hits.")
+    parser.add_argument("-i", "--input", required=True, help="alignments in LAST tab, BLAST m8, SAM or BAM (needs pysam) format")
+    parser.add_argument("-t", "--type", default="guess", help="input format: last, blast, sam, bam (default: guess)")
+    parser.add_argument("-p", "--orig_seq", help="original query sequence file")
+    parser.add_argument("-n", "--threads", type=int, default=1, help="classify SAM input in this many worker processes (default: 1)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        parser.error("input file not found: " + args.input)
+
+    print("Input file: " + args.input, file=sys.stderr)
+
+    input_type = input_format(args.input, args.type)
+    if args.type.lower() == "guess" and input_type != args.type:
+        print("Guess input format: " + input_type + ".", file=sys.stderr)
+
+    # SAM and BAM are classified contig by contig, in worker processes with -n
+    sam = input_type.lower() == "bam" or input_type.lower().startswith("sam")
+    if args.threads > 1 and (not sam or args.orig_seq):
+        parser.error("-n/--threads above 1 needs SAM or BAM input and no -p/--orig_seq")
+    if input_type.lower() == "bam" or args.threads > 1:
+        classify_sam(sam_lines(args.input), sys.stdout, args.threads)
+        return
+
+    # Preload taxonomy data
+    loadTaxonomy()
+    print("Done loading taxanomy data.", file=sys.stderr)
+
+    length = {}
+    if args.orig_seq and os.path.exists(args.orig_seq):
+        length = read_fasta_seq(args.orig_seq)
+        print("Done loading original " + str(len(length)) + " sequences.", file=sys.stderr)
+
+    with open(args.input) as f:
+        seq, cov, cnt, input_type = load_hits(f, input_type, length)
+    print(f"Done loading {cnt} {input_type} hits.", file=sys.stderr)
+
+    print(report_header)
+
+    # 1  SEQ = query sequence name
+    # 2  RANK = rank name
+    # 3  ORGANISM = taxonomy name
+    # 4  TAX_ID = taxonomy id
+    # 5  PARENT = parent taxonomy name
+    # 6  LENGTH = query sequence name
+    # 7  NUM_HIT = number of hits
+    # 8  TOL_HIT_LEN = total bases of hits
+    # 9  TOL_MISM = total bases of mismatches
+    # 10 AVG_IDT = average hit identity
+    # 11 LINEAR_LEN = linear length of hits
+    # 12 RANK_LINEAR_LEN = total linear length of hits in the certain rank
+    # 13 COV = LINEAR_LEN/LENGTH
+    # 14 SCALED_COV = LINEAR_LEN/RANK_LINEAR_LEN
+
+    for pname in sorted(seq):
+        for line in classify_seq(pname, seq[pname], cov[pname], length[pname]):
+            print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+binDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, binDir)
+sys.path.insert(0, binDir + "/../microbial_profiling/script")
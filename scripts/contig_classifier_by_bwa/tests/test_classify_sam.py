@@ -0,0 +1,100 @@
+import io
+import random
+import sys
+
+import pytest
+
+import seq_coverage
+
+# taxid: (parent, rank, name)
+tree = {
+    1: (1, "no rank", "root"),
+    131567: (1, "no rank", "cellular organisms"),
+    2: (131567, "superkingdom", "Bacteria"),
+    1224: (2, "phylum", "Pseudomonadota"),
+    1236: (1224, "class", "Gammaproteobacteria"),
+    91347: (1236, "order", "Enterobacterales"),
+    543: (91347, "family", "Enterobacteriaceae"),
+    561: (543, "genus", "Escherichia"),
+    562: (561, "species", "Escherichia coli"),
+    83333: (562, "strain", "Escherichia coli K-12"),
+    620: (543, "genus", "Shigella"),
+    623: (620, "species", "Shigella flexneri"),
+    1239: (2, "phylum", "Bacillota"),
+    1386: (1239, "genus", "Bacillus"),
+    1423: (1386, "species", "Bacillus subtilis"),
+}
+accessions = {"NC_000913": 83333, "NC_004337": 623, "NC_000964": 1423, "NC_000001": 562}
+
+@pytest.fixture
+def dbpath(tmp_path):
+    path = tmp_path / "taxonomy"
+    path.mkdir()
+    with open(path / "nodes.dmp", "w") as f:
+        for (tid, (parent, rank, name)) in tree.items():
+            f.write(f"{tid}\t|\t{parent}\t|\t{rank}\t|\t\t|\t0\t|\n")
+    with open(path / "names.dmp", "w") as f:
+        for (tid, (parent, rank, name)) in tree.items():
+            f.write(f"{tid}\t|\t{name}\t|\t\t|\tscientific name\t|\n")
+    (path / "merged.dmp").write_text("")
+    (path / "accession2taxid.tsv").write_text("".join(f"{acc}\t{tid}\n" for (acc, tid) in sorted(accessions.items())))
+    return str(path)
+
+def random_sam(rng, contigs):
+    """SAM lines of contigs with 0 to 4 hits each (unmapped if none), grouped by contig."""
+    lines = []
+    for c in range(contigs):
+        seq = "".join(rng.choice("ACGT") for _ in range(rng.randint(20, 60)))
+        hits = rng.randint(0, 4)
+        if not hits:
+            lines.append(f"ctg{c}\t4\t*\t0\t0\t*\t*\t0\t0\t{seq}\t*\n")
+        for h in range(hits):
+            clip5 = rng.randint(0, len(seq) // 2)
+            clip3 = rng.randint(0, len(seq) - clip5 - 1)
+            cigar = (f"{clip5}S" if clip5 else "") + f"{len(seq) - clip5 - clip3}M" + (f"{clip3}S" if clip3 else "")
+            acc = rng.choice(sorted(accessions))
+            lines.append(f"ctg{c}\t{256 if h else 0}\t{acc}.1\t{rng.randint(1, 1000)}\t60\t{cigar}\t*\t0\t0\t{'*' if h else seq}\t*\tNM:i:{rng.randint(0, 3)}\n")
+    return lines
+
+def classify(lines, **kwargs):
+    out = io.StringIO()
+    seq_coverage.classify_sam(iter(lines), out, **kwargs)
+    return out.getvalue()
+
+@pytest.mark.parametrize("threads,shard_lines", [(2, 1), (3, 7), (4, 20000)])
+def test_pool_classification_matches_serial(dbpath, threads, shard_lines):
+    lines = random_sam(random.Random(threads), 60)
+    serial = classify(lines, threads=1, dbpath=dbpath, shard_lines=shard_lines)
+
+    contigs = [line.split("\t", 1)[0] for line in serial.splitlines()[1:]]
+    assert list(dict.fromkeys(contigs)) == [f"ctg{c}" for c in range(60)]
+    assert "\tspecies\tEscherichia coli\t562\t" in serial
+    assert classify(lines, threads=threads, dbpath=dbpath, shard_lines=shard_lines) == serial
+
+@pytest.fixture
+def run_main(monkeypatch):
+    """Run seq_coverage.py with arguments; returns the threads classify_sam() was called with."""
+    calls = []
+    monkeypatch.setattr(seq_coverage, "classify_sam", lambda lines, out, threads=1, **kwargs: calls.append(threads))
+
+    def run(*argv):
+        monkeypatch.setattr(sys, "argv", ["seq_coverage.py"] + list(argv))
+        seq_coverage.main()
+        return calls
+
+    return run
+
+def test_main_pools_guessed_sam_input(tmp_path, run_main):
+    sam = tmp_path / "hits.sam"
+    sam.write_text("@HD\tVN:1.6\n" + "".join(line.rstrip("\n") + "\tMD:Z:20\tAS:i:20\tXS:i:0\n" for line in random_sam(random.Random(1), 5)))
+
+    assert seq_coverage.input_format(str(sam)) == "sam"
+    assert run_main("-i", str(sam), "-n", "4") == [4]
+
+def test_main_rejects_threads_it_cannot_use(tmp_path, run_main):
+    blast = tmp_path / "hits.m8"
+    blast.write_text("ctg1\tNC_000913.1\t99.0\t100\t1\t0\t1\t100\t5\t104\t1e-50\t180\n")
+
+    assert seq_coverage.input_format(str(blast)) == "blast"
+    with pytest.raises(SystemExit):
+        run_main("-i", str(blast), "-n", "4")
@@ -0,0 +1,64 @@
+import random
+from itertools import groupby
+
+import pytest
+
+import seq_coverage
+
+def random_regions(rng, n, seq_len):
+    """n 1-based, inclusive hits on a seq_len bp sequence, some empty, some past its end."""
+    regions = []
+    for _ in range(n):
+        qs = rng.randint(-2, seq_len + 2)
+        regions.append((qs, qs + rng.randint(-3, seq_len // 3)))
+    return regions
+
+def covered_bases(regions):
+    return set(pos for (qs, qe) in regions for pos in range(qs, qe + 1))
+
+@pytest.mark.parametrize("seed", range(50))
+def test_merge_intervals_matches_covered_bases(seed):
+    rng = random.Random(seed)
+    regions = random_regions(rng, rng.randint(0, 30), 100)
+    merged = seq_coverage.merge_intervals(regions)
+
+    assert covered_bases(merged) == covered_bases(regions)
+    # sorted, disjoint and not touching
+    for (a, b) in zip(merged, merged[1:]):
+        assert a[0] <= a[1] and a[1] + 1 < b[0]
+    assert seq_coverage.linear_length(regions) == len(covered_bases(regions))
+
+def test_merge_intervals_joins_adjacent_regions():
+    assert seq_coverage.merge_intervals([(5, 9), (1, 4), (12, 12), (10, 11), (20, 19)]) == [[1, 12]]
+    assert seq_coverage.linear_length([(1, 10), (3, 5), (21, 30)]) == 20
+
+def paint(regions, seq_len):
+    """Hit index painting each base 1..seq_len (first come, first painted), -1 if none."""
+    painted = [-1] * (seq_len + 1)
+    for (k, (qs, qe)) in enumerate(regions):
+        for pos in range(max(qs, 1), min(qe, seq_len) + 1):
+            if painted[pos] < 0:
+                painted[pos] = k
+    return painted[1:]
+
+@pytest.mark.parametrize("seed", range(50))
+def test_acc_cov_matches_a_painter(seed):
+    rng = random.Random(seed)
+    seq_len = rng.randint(1, 80)
+    regions = random_regions(rng, rng.randint(0, 20), seq_len)
+    segments = seq_coverage.acc_cov(regions, seq_len)
+
+    # tiles 1..seq_len without repeating a hit in adjacent segments
+    assert segments[0][0] == 1 and segments[-1][1] == seq_len
+    for (a, b) in zip(segments, segments[1:]):
+        assert a[1] + 1 == b[0] and a[2] != b[2]
+    assert [k for (qs, qe, k) in segments for pos in range(qs, qe + 1)] == paint(regions, seq_len)
+
+    names = [rng.choice("ABC") for k in regions]
+    runs = {}
+    pos = 1
+    for (name, run) in groupby(names[k] if k >= 0 else "unclassified" for k in paint(regions, seq_len)):
+        n = len(list(run))
+        runs.setdefault(name, []).append((pos, pos + n - 1))
+        pos += n
+    assert seq_coverage.acc_cov_summary(segments, names) == runs
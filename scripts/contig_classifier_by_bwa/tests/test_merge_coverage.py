@@ -0,0 +1,89 @@
+import io
+
+import pytest
+
+import merge_coverage
+
+def row(seq, rank, name, length, num_hit, linear_len, acc_cov_len):
+    """A seq_coverage.py report row."""
+    return f"{seq}\t{rank}\t{name}\t1\tup\t{length}\t{num_hit}\t{num_hit * 10}\t1\t0.9\t{linear_len}\t0\t0\t0\t1..{acc_cov_len}\t{acc_cov_len}\n"
+
+# two contigs of two CDS each, the rows of each CDS interleaved by rank
+rows = [
+    row("NODE_1_length_100_cov_5_1", "species", "Escherichia coli", 30, 2, 25, 20),
+    row("NODE_1_length_100_cov_5_1", "genus", "Escherichia", 30, 2, 25, 20),
+    row("NODE_1_length_100_cov_5_1", "species", "Shigella flexneri", 30, 1, 10, 5),
+    row("NODE_1_length_100_cov_5_1", "genus", "Shigella", 30, 1, 10, 5),
+    row("NODE_1_length_100_cov_5_2", "genus", "Escherichia", 40, 3, 35, 30),
+    row("NODE_1_length_100_cov_5_2", "species", "Escherichia coli", 40, 3, 35, 30),
+    row("NODE_1_length_100_cov_5_2", "unclassified", "unclassified", 40, 0, 10, 10),
+    row("NODE_2_length_80_cov_3_1", "species", "Bacillus subtilis", 50, 4, 45, 45),
+    row("NODE_2_length_80_cov_3_1", "genus", "Bacillus", 50, 4, 45, 45),
+    row("NODE_2_length_80_cov_3_2", "species", "Escherichia coli", 20, 1, 15, 15),
+    row("NODE_2_length_80_cov_3_2", "genus", "Bacillus", 20, 2, 12, 5),
+]
+
+class Output(object):
+    """Output that records how many input rows had been read when each line was written."""
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+        self.written = []
+
+    def rows(self):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+    def write(self, line):
+        self.written.append((self.read, line.rstrip("\n").split("\t")))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+def merge(contig=None, delimiter=None):
+    out = Output(["##SEQ\tRANK\n"] + rows)
+    merge_coverage.merge_coverage(out.rows(), out, contig, delimiter)
+    return out.written[1:]
+
+def expected_sums(contig_of):
+    """
+    {(contig, rank, name): [NUM_MERGED, NUM_HIT, LINEAR_LEN, ACC_COV_LEN]} of rows. Every
+    contig has an unclassified row, which only reports the lengths.
+    """
+    sums = {}
+    for line in rows:
+        temp = line.rstrip("\n").split("\t")
+        sums.setdefault((contig_of(temp[0]), "unclassified", "unclassified"), [0, 0, 0, 0])
+        ref = sums.setdefault((contig_of(temp[0]), temp[1], temp[2]), [0, 0, 0, 0])
+        values = (0, 0) if temp[1] == "unclassified" else (1, int(temp[6]))
+        for (k, value) in enumerate(values + (int(temp[10]), int(temp[15]))):
+            ref[k] += value
+    return sums
+
+def merged_sums(written):
+    return dict(((temp[0], temp[1], temp[2]), [int(temp[k] or 0) for k in (14, 6, 10, 15)]) for (read, temp) in written)
+
+def test_merge_by_delimiter_writes_each_contig_when_it_ends():
+    written = merge(delimiter="_")
+
+    assert merged_sums(written) == expected_sums(lambda seq: seq.rsplit("_", 1)[0])
+    assert [temp[5] for (read, temp) in written if temp[0] == "NODE_1_length_100_cov_5"] == ["70"] * 5
+    # NODE_1 is written once the first NODE_2 row is read, NODE_2 at the end
+    assert set(read for (read, temp) in written if temp[0] == "NODE_1_length_100_cov_5") == {9}
+    assert set(read for (read, temp) in written if temp[0] == "NODE_2_length_80_cov_3") == {len(rows) + 1}
+    # ranks in rank order, each contig closed by its unclassified row
+    assert [temp[1] for (read, temp) in written if temp[0] == "NODE_2_length_80_cov_3"] == ["genus", "species", "species", "unclassified"]
+
+def test_merge_into_one_contig():
+    written = merge(contig="assembly")
+
+    assert merged_sums(written) == expected_sums(lambda seq: "assembly")
+    assert merged_sums(written)[("assembly", "genus", "Escherichia")] == [2, 5, 60, 50]
+    assert set(temp[5] for (read, temp) in written) == {"140"}
+    assert set(read for (read, temp) in written) == {len(rows) + 1}
+
+def test_merge_rejects_names_without_the_delimiter():
+    with pytest.raises(SystemExit):
+        merge_coverage.merge_coverage(iter([row("contig", "genus", "Bacillus", 10, 1, 5, 5)]), io.StringIO(), delimiter="|")
@@ -0,0 +1,37 @@
+import io
+
+import pytest
+
+import seq_coverage
+
+header = "@HD\tVN:1.6\n@SQ\tSN:NC_000913.3\tLN:4641652\n"
+records = [
+    "ctg1\t0\tNC_000913.3\t101\t60\t5S20M\t*\t0\t0\tACGTACGTACGTACGTACGTACGTA\t*\tNM:i:1\n",
+    "ctg1\t256\tNC_000913.3\t501\t60\t10S15M\t*\t0\t0\t*\t*\tNM:i:0\n",
+    "ctg2\t4\t*\t0\t0\t*\t*\t0\t0\tTTTTGGGG\t*\n",
+]
+
+@pytest.mark.parametrize("sam_header", [header, ""])
+def test_sam_lines_reads_sam_text_with_or_without_header(tmp_path, sam_header):
+    sam = tmp_path / "hits.sam"
+    sam.write_text(sam_header + "".join(records))
+    fasta = io.StringIO()
+
+    assert list(seq_coverage.sam_lines(str(sam), fasta)) == records
+    assert fasta.getvalue() == ">ctg2\nTTTTGGGG\n"
+
+def test_sam_lines_reads_a_stream(tmp_path):
+    stream = io.BufferedReader(io.BytesIO((header + "".join(records)).encode()))
+    assert list(seq_coverage.sam_lines(stream)) == records
+
+def test_sam_lines_reads_bam(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    sam = tmp_path / "hits.sam"
+    sam.write_text(header + "".join(records))
+    with pysam.AlignmentFile(str(sam)) as i, pysam.AlignmentFile(str(tmp_path / "hits.bam"), "wb", template=i) as o:
+        for rec in i:
+            o.write(rec)
+    fasta = io.StringIO()
+
+    assert [line.split("\t")[:10] for line in seq_coverage.sam_lines(str(tmp_path / "hits.bam"), fasta)] == [line.split("\t")[:10] for line in records]
+    assert fasta.getvalue() == ">ctg2\nTTTTGGGG\n"
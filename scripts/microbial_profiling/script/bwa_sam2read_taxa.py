@@ -9,7 +9,8 @@
 # The default RANK is species. That can be changed to any rank. The "preload" option will load the
 # entire GI-taxonomy mapping table into memory. That can increase the speed if your input is a
 # very large SAM file (>10G). Note that "preload" option can only work properly with Python 3.5 or 
-# above.
+# above. With "--output FILE.arrow" (or .parquet) the classifications are written in columnar
+# form instead (see read_classification.py; needs pyarrow).
 #
 # EXAMPLE:
 #   
@@ -28,16 +29,24 @@ from gi2lineage import loadTaxonomy, getAccFromSeqID, acc2rank
 
 rank = "species"
 preload = None
+output = None
 
-opts, args = getopt.getopt(sys.argv[1:], "", ["rank=", "preload="])
+opts, args = getopt.getopt(sys.argv[1:], "", ["rank=", "preload=", "output="])
 for opt, arg in opts:
     if opt == "--rank":
         rank = arg
     elif opt == "--preload":
         preload = arg
+    elif opt == "--output":
+        output = arg
 
 loadTaxonomy(preload)
 
+writer = None
+if output:
+    import read_classification
+    writer = read_classification.ReadClassificationWriter(output, read_classification.readTaxaColumns)
+
 for line in sys.stdin:
     if line.startswith('@SQ'):
         continue
@@ -45,12 +54,20 @@ for line in sys.stdin:
 
     # unmapped
     if int(fields[1]) & 4:
-        print(fields[0], '\t')
+        if writer:
+            writer.write((fields[0], ''))
+        else:
+            print(fields[0], '\t')
     else: # mapped
         # gi = fields[2].split('|')[1]
         acc = getAccFromSeqID(fields[2])
         name = acc2rank(acc, rank)
-        if name:
+        if writer:
+            writer.write((fields[0], name or 'no %s (%s)' % (rank, fields[2])))
+        elif name:
             print(fields[0], '\t', name)
         else:
             print(fields[0], '\t', 'no', rank, '(', fields[2], ')')
+
+if writer:
+    writer.close()
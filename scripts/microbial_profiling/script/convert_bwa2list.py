@@ -2,7 +2,8 @@
 import sys
 import os
 import re
-import KronaTools
+from gi2lineage import *
+import taxonomy
 
 # load taxonomy
 print("Loading taxonomy...")
@@ -11,17 +12,8 @@ loadTaxonomy()
 # parse BLAST results
 fileName = sys.argv[1]
 
-major_level = {
-	'superkingdom': 10,
-	'phylum': 20,
-	'class': 30,
-	'order': 40,
-	'family': 50,
-	'genus': 60,
-	'species': 70,
-	'strain': 80,
-	'replicon': 90
-}
+# report ranks, see taxonomy.rankLevel
+major_level = [r for r in taxonomy.majorReportRanks if r != 'root']
 
 headers = []
 taxa = {}
@@ -70,14 +62,13 @@ with open(fileName, 'r') as TAXA:
 			taxa[rank][name]['RESULT'] = fields[0:7]
 
 		if taxID:
-			rank = getTaxRank(taxID)
-			rank = "strain" if rank == "no rank"
+			rank = getTaxNormRank(taxID)
 			name = getTaxName(taxID)
 
 			p_id = taxID
-			while rank not in major_level:
+			while rank not in major_level and p_id not in (0, 1):
 				p_id = getTaxParent(p_id)
-				rank = getTaxRank(p_id)
+				rank = getTaxNormRank(p_id)
 				name = getTaxName(p_id)
 			if rank not in taxa:
 				taxa[rank] = {}
@@ -88,18 +79,18 @@ with open(fileName, 'r') as TAXA:
 			taxa[rank][name]['READ_COUNT'] += int(fields[6])
 
 			while taxID:
-                rank = getTaxRank(taxID)
-                rank = "strain" if rank == "no rank" else rank
+				rank = getTaxNormRank(taxID)
 
-                name = getTaxName(taxID)
-                if name == 'root':
-                    break
+				name = getTaxName(taxID)
+				if name == 'root':
+					break
 
-                if rank in major_level:
-                    taxa[rank][name]['ROLLUP'] = 0 if 'ROLLUP' not in taxa[rank][name] else taxa[rank][name]['ROLLUP']
-                    taxa[rank][name]['ROLLUP'] += int(fields[6])
+				if rank in major_level:
+					taxa.setdefault(rank, {}).setdefault(name, {})
+					taxa[rank][name]['ROLLUP'] = 0 if 'ROLLUP' not in taxa[rank][name] else taxa[rank][name]['ROLLUP']
+					taxa[rank][name]['ROLLUP'] += int(fields[6])
 
-                taxID = getTaxParent(taxID)
+				taxID = getTaxParent(taxID)
 
 # Close TAXA file
 TAXA.close()
@@ -112,8 +103,8 @@ header = '\t'.join(headers)
 print(f"LEVEL\tTAXA\tROLLUP\tASSIGNED\t{header}")
 
 # Loop through taxa dictionary and print results
-for rank in sorted(major_level, key=major_level.get):
-    for name in sorted(taxa[rank], key=lambda x: taxa[rank][x]['ROLLUP'], reverse=True):
+for rank in major_level:
+    for name in sorted(taxa.get(rank, {}), key=lambda x: taxa[rank][x].get('ROLLUP', 0), reverse=True):
         result = '\t'.join(taxa[rank][name]['RESULT']) if 'RESULT' in taxa[rank][name] else ''
         print(f"{rank}\t{name}\t{taxa[rank][name]['ROLLUP']}\t{taxa[rank][name]['READ_COUNT'] if 'READ_COUNT' in taxa[rank][name] else ''}\t{result}")
 
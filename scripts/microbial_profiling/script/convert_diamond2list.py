@@ -14,13 +14,14 @@ __license__ = "GPLv3"
 import argparse as ap, textwrap as tw
 import sys, os, time, subprocess
 import taxonomy as t
+import read_classification as rc
 
 def parse_params(ver):
 	p = ap.ArgumentParser(prog='diamond_class_report.py', description="""Diamond classification reporter %s""" % ver)
 
 	p.add_argument('-i', '--input', 
 			metavar='[FILE]', type=ap.FileType('r'), default=sys.stdin,
-			        help="Specify a file of Diamond read classification results. [default: STDIN]")
+			        help="Specify a file of Diamond read classification results (text, or .arrow/.parquet from read_classification.py). [default: STDIN]")
 
 	p.add_argument('-tp', '--taxaPath',
 			metavar='[PATH]', type=str, default='./taxonomy',
@@ -37,56 +38,66 @@ The function "parsing" will take Diamond classification result line by line
 """
 def parsing():
 	cnt = 0
+	counts = {}
+
+	# columnar input (see read_classification.py): only the taxid column is read
+	if rc.columnarFormat( argvs.input.name ):
+		counts, cnt = rc.countValues( argvs.input.name, "taxid" )
+	else:
+		for line in argvs.input:
+			cnt += 1
+			# Example line: D85TC5M1:229:C2JUAACXX:1:1101:2077:2173 32008   7.5e-05
+			# Only process complete lines
+			temp = line.split('\t')
+
+			(readid, taxid, evalue) = ("","","")
+			if len(temp) == 3:
+				(readid, taxid, evalue) = temp
+			else:
+				continue
 
-	# parsing results
-	for line in argvs.input:
-		cnt += 1
-		# Example line: D85TC5M1:229:C2JUAACXX:1:1101:2077:2173 32008   7.5e-05
-		# Only process complete lines
-		temp = line.split('\t')
+			counts[taxid] = counts.get( taxid, 0 ) + 1
 
-		(readid, taxid, evalue) = ("","","")
-		if len(temp) == 3:
-			(readid, taxid, evalue) = temp
-		else:
-			continue
+			if ( cnt % 1000 == 0):
+				sys.stderr.write( "[INFO] Processing %s read classifications...\r"%cnt )
 
+	# reads with the same taxid share a lineage: roll each taxid up once
+	for (taxid, n) in counts.items():
 		# reference doesn't have a mapped taxid or taxid doesn't have tax info
-		if taxid == '0': continue
+		if not taxid or taxid == '0': continue
+		rollup( taxid, n )
 
-		lineage = t.taxid2lineageDICT( taxid, 1, 1 )
-		assigned_rank = False
+	return cnt
 
-		# Directory "res_rollup" maintains a directory of "ASGN"|"ROLL"|"NAME" for all major ranks and mapped taxonomy id.
-		for rank in sorted( major_ranks, key=major_ranks.__getitem__, reverse=True ):
-			if not rank in lineage:
-				continue
-			else:
-				tid = lineage[rank]['taxid']
-				name = lineage[rank]['name']
-			
-				# count the read to the latest rank
-				if not assigned_rank:
-					assigned_rank = True
-					if tid in res_rollup[rank]:
-						res_rollup[rank][tid]["ASGN"] += 1
-					else:
-						res_rollup[rank][tid]["ASGN"] = 1
-						res_rollup[rank][tid]["ROLL"] = 0
-						res_rollup[rank][tid]["NAME"] = name
-
-				# count for rolling up taxonomies
+def rollup( taxid, n ):
+	lineage = t.taxid2lineageDICT( taxid, 1, 1 )
+	assigned_rank = False
+
+	# Directory "res_rollup" maintains a directory of "ASGN"|"ROLL"|"NAME" for all major ranks and mapped taxonomy id.
+	for rank in sorted( major_ranks, key=major_ranks.__getitem__, reverse=True ):
+		if not rank in lineage:
+			continue
+		else:
+			tid = lineage[rank]['taxid']
+			name = lineage[rank]['name']
+
+			# count the reads to the latest rank
+			if not assigned_rank:
+				assigned_rank = True
 				if tid in res_rollup[rank]:
-					res_rollup[rank][tid]["ROLL"] += 1
+					res_rollup[rank][tid]["ASGN"] += n
 				else:
-					res_rollup[rank][tid]["ROLL"] = 1
-					res_rollup[rank][tid]["ASGN"] = 0
+					res_rollup[rank][tid]["ASGN"] = n
+					res_rollup[rank][tid]["ROLL"] = 0
 					res_rollup[rank][tid]["NAME"] = name
 
-		if ( cnt % 1000 == 0):
-			sys.stderr.write( "[INFO] Processing %s read classifications...\r"%cnt )
-	
-	return cnt
+			# count for rolling up taxonomies
+			if tid in res_rollup[rank]:
+				res_rollup[rank][tid]["ROLL"] += n
+			else:
+				res_rollup[rank][tid]["ROLL"] = n
+				res_rollup[rank][tid]["ASGN"] = 0
+				res_rollup[rank][tid]["NAME"] = name
 
 def write_report(f, tol_read_count):
 	# print header
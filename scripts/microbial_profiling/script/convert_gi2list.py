@@ -1,23 +1,15 @@
 #!/usr/bin/env python3
 
 from gi2lineage import *
+import taxonomy
 from collections import defaultdict
 
 # load taxonomy
 print ("Loading taxonomy...\n", file=sys.stderr)
 loadTaxonomy()
 
-major_level = {
-    'superkingdom': 10,
-    'phylum': 20,
-    'class': 30,
-    'order': 40,
-    'family': 50,
-    'genus': 60,
-    'species': 70,
-    'strain': 80,
-    'replicon': 90
-}
+# report ranks, see taxonomy.rankLevel
+major_level = [r for r in taxonomy.majorReportRanks if r != 'root']
 
 headers = []
 taxa = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
@@ -32,7 +24,8 @@ while True:
     acc = fields[0]
     taxID = getTaxIDFromAcc(acc)
 
-    print(f"[WARNING] Can't find Accession#{acc}") if not taxID
+    if not taxID:
+        print(f"[WARNING] Can't find Accession#{acc}", file=sys.stderr)
 
     rank = "replicon"
     name = acc
@@ -42,21 +35,19 @@ while True:
 
     if taxID:
         #print("Processing GI:$gi TAXID:$taxID NAME:'$fields[8]'...\n", file=sys.stderr);
-        rank = getTaxRank(taxID) or "no rank"
-        rank = "strain" if rank == "no rank"
+        rank = getTaxNormRank(taxID)
         name = getTaxName(taxID)
 
         p_id = taxID
-        while rank not in major_level:
+        while rank not in major_level and p_id not in (0, 1):
             p_id = getTaxParent(p_id)
-            rank = getTaxRank(p_id)
+            rank = getTaxNormRank(p_id)
             name = getTaxName(p_id)
 
         taxa[rank][name]['READ_COUNT'] += int(fields[1])
 
         while taxID:
-            rank = getTaxRank(taxID)
-            rank = "strain" if rank == "no rank"
+            rank = getTaxNormRank(taxID)
             name = getTaxName(taxID)
 
             if name == 'root':
@@ -69,6 +60,6 @@ while True:
 
 print("\n", file=sys.stderr)
 print("LEVEL\tTAXA\tROLLUP\tASSIGNED")
-for rank in sorted(major_level, key=major_level.get):
+for rank in major_level:
     for name in sorted(taxa[rank], key=lambda x: taxa[rank][x]['ROLLUP'], reverse=True):
         print(f"{rank}\t{name}\t{taxa[rank][name]['ROLLUP']}\t{taxa[rank][name]['READ_COUNT'] if 'READ_COUNT' in taxa[rank][name] else ''}")
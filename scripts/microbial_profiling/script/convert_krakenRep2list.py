@@ -1,65 +1,14 @@
 #!/usr/bin/env python
-import os
 import sys
 import time
+from gi2lineage import loadTaxonomy, getTaxNormRank
+import taxonomy
 
-# Load KronaTools library
-os.system('ktGetLibPath')
-import KronaTools
-
-# Set output buffering
+# load taxonomy
 count = 0
-taxa = None
-period = None
-time = time.time()
-period = KronaTools.timeInterval(time)
-KronaTools.loadTaxonomy()
-period = KronaTools.timeInterval(time)
-
-major_level = {
-    'root': 0,
-    'superkingdom': 15,
-    'phylum': 25,
-    'class': 35,
-    'order': 45,
-    'family': 55,
-    'genus': 65,
-    'species': 75,
-    'strain': 85,
-    'replicon': 95
-}
-
-level = {
-    'root': 0,
-    'superkingdom': 14,
-    'kingdom': 15,
-    'subkingdom': 16,
-    'superphylum': 24,
-    'phylum': 25,
-    'subphylum': 26,
-    'infraclass': 33,
-    'superclass': 34,
-    'class': 35,
-    'subclass': 36,
-    'infraorder': 43,
-    'superorder': 44,
-    'order': 45,
-    'suborder': 46,
-    'parvorder': 47,
-    'superfamily': 54,
-    'family': 55,
-    'subfamily': 56,
-    'tribe': 58,
-    'genus': 65,
-    'subgenus': 66,
-    'species group': 73,
-    'species subgroup': 74,
-    'species': 75,
-    'subspecies': 76,
-    'strain': 85,
-    'no rank': 90,
-    'unclassified': 100
-}
+taxa = {}
+start = time.time()
+loadTaxonomy()
 
 #  23.85  1564844 1564844 U   0   unclassified
 #  76.15  4997221 7839    -   1   root
@@ -88,7 +37,7 @@ def timeInterval(now):
 for line in sys.stdin:
     count += 1
     if count % 5000 == 0:
-        period = timeInterval(time)
+        period = timeInterval(start)
         number = format(count, ',d')
         print("[{}] {} taxonomy processed.".format(period, number), end='\r', file=sys.stderr)
 
@@ -99,12 +48,11 @@ for line in sys.stdin:
     taxID = fields[4]
     name = fields[5].lstrip()
 
-    rank = getTaxRank(taxID) or 'no rank'
-    depth = getTaxDepth(taxID) or '10'
+    rank = getTaxNormRank(taxID)
 
-    rank = "unclassified" if taxID == '0' else rank
-    rank = "root" if taxID == '1' else rank
-    rank = "strain" if rank == "no rank" and int(depth) > 6 else rank
+    # clades and other ranks that are not report levels
+    if rank == "other rank":
+        continue
 
     # skip extra strain levels
     # no rank -- Escherichia coli O111:H-
@@ -116,12 +64,12 @@ for line in sys.stdin:
     taxa.setdefault(rank, {}).setdefault(name, {})['ROLLUP'] = fields[1]
     taxa.setdefault(rank, {}).setdefault(name, {})['TAXID'] = taxID
 
-period = timeInterval(time)
+period = timeInterval(start)
 number = format(count, ',d')
 print("[{}] {} sequences processed.".format(period, number), file=sys.stderr)
 
 print("LEVEL\tTAXA\tROLLUP\tASSIGNED\tTAXID")
-for rank in sorted(taxa.keys(), key=lambda x: level[x]):
+for rank in sorted(taxa.keys(), key=taxonomy.rankLevel.get):
     for name in sorted(taxa[rank].keys(), key=lambda x: taxa[rank][x]['ROLLUP'], reverse=True):
         print("{}\t{}\t{}\t{}\t{}".format(
             rank,
@@ -2,54 +2,16 @@
 
 import sys
 import re
-from gi2lineage import loadTaxonomy, getTaxRank, getTaxDepth, taxid2rank
+from gi2lineage import loadTaxonomy, getTaxNormRank, getTaxParent, taxid2rank
+import taxonomy
 
-col = None
+# load taxonomy
+loadTaxonomy()
 
-major_level = {
-    'root': 0,
-    'superkingdom': 15,
-    'phylum': 25,
-    'class': 35,
-    'order': 45,
-    'family': 55,
-    'genus': 65,
-    'species': 75,
-    'strain': 85,
-    # 'replicon': 95
-}
+col = None
 
-level = {
-    'root': 0,
-    'superkingdom': 15,
-    'kingdom': 16,
-    'subkingdom': 17,
-    'superphylum': 24,
-    'phylum': 25,
-    'subphylum': 26,
-    'infraclass': 33,
-    'superclass': 34,
-    'class': 35,
-    'subclass': 36,
-    'infraorder': 43,
-    'superorder': 44,
-    'order': 45,
-    'suborder': 46,
-    'parvorder': 47,
-    'superfamily': 54,
-    'family': 55,
-    'subfamily': 56,
-    'tribe': 58,
-    'genus': 65,
-    'subgenus': 66,
-    'species group': 73,
-    'species subgroup': 74,
-    'species': 75,
-    'subspecies': 76,
-    'strain': 85,
-    'no rank': 90,
-    'unclassified': 100
-}
+# report ranks of the lineage, see taxonomy.rankLevel
+major_level = [r for r in taxonomy.majorReportRanks if r != 'replicon']
 
 taxa = {}
 count = 0
@@ -71,26 +33,17 @@ for line in sys.stdin:
     taxID = fields[col]
     name = fields[1].lstrip()
 
-    rank = getTaxRank(taxID)
-    depth = getTaxDepth(taxID)
-
-    if taxID == 0:
-        rank = 'unclassified'
-    if taxID == 1:
-        rank = 'root'
-    if rank == 'no rank' and depth > 6:
-        rank = 'strain'
-
-    # transfer minor rank to major rank
-    close_major_rank = rank
-    if rank not in major_level:
-        for temp in sorted(major_level, key=major_level.get):
-            if level[rank] > major_level[temp]:
-                close_major_rank = temp
-        pass
+    # transfer minor rank to major rank; ranks that are not report levels (clade, ...) take
+    # the report rank of their closest ancestor that has one
+    rank = getTaxNormRank(taxID)
+    p_id = taxID
+    while rank == "other rank" and str(p_id) not in ('0', '1'):
+        p_id = getTaxParent(p_id)
+        rank = getTaxNormRank(p_id)
+    close_major_rank = taxonomy.normRank2major[rank]
 
     lineage = []
-    for rank in sorted(major_level, key=major_level.get):
+    for rank in major_level:
         rname = taxid2rank(taxID, rank)
         if rank == 'strain':
             rname = name
@@ -1,28 +1,20 @@
 #!/usr/bin/env python3
 
 import sys
-from gi2lineage import loadTaxonomy, getTaxRank, getTaxName, getTaxParent
+from collections import defaultdict
+from gi2lineage import loadTaxonomy, getTaxRank, getTaxNormRank, getTaxName, getTaxParent
+import taxonomy
 
 min_count = int(sys.argv[1]) if len(sys.argv) > 1 else 0
 
 # Load taxonomy
 loadTaxonomy()
 
-major_level = {
-    'root': 0,
-    'superkingdom': 10,
-    'phylum': 20,
-    'class': 30,
-    'order': 40,
-    'family': 50,
-    'genus': 60,
-    'species': 70,
-    'strain': 80,
-    'misc': 90
-}
+# report ranks, see taxonomy.rankLevel; non-NCBI taxids are listed as "misc"
+major_level = [r for r in taxonomy.majorReportRanks if r != 'replicon'] + ['misc']
 
 taxID = 0
-taxa = {}
+taxa = defaultdict(lambda: defaultdict(dict))
 
 for line in sys.stdin:
     line = line.rstrip()
@@ -49,20 +41,19 @@ for line in sys.stdin:
                 taxa['misc']['non-ncbi taxid']['ROLLUP'] = taxa['misc']['non-ncbi taxid'].get('ROLLUP', 0) + read_count
                 continue
 
-            rank = 'strain' if rank == 'no rank'
+            rank = getTaxNormRank(taxID)
             name = getTaxName(taxID)
 
             p_id = taxID
             while rank not in major_level:
                 p_id = getTaxParent(p_id)
-                rank = getTaxRank(p_id)
+                rank = getTaxNormRank(p_id)
                 name = getTaxName(p_id)
 
             taxa[rank][name]['READ_COUNT'] = taxa[rank][name].get('READ_COUNT', 0) + read_count
 
             while taxID:
-                rank = getTaxRank(taxID)
-                rank = 'strain' if rank == 'no rank'
+                rank = getTaxNormRank(taxID)
                 name = getTaxName(taxID)
                 if name == 'root':
                     break
@@ -76,7 +67,7 @@ for line in sys.stdin:
         taxID = 0
 
 print("LEVEL\tTAXA\tROLLUP\tASSIGNED\tTAXID")
-for rank in sorted(major_level, key=major_level.get):
-    for name in sorted(taxa[rank], key=lambda x: taxa[rank][x]['ROLLUP'], reverse=True):
+for rank in major_level:
+    for name in sorted(taxa[rank], key=lambda x: taxa[rank][x].get('ROLLUP', 0), reverse=True):
         result = '\t'.join(taxa[rank][name]['RESULT']) if 'RESULT' in taxa[rank][name] else ''
         print(f"{rank}\t{name}\t{taxa[rank][name].get('ROLLUP', 0)}\t{taxa[rank][name].get('READ_COUNT', '')}\t{taxa[rank][name].get('TAXID', '')}")
@@ -0,0 +1 @@
+../../contig_classifier_by_bwa/gi2lineage.py
\ No newline at end of file
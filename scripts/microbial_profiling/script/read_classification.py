@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# Per-read classification files in text or columnar form.
+#
+# Classifier adapters write one record per read (e.g. read id, taxid and e-value of a Diamond
+# "-f 102" run) and the converters roll them up. Besides the usual tab-separated text, the
+# records can be stored column by column, which needs pyarrow:
+#   *.arrow, *.feather - Arrow IPC file, memory-mapped when read
+#   *.parquet          - Parquet
+# Low-cardinality columns (taxids, taxonomy names) are dictionary-encoded, with one dictionary
+# per column that grows from batch to batch (an Arrow IPC file takes the new values as
+# dictionary deltas; it cannot replace a dictionary). Readers ask for the columns they need,
+# so a rollup that only needs taxids does not touch the read ids.
+#
+#   read_classification.py convert [--columns read,taxid,evalue] INPUT OUTPUT
+#
+# converts between the formats (by file extension; "-" is text on STDIN/STDOUT).
+
+import sys
+import os.path
+import argparse
+
+try:
+	import pyarrow as pa
+	import pyarrow.compute as pc
+	import pyarrow.ipc as ipc
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None
+
+####################
+# Global variables #
+####################
+
+columnarFormats = { ".arrow": "arrow", ".feather": "arrow", ".parquet": "parquet" }
+batchSize = 1000000
+
+# column types: "string", "dictionary" (dictionary-encoded strings) or "float"
+diamondColumns = ( ("read", "string"), ("taxid", "dictionary"), ("evalue", "float") )
+readTaxaColumns = ( ("read", "string"), ("taxonomy", "dictionary") )
+
+####################
+#      Methods     #
+####################
+
+def columnarFormat( filename ):
+	"""'arrow' or 'parquet' if filename is a columnar file (by extension or magic bytes), else None."""
+	ext = os.path.splitext( filename )[1].lower()
+	if ext in columnarFormats:
+		return columnarFormats[ext]
+	if os.path.isfile( filename ):
+		with open( filename, 'rb' ) as f:
+			magic = f.read(6)
+		if magic == b"ARROW1":
+			return "arrow"
+		if magic[:4] == b"PAR1":
+			return "parquet"
+	return None
+
+class ReadClassificationWriter(object):
+	"""
+	Write per-read records (tuples in the order of columns, a list of (name, type) pairs)
+	to filename as tab-separated text, or, for a columnar file name, in batches of
+	batch_size records as Arrow IPC or Parquet. Use as a context manager or call close().
+	"""
+	def __init__( self, filename, columns=diamondColumns, batch_size=None ):
+		self.columns = columns
+		self.format = columnarFormat( filename ) if filename != "-" else None
+		self.batch_size = batch_size or batchSize
+		self.rows = []
+		self.dicts = dict( (k, {}) for (k, (name, t)) in enumerate( columns ) if t == "dictionary" )
+
+		if self.format is None:
+			self.out = sys.stdout if filename == "-" else open( filename, 'w' )
+			return
+
+		_checkArrow()
+		self.schema = pa.schema( [ (name, _arrowType(t)) for (name, t) in columns ] )
+		if self.format == "arrow":
+			self.sink = pa.OSFile( filename, 'wb' )
+			self.writer = ipc.new_file( self.sink, self.schema, options=ipc.IpcWriteOptions( emit_dictionary_deltas=True ) )
+		else:
+			self.sink = None
+			self.writer = pq.ParquetWriter( filename, self.schema )
+
+	def write( self, row ):
+		if self.format is None:
+			self.out.write( "\t".join( str(v) for v in row ) + "\n" )
+			return
+		self.rows.append( row )
+		if len(self.rows) >= self.batch_size:
+			self._flush()
+
+	def close( self ):
+		if self.format is None:
+			if self.out is not sys.stdout: self.out.close()
+			return
+		self._flush()
+		self.writer.close()
+		if self.sink is not None: self.sink.close()
+
+	def _flush( self ):
+		if not self.rows:
+			return
+		arrays = []
+		for (k, (name, t)) in enumerate( self.columns ):
+			values = [ row[k] for row in self.rows ]
+			if t == "float":
+				arrays.append( pa.array( [ float(v) if v != "" else None for v in values ], type=pa.float64() ) )
+			elif t == "dictionary":
+				arrays.append( self._dictionaryArray( self.dicts[k], values ) )
+			else:
+				arrays.append( pa.array( [ str(v) for v in values ], type=pa.string() ) )
+		batch = pa.record_batch( arrays, schema=self.schema )
+		if self.format == "arrow":
+			self.writer.write_batch( batch )
+		else:
+			self.writer.write_table( pa.Table.from_batches( [batch] ) )
+		self.rows = []
+
+	def _dictionaryArray( self, index, values ):
+		"""Encode values with the running dictionary index ({value: code}), adding new values to its end."""
+		codes = []
+		for v in values:
+			v = str(v)
+			if v not in index:
+				index[v] = len(index)
+			codes.append( index[v] )
+		return pa.DictionaryArray.from_arrays( pa.array( codes, type=pa.int32() ), pa.array( list(index), type=pa.string() ) )
+
+	def __enter__( self ):
+		return self
+
+	def __exit__( self, *exc ):
+		self.close()
+
+def readRecords( filename, columns=None, names=diamondColumns ):
+	"""
+	Yield the records of a text or columnar per-read file as tuples of the requested columns
+	(all by default). Text files are read by position, with the column names of names.
+	"""
+	fmt = columnarFormat( filename ) if filename != "-" else None
+	if fmt is None:
+		names = [ name for (name, t) in names ]
+		pick = [ names.index(c) for c in columns ] if columns else None
+		f = sys.stdin if filename == "-" else open( filename )
+		for line in f:
+			fields = line.rstrip('\r\n').split('\t')
+			yield tuple( fields[k] if k < len(fields) else "" for k in pick ) if pick else tuple(fields)
+		if f is not sys.stdin: f.close()
+		return
+
+	for batch in _columnBatches( filename, fmt, columns ):
+		cols = [ c.to_pylist() for c in batch ]
+		for row in zip( *cols ):
+			yield row
+
+def countValues( filename, column="taxid", names=diamondColumns ):
+	"""
+	Count the records of a per-read file by the value of one column. Returns ({value: count},
+	number of records). For a columnar file only that column is read.
+	"""
+	counts = {}
+	total = 0
+
+	fmt = columnarFormat( filename ) if filename != "-" else None
+	if fmt is None:
+		for (value,) in readRecords( filename, [column], names ):
+			counts[value] = counts.get( value, 0 )+1
+			total += 1
+		return counts, total
+
+	for (col,) in _columnBatches( filename, fmt, [column] ):
+		total += len(col)
+		vc = pc.value_counts( col )
+		for (value, n) in zip( vc.field("values").to_pylist(), vc.field("counts").to_pylist() ):
+			counts[value] = counts.get( value, 0 )+n
+
+	return counts, total
+
+def _columnBatches( filename, fmt, columns ):
+	"""Yield lists of the requested column arrays (all columns by default), batch by batch."""
+	_checkArrow()
+	if fmt == "arrow":
+		reader = ipc.open_file( pa.memory_map( filename, 'r' ) )
+		names = columns or reader.schema.names
+		for i in range( reader.num_record_batches ):
+			batch = reader.get_batch(i)
+			yield [ batch.column( name ) for name in names ]
+	else:
+		pf = pq.ParquetFile( filename )
+		names = columns or pf.schema_arrow.names
+		for batch in pf.iter_batches( columns=names ):
+			yield [ batch.column( name ) for name in names ]
+
+def _arrowType( t ):
+	if t == "float":
+		return pa.float64()
+	if t == "dictionary":
+		return pa.dictionary( pa.int32(), pa.string() )
+	return pa.string()
+
+def _checkArrow():
+	if pa is None:
+		sys.exit( "[ERROR] Columnar (Arrow/Parquet) read classification files require pyarrow.\n" )
+
+def convert( input_file, output_file, columns=diamondColumns ):
+	"""Copy the records of input_file to output_file; the formats follow the file names."""
+	n = 0
+	with ReadClassificationWriter( output_file, columns ) as out:
+		for row in readRecords( input_file, names=columns ):
+			if len(row) != len(columns): continue
+			out.write( row )
+			n += 1
+	return n
+
+if __name__ == '__main__':
+	p = argparse.ArgumentParser( description="Convert per-read classification files between text, Arrow IPC (.arrow) and Parquet (.parquet)." )
+	p.add_argument( "command", choices=["convert"] )
+	p.add_argument( "input", help="input file, or - for text on STDIN" )
+	p.add_argument( "output", help="output file, or - for text on STDOUT" )
+	p.add_argument( "--columns", default="read:string,taxid:dictionary,evalue:float",
+	                help="comma-separated NAME:TYPE columns, TYPE one of string, dictionary, float [default: the Diamond read, taxid, evalue]" )
+	args = p.parse_args()
+
+	columns = tuple( tuple( c.split(":") ) if ":" in c else (c, "string") for c in args.columns.split(",") )
+	n = convert( args.input, args.output, columns )
+	sys.stderr.write( "[INFO] %d read classifications written to %s\n" % (n, args.output) )
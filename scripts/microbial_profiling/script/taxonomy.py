@@ -9,9 +9,26 @@ import sys
 import io
 import os.path
 import json
+import re
 import gzip
 import subprocess
 import fileinput
+import shutil
+import mmap
+import socket
+import socketserver
+import signal
+import threading
+import weakref
+import gc
+import builtins
+import multiprocessing
+from collections import OrderedDict
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
 
 ####################
 # Global variables #
@@ -19,7 +36,19 @@ import fileinput
 
 libPath = os.path.dirname(os.path.realpath(__file__))
 taxonomyDir = libPath + "/database"
+snapshotDirName = "taxonomy.snapshot"
+socketName = "taxonomy.sock"
+# accession2taxid lists, in order of preference (the second is the Krona/gi2lineage name)
+accessionFiles = ( "accession2taxid.tsv", "all.accession2taxid.sorted" )
+snapshotVersion = 1
+snapshotColumns = ( "parent", "depth", "rank", "nchild", "merged", "name_offset" )
+ancestorColumns = ( "rank_ancestor", "nearest_major", "type" )
+intervalColumns = ( "pre", "post" )
+normRankColumns = ( "norm_rank", )
+lcaBlock = 64
 DEBUG=0
+parseProcesses = None
+cacheEntries = 1000000
 
 taxDepths      = {}
 taxParents     = {}
@@ -27,9 +56,229 @@ taxRanks       = {}
 taxNames       = {}
 taxMerged      = {}
 taxNumChilds   = {}
-accTid         = {}
-tidLineage     = {}
-tidLineageDict = {}
+accCatalog     = {}
+taxSnapshot    = None
+taxOverlay     = []
+accLookup      = None
+taxDaemon      = None
+localFunctions = {}
+# serializes the lazy building of shared tables (intervals, LCA, rank ancestors, accession lookup)
+buildLock      = threading.RLock()
+
+majorRanks = ( "superkingdom", "phylum", "class", "order", "family", "genus", "species" )
+
+# Report levels of the profiling converters (convert_*2list.py), see taxid2normRank().
+# "replicon" (a reference sequence) and "unclassified" are never the rank of a node, and
+# "other rank" stands for the node ranks missing here (clade, cohort, section, ...).
+rankLevel = {
+	'root'             : 0,
+	'superkingdom'     : 15,
+	'kingdom'          : 16,
+	'subkingdom'       : 17,
+	'superphylum'      : 24,
+	'phylum'           : 25,
+	'subphylum'        : 26,
+	'infraclass'       : 33,
+	'superclass'       : 34,
+	'class'            : 35,
+	'subclass'         : 36,
+	'infraorder'       : 43,
+	'superorder'       : 44,
+	'order'            : 45,
+	'suborder'         : 46,
+	'parvorder'        : 47,
+	'superfamily'      : 54,
+	'family'           : 55,
+	'subfamily'        : 56,
+	'tribe'            : 58,
+	'genus'            : 65,
+	'subgenus'         : 66,
+	'species group'    : 73,
+	'species subgroup' : 74,
+	'species'          : 75,
+	'subspecies'       : 76,
+	'strain'           : 85,
+	'other rank'       : 89,
+	'no rank'          : 90,
+	'replicon'         : 95,
+	'unclassified'     : 100
+}
+majorReportRanks = ( "root", "superkingdom", "phylum", "class", "order", "family", "genus", "species", "strain", "replicon" )
+# a "no rank" node deeper than this is a strain
+strainDepth = 6
+
+# normalized rank codes are indexes into normRanks, so they sort in report order
+normRanks = tuple( sorted( rankLevel, key=rankLevel.get ) )
+normRankCode = dict( (r, c) for (c, r) in enumerate( normRanks ) )
+# closest major report rank at or above each level (a minor rank rolls up into it); the
+# ranks that are not report levels map to themselves and are skipped by the rollups
+normRank2major = {}
+for _r in normRanks:
+	normRank2major[_r] = _r if _r in ("replicon", "unclassified", "other rank") else \
+		max( [ m for m in majorReportRanks if m != "replicon" and rankLevel[m] <= rankLevel[_r] ], key=rankLevel.get )
+
+####################
+#      Caches      #
+####################
+
+class LRUCache(object):
+	"""
+	Dict-like cache holding at most max_entries items and/or about max_bytes bytes of
+	keys and values; the least recently used items are evicted first. Counts hits,
+	misses and evictions (see stats()). A limit of None means unbounded.
+	Each thread has its own entries (the limits apply per thread), so lookups from worker
+	threads never share or lock a cache; clear() and stats() cover all threads. share()
+	makes all threads use one set of entries, for callers that serialize lookups themselves.
+	"""
+	def __init__( self, name, max_entries=None, max_bytes=None ):
+		self.name = name
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.local = threading.local()
+		self.shards = weakref.WeakSet()
+		self.shared = None
+		self.lock = threading.Lock()
+
+	def _shard( self ):
+		if self.shared is not None:
+			return self.shared
+		try:
+			return self.local.shard
+		except AttributeError:
+			# kept alive by the thread; dropped from shards when the thread ends
+			shard = self.local.shard = _CacheShard()
+			with self.lock:
+				self.shards.add( shard )
+			return shard
+
+	def get( self, key, default=None ):
+		shard = self._shard()
+		try:
+			value = shard.data[key]
+		except KeyError:
+			shard.misses += 1
+			return default
+		shard.data.move_to_end(key)
+		shard.hits += 1
+		return value
+
+	def __setitem__( self, key, value ):
+		shard = self._shard()
+		if key in shard.data:
+			shard.discard(key)
+		shard.data[key] = value
+		if self.max_bytes is not None:
+			shard.sizes[key] = _sizeof(key) + _sizeof(value)
+			shard.nbytes += shard.sizes[key]
+		shard.evict( self.max_entries, self.max_bytes )
+
+	def __getitem__( self, key ):
+		value = self.get( key, self )
+		if value is self:
+			raise KeyError(key)
+		return value
+
+	def __contains__( self, key ):
+		return key in self._shard().data
+
+	def __len__( self ):
+		return len(self._shard().data)
+
+	def resize( self, max_entries=None, max_bytes=None ):
+		with self.lock:
+			for shard in self.shards:
+				# byte sizes are only tracked while there is a byte limit
+				if max_bytes is not None and self.max_bytes is None:
+					shard.sizes = dict( (k, _sizeof(k) + _sizeof(v)) for (k, v) in shard.data.items() )
+					shard.nbytes = sum( shard.sizes.values() )
+				elif max_bytes is None:
+					shard.sizes = {}
+					shard.nbytes = 0
+				shard.evict( max_entries, max_bytes )
+			self.max_entries = max_entries
+			self.max_bytes = max_bytes
+
+	def discard( self, key ):
+		with self.lock:
+			for shard in self.shards:
+				if key in shard.data:
+					shard.discard(key)
+
+	def clear( self ):
+		with self.lock:
+			for shard in self.shards:
+				shard.data.clear()
+				shard.sizes = {}
+				shard.nbytes = 0
+
+	def share( self ):
+		self.shared = self._shard()
+
+	def resetWorker( self ):
+		"""Start with empty cache and counters in this process, e.g. after fork()."""
+		self.lock = threading.Lock()
+		self.shards = weakref.WeakSet()
+		self.shared = None
+		self.local = threading.local()
+
+	def stats( self ):
+		with self.lock:
+			shards = list( self.shards )
+		return {
+			"entries"   : sum( len(shard.data) for shard in shards ),
+			"bytes"     : sum( shard.nbytes for shard in shards ) if self.max_bytes is not None else None,
+			"hits"      : sum( shard.hits for shard in shards ),
+			"misses"    : sum( shard.misses for shard in shards ),
+			"evictions" : sum( shard.evictions for shard in shards )
+		}
+
+class _CacheShard(object):
+	"""The entries and counters of one LRUCache in one thread."""
+	def __init__( self ):
+		self.data = OrderedDict()
+		self.sizes = {}
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def discard( self, key ):
+		del self.data[key]
+		if key in self.sizes:
+			self.nbytes -= self.sizes.pop(key)
+
+	def evict( self, max_entries, max_bytes ):
+		while self.data and ( ( max_entries is not None and len(self.data) > max_entries )
+		                   or ( max_bytes is not None and self.nbytes > max_bytes ) ):
+			self.discard( next(iter(self.data)) )
+			self.evictions += 1
+
+accTid         = LRUCache( "accTid", cacheEntries )
+tidLineage     = LRUCache( "tidLineage", cacheEntries )
+tidLineageDict = LRUCache( "tidLineageDict", cacheEntries )
+lookupCaches   = [ accTid, tidLineage, tidLineageDict ]
+# TaxonomyDB instances in use; they all hold the one taxonomy of the process
+taxonomyDBs    = weakref.WeakSet()
+
+def setCacheLimits( max_entries=None, max_bytes=None, caches=None ):
+	"""
+	Bound the lookup caches (all of them, or those named in caches) to max_entries items
+	and/or max_bytes bytes each; None for both makes them unbounded.
+	"""
+	for cache in lookupCaches:
+		if caches is None or cache.name in caches:
+			cache.resize( max_entries, max_bytes )
+
+def cacheStats():
+	"""Size and hit/miss/eviction counters of each lookup cache, keyed by cache name."""
+	return dict( (cache.name, cache.stats()) for cache in lookupCaches )
+
+def printCacheStats( out=sys.stderr ):
+	for cache in lookupCaches:
+		st = cache.stats()
+		total = st["hits"] + st["misses"]
+		out.write( "[INFO] Cache %s: %d entries, %d hits, %d misses (%.1f%% hit rate), %d evictions\n" % (
+			cache.name, st["entries"], st["hits"], st["misses"], 100.0*st["hits"]/total if total else 0, st["evictions"]) )
 
 major_level = {
 	'superkingdom' : 'k',
@@ -66,67 +315,286 @@ def taxidStatus( taxID ):
 # Replace the query taxID with the merged taxID if it exists.
 def taxid2mergedTid( taxID ):
 	_checkTaxonomy()
-	if taxID and taxID in taxMerged.keys():
+	if taxID and taxID in taxMerged:
 		return taxMerged[taxID]
 	else:
 		return taxID
 
 def acc2taxid( acc ):
 	_checkTaxonomy()
-	accession2taxid_file=taxonomyDir+"/accession2taxid.tsv"
 	#remove version number#
 	acc = acc.split('.')[0]
-	
-	if DEBUG: sys.stderr.write( "[INFO] acc2taxid from file: %s\n" % accession2taxid_file )
-		
 
-	if not acc in accTid:
-		with open( accession2taxid_file ) as f:
-			f.seek(0, 2)
-			start = 0
-			end = f.tell()
-			accCur = ""
-			
-			if DEBUG: sys.stderr.write( "[INFO] acc2taxid from file: %s\n" % accession2taxid_file )
-			
-			while( acc != accCur and start < end ):
-				
-				posNew = (end+start)/2
-				
-				f.seek( posNew )
-		
-				if posNew != start: f.readline()
+	if acc in accCatalog:
+		return taxid2mergedTid(accCatalog[acc])
 
-				line = f.readline()	
-				
-				if DEBUG: sys.stderr.write( "[INFO] start: %15d, posNew: %15d, end: %15d, line: %s" % (start, posNew, end, line) )
-				if line :
-					(accNew, tid) = line.split('\t')
-				else:
-					break
+	tid = accTid.get( acc )
+	if tid is None:
+		tid = accTid[acc] = _accessionLookup().lookup( acc )
 
-				if acc > accNew and accCur != accNew and accNew:
-					if accNew: posNew = f.tell()
-					start = posNew
-					if start >= end: end = start+1
-				else:
-					end = posNew
-				
-				accCur = accNew
+	tid = taxid2mergedTid(tid)
+
+	return tid
 
+def accs2taxid( accs ):
+	"""
+	Batch acc2taxid(): taxids of a list of accessions as an int array (0 if not found),
+	with merged taxids resolved. Fast with an accession index (see compileAccessionIndex).
+	If an accession has a custom (non-numeric) taxid, the array is an object array holding
+	that taxid as a string and the others as ints; the batch taxids2* functions take either.
+	"""
+	_checkTaxonomy()
+	tids = _accessionLookup().lookupMany( accs )
+
+	# a loaded RefSeq catalog (loadRefSeqCatelog) comes first, as in acc2taxid()
+	if accCatalog:
+		hits = [ (k, accCatalog[acc]) for (k, acc) in enumerate( a.split('.')[0] for a in accs ) if acc in accCatalog ]
+		if any( not tid.isdigit() for (k, tid) in hits ):
+			tids = tids.astype( object )
+		for (k, tid) in hits:
+			tids[k] = int(tid) if tid.isdigit() else tid
+
+	snap = taxSnapshot
+	if tids.dtype == object or snap is None:
+		resolved = [ taxid2mergedTid( str(tid) ) if tid else tid for tid in tids.tolist() ]
+		return np.array( [ int(tid) if isinstance(tid, str) and tid.isdigit() else tid for tid in resolved ], dtype=tids.dtype )
+
+	inside = tids < snap.size
+	merged = np.where( inside, snap.merged[ np.where(inside, tids, 0) ], 0 )
+	return np.where( merged > 0, merged, tids )
+
+def compileAccessionIndex( accession2taxid_file ):
+	"""
+	Build the accession index of a sorted or unsorted "accession<TAB>taxid" file (e.g.
+	accession2taxid.tsv) in accession2taxid_file+".idx/": a sorted block of fixed-width
+	accession keys (version numbers removed) with a parallel int32 taxid column.
+	acc2taxid() memory-maps it instead of bisecting the text file on every cache miss.
+	"""
+	if np is None:
+		_die( "Building accession index requires numpy.\n" )
+
+	accs = []
+	tids = []
+	try:
+		with open( accession2taxid_file ) as f:
+			for line in f:
+				fields = line.rstrip('\r\n').split('\t')
+				if len(fields) < 2: continue
+				accs.append( fields[0].split('.')[0] )
+				tids.append( fields[1] )
 			f.close()
+	except IOError:
+		_die( "Failed to open accession2taxid file: %s.\n" % accession2taxid_file )
 
-			if accCur == acc:
-				accTid[acc] = tid.strip()
-			else:
-				accTid[acc] = ""
+	return _writeAccessionIndex( accession2taxid_file, accs, tids )
 
-	tid = taxid2mergedTid(accTid[acc])
+def openAccessionLookup( accession2taxid_file ):
+	"""
+	Open accession2taxid_file for lookups: its memory-mapped index if it has an up-to-date
+	one, otherwise the sorted text file itself (memory-mapped and binary searched). Both
+	offer lookup(acc) and lookupMany(accs), and stay open for the life of the process.
+	"""
+	index_dir = accession2taxid_file+".idx"
 
-	return tid
+	if np is None or not os.path.isfile( index_dir+"/meta.json" ):
+		return _SortedAccessionFile( accession2taxid_file )
+
+	with open( index_dir+"/meta.json" ) as f:
+		meta = json.load(f)
+
+	try:
+		current = _fileStamps( [accession2taxid_file] )
+	except OSError:
+		current = None
+	if current != meta["sources"]:
+		sys.stderr.write( "[WARNING] Accession index %s is out of date. Searching %s instead; run \"taxonomy.py index-acc\" to rebuild it.\n" % (index_dir, accession2taxid_file) )
+		return _SortedAccessionFile( accession2taxid_file )
+
+	if DEBUG: sys.stderr.write( "[INFO] Map accession index: %s\n" % index_dir )
+
+	return _AccessionIndex( index_dir, meta )
+
+def _writeAccessionIndex( accession2taxid_file, accs, tids ):
+	keys = np.array( accs, dtype=bytes )
+	order = np.argsort( keys, kind='stable' )
+	keys = keys[order]
+	# keep the first taxid listed for each accession
+	keys, first = np.unique( keys, return_index=True )
+	order = order[first]
+
+	# non-numeric (custom) taxids are kept aside in extra.tsv
+	taxids = np.zeros( len(keys), dtype=np.int32 )
+	extra = {}
+	for (k, i) in enumerate( order.tolist() ):
+		if tids[i].isdigit():
+			taxids[k] = int(tids[i])
+		else:
+			extra[ accs[i] ] = tids[i]
+
+	index_dir = accession2taxid_file+".idx"
+	tmp_dir = "%s.tmp%d" % (index_dir, os.getpid())
+	if os.path.isdir( tmp_dir ): shutil.rmtree( tmp_dir )
+	os.makedirs( tmp_dir )
+
+	np.save( tmp_dir+"/keys.npy", keys )
+	np.save( tmp_dir+"/taxid.npy", taxids )
+	with open( tmp_dir+"/extra.tsv", 'w' ) as f:
+		for acc in sorted(extra):
+			f.write( "%s\t%s\n" % (acc, extra[acc]) )
+	meta = {
+		"accessions" : len(keys),
+		"sources"    : _fileStamps( [accession2taxid_file] )
+	}
+
+	# imported RefSeq catalogs survive a rebuild of the index
+	if os.path.isfile( index_dir+"/meta.json" ):
+		with open( index_dir+"/meta.json" ) as f:
+			catalogs = json.load(f).get("catalogs")
+		if catalogs:
+			meta["catalogs"] = catalogs
+			for col in ("catalog_keys", "catalog_taxid"):
+				shutil.copy( "%s/%s.npy" % (index_dir, col), tmp_dir )
+
+	with open( tmp_dir+"/meta.json", 'w' ) as f:
+		json.dump( meta, f, indent=1 )
+
+	if os.path.isdir( index_dir ): shutil.rmtree( index_dir )
+	os.rename( tmp_dir, index_dir )
+
+	if DEBUG: sys.stderr.write( "[INFO] Accession index written to %s (%d accessions)\n" % (index_dir, len(keys)) )
+
+	return index_dir
+
+def importRefSeqCatalog( refseq_catalog_file, accession2taxid_file=None, seq_type="nc", release=None ):
+	"""
+	Merge a RefSeq catalog (e.g. RefSeq-release215.catalog.gz) into the accession index of
+	accession2taxid_file (default: the accession list in taxonomyDir), so acc2taxid() finds its
+	accessions without loading the catalog at run time. As in loadRefSeqCatelog(), seq_type
+	"nc" keeps nucleotide accessions only. Imports are incremental by release (taken from the
+	file name unless given): a release that is already imported is skipped, and accessions of
+	a newer release replace those of older ones. Catalog taxids take precedence over the
+	accession list. Returns the index directory.
+	"""
+	if np is None:
+		_die( "Importing RefSeq catalog requires numpy.\n" )
+
+	if accession2taxid_file is None:
+		for f in accessionFiles:
+			if os.path.isfile( taxonomyDir+"/"+f ):
+				accession2taxid_file = taxonomyDir+"/"+f
+				break
+		else:
+			_die( "Accession to taxid list (%s) not found in %s.\n" % (" or ".join(accessionFiles), taxonomyDir) )
+
+	if release is None:
+		m = re.search( r"release(\d+)", os.path.basename( refseq_catalog_file ) )
+		release = m.group(1) if m else os.path.basename( refseq_catalog_file )
+	release = str(release)
+
+	index_dir = accession2taxid_file+".idx"
+	if not isinstance( openAccessionLookup( accession2taxid_file ), _AccessionIndex ):
+		compileAccessionIndex( accession2taxid_file )
+
+	with open( index_dir+"/meta.json" ) as f:
+		meta = json.load(f)
+	catalogs = meta.setdefault( "catalogs", {} )
+
+	if release in catalogs and catalogs[release]["seq_type"] == seq_type:
+		if DEBUG: sys.stderr.write( "[INFO] RefSeq release %s is already in %s\n" % (release, index_dir) )
+		return index_dir
+
+	if DEBUG: sys.stderr.write( "[INFO] Import RefSeq catalog: %s\n" % refseq_catalog_file )
+	keys, taxids = _readRefSeqCatalog( refseq_catalog_file, seq_type )
+	imported = len(keys)
+
+	# merge with the releases imported so far; the newest release wins
+	older = [ r for r in catalogs if r != release ]
+	if older:
+		newer = [ r for r in older if _releaseKey(r) > _releaseKey(release) ]
+		old_keys = np.load( index_dir+"/catalog_keys.npy" )
+		old_taxids = np.load( index_dir+"/catalog_taxid.npy" )
+		parts = [ (old_keys, old_taxids), (keys, taxids) ] if newer else [ (keys, taxids), (old_keys, old_taxids) ]
+		keys = np.concatenate( [ k for (k, t) in parts ] )
+		taxids = np.concatenate( [ t for (k, t) in parts ] )
+
+	order = np.argsort( keys, kind='stable' )
+	keys, first = np.unique( keys[order], return_index=True )
+	taxids = taxids[ order[first] ]
+
+	catalogs[release] = {
+		"file"       : os.path.basename( refseq_catalog_file ),
+		"seq_type"   : seq_type,
+		"accessions" : imported
+	}
+
+	# write the catalog columns and meta aside, then swap them in
+	tmp = ".tmp%d" % os.getpid()
+	np.save( index_dir+"/catalog_keys"+tmp+".npy", keys )
+	np.save( index_dir+"/catalog_taxid"+tmp+".npy", taxids )
+	with open( index_dir+"/meta.json"+tmp, 'w' ) as f:
+		json.dump( meta, f, indent=1 )
+	os.rename( index_dir+"/catalog_keys"+tmp+".npy", index_dir+"/catalog_keys.npy" )
+	os.rename( index_dir+"/catalog_taxid"+tmp+".npy", index_dir+"/catalog_taxid.npy" )
+	os.rename( index_dir+"/meta.json"+tmp, index_dir+"/meta.json" )
+
+	if DEBUG: sys.stderr.write( "[INFO] RefSeq release %s imported into %s (%d accessions, %d in catalog)\n" % (release, index_dir, imported, len(keys)) )
+
+	return index_dir
+
+def _readRefSeqCatalog( refseq_catalog_file, seq_type, chunk_lines=10000000 ):
+	"""Accession keys (version numbers removed) and int32 taxids of a RefSeq catalog, read in chunks."""
+	key_chunks = []
+	taxid_chunks = []
+	accs = []
+	tids = []
+	try:
+		if refseq_catalog_file.endswith(".gz"):
+			f = gzip.open( refseq_catalog_file, 'rt' )
+		else:
+			f = open( refseq_catalog_file, 'r' )
+
+		for line in f:
+			temp = line.rstrip('\r\n').split('\t')
+			acc = temp[2]
+			if seq_type == "nc" and ( acc[1] == "P" or acc.startswith("NM_") or acc.startswith("NR_") or acc.startswith("XM_") or acc.startswith("XR_") ):
+				continue
+			accs.append( acc.split('.')[0] )
+			tids.append( int(temp[0]) )
+			if len(accs) == chunk_lines:
+				key_chunks.append( np.array( accs, dtype=bytes ) )
+				taxid_chunks.append( np.array( tids, dtype=np.int32 ) )
+				accs = []
+				tids = []
+
+		f.close()
+	except IOError:
+		_die( "Failed to open custom RefSeq catelog file: %s.\n" % refseq_catalog_file )
+
+	key_chunks.append( np.array( accs, dtype=bytes ) )
+	taxid_chunks.append( np.array( tids, dtype=np.int32 ) )
+	return np.concatenate( key_chunks ), np.concatenate( taxid_chunks )
+
+def _releaseKey( release ):
+	return (0, int(release), "") if release.isdigit() else (1, 0, release)
+
+def _accessionLookup():
+	"""Accession lookup of the first of accessionFiles in taxonomyDir, opened once per process."""
+	global accLookup
+	if accLookup is None:
+		with buildLock:
+			if accLookup is None:
+				for f in accessionFiles:
+					if os.path.isfile( taxonomyDir+"/"+f ):
+						accLookup = openAccessionLookup( taxonomyDir+"/"+f )
+						break
+				else:
+					_die( "Accession to taxid list (%s) not found in %s.\n" % (" or ".join(accessionFiles), taxonomyDir) )
+	return accLookup
 
 def taxid2rank( taxID, guess_strain=True ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2rank( i, guess_strain )
 	taxID = taxid2mergedTid(taxID)
 	if not taxID in taxRanks:
 		return "unknown"
@@ -149,18 +617,45 @@ def taxid2rank( taxID, guess_strain=True ):
 	
 	return taxRanks[taxID]
 
+def taxid2normRank( taxID ):
+	"""
+	Rank of taxID as the report converters list it (one of normRanks): "root" for taxid 1,
+	"unclassified" for unknown taxids, "strain" for a "no rank" node deeper than strainDepth
+	and "other rank" for ranks missing from rankLevel (e.g. clade), which are not reported.
+	normRank2major[] gives its report rank.
+	"""
+	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return normRanks[ _normRanks()[i] ]
+	taxID = taxid2mergedTid( str(taxID) )
+	if taxID == '1':
+		return "root"
+	if not taxID in taxRanks:
+		return "unclassified"
+
+	rank = _normRank( taxRanks[taxID] )
+	if rank == "no rank" and int(taxDepths[taxID]) > strainDepth:
+		return "strain"
+	return rank
+
 def taxid2name( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return taxSnapshot.name(i)
 	taxID = taxid2mergedTid(taxID)
 	return _getTaxName(taxID)
 
 def taxid2depth( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return str(taxSnapshot.d[i])
 	taxID = taxid2mergedTid(taxID)
 	return _getTaxDepth(taxID)
 
 def taxid2type( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2type(i)
 	taxID = taxid2mergedTid(taxID)
 	origID = taxID
 	lastID = taxID
@@ -182,6 +677,8 @@ def taxid2type( taxID ):
 
 def taxid2parent( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2parent(i)
 	taxID = taxid2mergedTid(taxID)
 	taxID = taxParents[taxID]
 	while taxID != '1' and taxRanks[taxID] == 'no rank':
@@ -195,6 +692,9 @@ def taxid2nameOnRank( taxID, r ):
 	if taxID == 1: return "root"
 	if r == "root": return "root"
 
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2nameOnRank( i, r )
+
 	rank = _getTaxRank(taxID)
 	name = _getTaxName(taxID)
 
@@ -212,6 +712,8 @@ def taxid2nameOnRank( taxID, r ):
 
 def taxid2taxidOnRank( taxID, r ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2taxidOnRank( i, r )
 	taxID = taxid2mergedTid(taxID)
 	rank = _getTaxRank(taxID)
 	name = _getTaxName(taxID)
@@ -230,14 +732,93 @@ def taxid2taxidOnRank( taxID, r ):
 	return ""
 
 def taxidIsLeaf( taxID ):
+	i = _tidx(taxID)
+	if i >= 0: return _aIsLeaf(i)
 	taxID = taxid2mergedTid(taxID)
 	if not taxID in taxNumChilds:
 		return True
 	else:
 		return False
 
+def taxidContains( parentTaxID, childTaxID ):
+	"""True if parentTaxID is an ancestor of (or the same as) childTaxID."""
+	_checkTaxonomy()
+	i = _tidx(parentTaxID)
+	j = _tidx(childTaxID)
+	if i >= 0 and j >= 0: return _aContains( i, j )
+	if taxidStatus( parentTaxID ) == "invalid" or taxidStatus( childTaxID ) == "invalid":
+		return False
+	parentTaxID = taxid2mergedTid(parentTaxID)
+	taxID = taxid2mergedTid(childTaxID)
+
+	depth = int( _getTaxDepth(parentTaxID) )
+	while int( _getTaxDepth(taxID) ) > depth:
+		taxID = taxParents[taxID]
+
+	return taxID == parentTaxID
+
+def taxidLCA( taxID1, taxID2 ):
+	"""Lowest common ancestor of two taxids ("" if either is unknown)."""
+	_checkTaxonomy()
+	i = _tidx(taxID1)
+	j = _tidx(taxID2)
+	if i >= 0 and j >= 0:
+		k = _aLCA( i, j )
+		return str(k) if k else ""
+
+	if taxidStatus( taxID1 ) == "invalid" or taxidStatus( taxID2 ) == "invalid":
+		return ""
+	taxID = taxid2mergedTid(taxID1)
+	while not taxidContains( taxID, taxID2 ):
+		if taxID == '1': return ""
+		taxID = taxParents[taxID]
+	return taxID
+
+def taxidsLCA( taxids ):
+	"""
+	Lowest common ancestor of all of taxids ("" if none is known). Unknown taxids are ignored.
+	With the array backend this is one pass over taxids plus one constant-time query.
+	"""
+	_checkTaxonomy()
+	snap = taxSnapshot
+	lo = hi = -1
+	other = []
+	for tid in taxids:
+		i = _tidx(tid)
+		if i < 0:
+			if taxidStatus( str(tid) ) != "invalid": other.append( str(tid) )
+		# the LCA of a set is the LCA of its first and last nodes in pre-order
+		elif lo < 0:
+			lo = hi = i
+		else:
+			pre = _intervals().pr[i]
+			if pre < snap.pr[lo]: lo = i
+			if pre > snap.pr[hi]: hi = i
+
+	lca = ( str( _aLCA( lo, hi ) or "" ) if lo >= 0 else "" )
+	for tid in other:
+		lca = taxidLCA( lca, tid ) if lca else tid
+	return lca
+
+def lcaStream( pairs ):
+	"""
+	For (query, taxid) pairs grouped by query (e.g. alignments of a name-sorted SAM), yield one
+	(query, LCA taxid) per query, in input order, without holding more than one query's hits.
+	"""
+	query = None
+	hits = []
+	for (q, tid) in pairs:
+		if q != query:
+			if hits: yield (query, taxidsLCA( hits ))
+			query = q
+			hits = []
+		hits.append( tid )
+	if hits: yield (query, taxidsLCA( hits ))
+
 def taxid2fullLineage( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2fullLineage(i)
 	taxID = taxid2mergedTid(taxID)
 	fullLineage = ""
 
@@ -252,6 +833,8 @@ def taxid2fullLineage( taxID ):
 
 def taxid2fullLinkDict( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return _aTaxid2fullLinkDict(i)
 	taxID = taxid2mergedTid(taxID)
 	fullLineage = ""
 	link = {}
@@ -269,6 +852,8 @@ def taxid2fullLinkDict( taxID ):
 
 def taxid2nearestMajorTaxid( taxID ):
 	_checkTaxonomy()
+	i = _tidx(taxID)
+	if i >= 0: return str(_aNearestMajor(i))
 	taxID = taxid2mergedTid(taxID)
 	ptid = _getTaxParent( taxID )
 	while ptid != '1':
@@ -289,10 +874,8 @@ def taxid2lineageDICT( tid, print_all_rank=1, print_strain=0, replace_space2unde
 def _taxid2lineage(tid, print_all_rank, print_strain, replace_space2underscore, output_type):
 	_checkTaxonomy()
 
-	if output_type == "DICT":
-		if tid in tidLineageDict: return tidLineageDict[tid]
-	else:
-		if tid in tidLineage: return tidLineage[tid]
+	cached = tidLineageDict.get(tid) if output_type == "DICT" else tidLineage.get(tid)
+	if cached is not None: return cached
 
 	info = _autoVivification()
 	lineage = []
@@ -312,10 +895,15 @@ def _taxid2lineage(tid, print_all_rank, print_strain, replace_space2underscore,
 
 	rank = taxid2rank(taxID)
 	orig_rank = rank
-	name = _getTaxName(taxID)
+	name = taxid2name(taxID)
 	str_name = name
 	if replace_space2underscore: str_name.replace(" ", "_")
 
+	i = _tidx(taxID)
+	if i >= 0:
+		_aLineageLevels( i, orig_rank, level, info )
+		taxID = None
+
 	while taxID:
 		if rank in major_level:
 			if replace_space2underscore: name.replace(" ", "_")
@@ -383,6 +971,549 @@ def _taxid2lineage(tid, print_all_rank, print_strain, replace_space2underscore,
 		tidLineage[tid] = "|".join(lineage)
 		return "|".join(lineage)
 
+#####################
+#  Batch lookups    #
+#####################
+
+# Vectorized versions of the per-taxid lookups for resolving millions of taxids at once
+# (e.g. one per read). They need the array backend (a compiled snapshot, or
+# loadTaxonomy(backend="array")) and return numpy arrays where 0 means "no such taxid".
+
+def taxids2taxidOnRank( taxids, r ):
+	"""Batch taxid2taxidOnRank(): the taxid on rank r for each of taxids (0 if none)."""
+	snap = _checkSnapshot()
+	idx = _taxidArray( taxids )
+
+	if r == "root":
+		return np.where( idx > 0, 1, 0 )
+
+	anc = _rankAncestors( r )[idx]
+	if r == "strain":
+		# same as taxid2taxidOnRank(): a "no rank" node is its own strain
+		anc = np.where( (snap.rank[idx] == snap.norank) & (idx > 0), idx, anc )
+	return anc
+
+def taxids2nameOnRank( taxids, r ):
+	"""Batch taxid2nameOnRank(): the name on rank r for each of taxids ("" if none)."""
+	snap = _checkSnapshot()
+	idx = _taxidArray( taxids )
+
+	if r == "root":
+		return np.where( idx > 0, "root", "" ).astype(object)
+
+	anc = _rankAncestors( r )[idx]
+	if r == "strain":
+		anc = np.where( (snap.nchild[idx] == 0) & (idx > 0), idx, anc )
+	return taxids2name( anc )
+
+def taxids2name( taxids ):
+	"""Batch taxid2name(): names of taxids as an object array ("" for unknown taxids)."""
+	snap = _checkSnapshot()
+	idx = _taxidArray( taxids )
+	# decode each distinct name once
+	uniq, inv = np.unique( idx, return_inverse=True )
+	names = np.array( [ snap.name(i) if i else "" for i in uniq.tolist() ], dtype=object )
+	return names[inv.reshape(idx.shape)]
+
+def taxids2normRank( taxids, major=False ):
+	"""
+	Batch taxid2normRank(): normalized rank codes (indexes into normRanks) of taxids as an
+	int8 array, or with major=True the codes of their report ranks (normRank2major).
+	"""
+	snap = _checkSnapshot()
+	if not snap.fast:
+		codes = np.array( [ normRankCode[ taxid2normRank( str(t) ) ] for t in taxids ], dtype=np.int8 )
+	else:
+		codes = _normRanks()[ _taxidArray( taxids ) ]
+		# custom taxids are not in the column; _taxidArray() moved them to a snapshot ancestor
+		if taxParents.extra:
+			for k in np.flatnonzero( np.char.find( np.asarray( taxids, dtype=str ), "." ) >= 0 ).tolist():
+				codes[k] = normRankCode[ taxid2normRank( str(taxids[k]) ) ]
+
+	if major:
+		return np.array( [ normRankCode[ normRank2major[r] ] for r in normRanks ], dtype=np.int8 )[codes]
+	return codes
+
+def taxids2lineage( taxids, ranks=majorRanks, names=True, output_type="DICT" ):
+	"""
+	Batch lineage lookup. For each rank in ranks, returns the ancestor taxids of taxids on
+	that rank (0 if the lineage has no such rank) and, with names=True, their names under
+	"<rank>_name". The "taxid" column holds the input taxids with merged taxids resolved.
+	output_type="DICT" returns {column: numpy array}; "DATAFRAME" returns a pandas DataFrame.
+	"""
+	_checkSnapshot()
+	idx = _taxidArray( taxids )
+
+	columns = [ "taxid" ]
+	lineage = { "taxid": idx }
+	for r in ranks:
+		lineage[r] = taxids2taxidOnRank( idx, r )
+		columns.append( r )
+		if names:
+			lineage[r+"_name"] = taxids2name( lineage[r] )
+			columns.append( r+"_name" )
+
+	if output_type == "DATAFRAME":
+		import pandas as pd
+		return pd.DataFrame( lineage, columns=columns )
+	return lineage
+
+def taxidsContain( parents, children ):
+	"""
+	Batch taxidContains(): for each (parents[k], children[k]) pair, whether parents[k] is an
+	ancestor of (or the same as) children[k], as a bool array.
+	"""
+	snap = _checkSnapshot()
+	if not snap.fast:
+		return np.array( [ taxidContains( str(p), str(c) ) for (p, c) in zip( parents, children ) ], dtype=bool )
+
+	_intervals()
+	pi = _taxidArray( parents )
+	ci = _taxidArray( children )
+	contains = (snap.pre[pi] <= snap.pre[ci]) & (snap.pre[ci] <= snap.post[pi]) & (pi > 0) & (ci > 0)
+
+	# custom taxids are not in the intervals; _taxidArray() moved them to a snapshot ancestor
+	if taxParents.extra:
+		for k in np.flatnonzero( np.char.find( np.asarray( parents, dtype=str ), "." ) >= 0 ).tolist() \
+		       + np.flatnonzero( np.char.find( np.asarray( children, dtype=str ), "." ) >= 0 ).tolist():
+			contains[k] = taxidContains( str(parents[k]), str(children[k]) )
+	return contains
+
+def taxidsPairLCA( taxids1, taxids2 ):
+	"""
+	Batch taxidLCA(): the lowest common ancestor of each (taxids1[k], taxids2[k]) pair as an
+	int array (0 if either taxid is unknown). Custom taxids are taken as their nearest
+	snapshot ancestor, like in the other batch lookups.
+	"""
+	snap = _checkSnapshot()
+	if not snap.fast:
+		return _taxidArray( [ taxidLCA( str(a), str(b) ) for (a, b) in zip( taxids1, taxids2 ) ] )
+
+	_intervals()
+	a = _taxidArray( taxids1 )
+	b = _taxidArray( taxids2 )
+	known = (a > 0) & (b > 0)
+
+	# lift a until its interval covers b; at most the depth of the tree
+	todo = np.flatnonzero( known )
+	while len(todo):
+		x = a[todo]
+		y = b[todo]
+		inside = (snap.pre[x] <= snap.pre[y]) & (snap.pre[y] <= snap.post[x])
+		todo = todo[~inside]
+		lifted = snap.parent[ a[todo] ]
+		# a root that does not cover b: no common ancestor
+		stuck = lifted == a[todo]
+		a[ todo[stuck] ] = 0
+		todo = todo[~stuck]
+		a[todo] = lifted[~stuck]
+
+	return np.where( known, a, 0 )
+
+def _taxidArray( taxids ):
+	"""
+	Convert taxids (int/str sequence or array) into an int array of snapshot indexes, with
+	merged taxids resolved. Custom taxids map to their nearest snapshot ancestor; unknown
+	taxids map to 0.
+	"""
+	snap = taxSnapshot
+	arr = np.asarray( taxids )
+
+	if arr.dtype.kind in "iuf":
+		idx = arr.astype( np.int64 )
+	else:
+		idx = np.zeros( arr.shape, dtype=np.int64 )
+		flat = idx.reshape(-1)
+		for (k, tid) in enumerate( arr.reshape(-1).tolist() ):
+			tid = str(tid)
+			if not tid.isdigit():
+				# custom taxids (e.g. "562.1") hang below snapshot nodes
+				while tid in taxParents.extra and not tid.isdigit():
+					tid = taxParents.extra[tid]
+			if tid.isdigit():
+				flat[k] = int(tid)
+
+	idx[ (idx < 0) | (idx >= snap.size) ] = 0
+	merged = snap.merged[idx]
+	idx = np.where( merged > 0, merged, idx )
+	idx[ snap.parent[idx] < 0 ] = 0
+	return idx
+
+def _rankAncestors( r ):
+	"""
+	For every snapshot node, its nearest ancestor-or-self whose rank is r (case-insensitive),
+	or 0 if there is none. Taken from the ancestor table if there is one, otherwise built
+	once per rank.
+	"""
+	snap = taxSnapshot
+	c = snap.rankCode.get( r.upper(), -1 )
+	if c in snap.rankAncestors:
+		return snap.rankAncestors[c]
+
+	with buildLock:
+		if c in snap.rankAncestors:
+			return snap.rankAncestors[c]
+		if r.upper() in snap.ancestorCol:
+			anc = snap.ancestors[ :, snap.ancestorCol[r.upper()] ]
+		elif c >= 0:
+			anc = _nearestAncestor( snap.rank == c )
+		else:
+			anc = np.zeros( snap.size, dtype=np.int32 )
+		snap.rankAncestors[c] = anc
+
+	return anc
+
+def _nearestAncestor( match ):
+	"""
+	For every snapshot node, its nearest ancestor-or-self j with match[j] True (0 if none),
+	by walking all nodes up the parent column together.
+	"""
+	snap = taxSnapshot
+	anc = np.zeros( snap.size, dtype=np.int32 )
+	node = np.nonzero( snap.parent >= 0 )[0].astype( np.int32 )
+	cur = node
+	while len(node):
+		hit = match[cur]
+		anc[ node[hit] ] = cur[hit]
+		keep = ~hit & (cur != 1)
+		node = node[keep]
+		cur = snap.parent[ cur[keep] ]
+		# drop nodes whose parent chain leaves the snapshot
+		keep = snap.parent[cur] >= 0
+		node = node[keep]
+		cur = cur[keep]
+	return anc
+
+def _buildAncestors():
+	"""
+	Precompute, for every snapshot node, its ancestor on each of majorRanks, its nearest
+	major-rank ancestor (taxid2nearestMajorTaxid) and its "type" node (taxid2type).
+	Returns the columns keyed by ancestorColumns.
+	"""
+	snap = taxSnapshot
+	present = snap.parent >= 0
+	parent = np.where( present, snap.parent, 0 )
+
+	ancestors = np.zeros( (snap.size, len(majorRanks)), dtype=np.int32 )
+	for (j, r) in enumerate( majorRanks ):
+		c = snap.rankCode.get( r.upper(), -1 )
+		if c >= 0: ancestors[:, j] = _nearestAncestor( snap.rank == c )
+
+	# nearest major rank strictly above each node, root (1) if none
+	isMajor = np.array( snap.major + [False], dtype=bool )
+	nearest = _nearestAncestor( isMajor[snap.rank] & present )[parent]
+	nearest[ nearest == 0 ] = 1
+	nearest[ ~present ] = 0
+
+	# type: the node right below the first species above a node, unless that is the node itself
+	childOfSpecies = _nearestAncestor( (snap.rank[parent] == snap.species) & present & (np.arange(snap.size) != 1) )
+	nodeType = np.where( childOfSpecies != np.arange( snap.size ), childOfSpecies, 0 ).astype( np.int32 )
+
+	return { "rank_ancestor": ancestors, "nearest_major": nearest, "type": nodeType }
+
+def _buildIntervals():
+	"""
+	Number the snapshot nodes in depth-first pre-order. Node i's subtree is then exactly the
+	nodes numbered pre[i]..post[i], so ancestor tests are two comparisons. Returns the
+	columns keyed by intervalColumns.
+	"""
+	snap = taxSnapshot
+	nodes = np.flatnonzero( snap.parent >= 0 )
+	parent = snap.parent
+	isRoot = (parent[nodes] == nodes) | (parent[ np.where( parent[nodes] >= 0, parent[nodes], 0 ) ] < 0)
+
+	# nodes below the roots, level by level
+	below = nodes[ ~isRoot ]
+	below = below[ np.argsort( snap.depth[below], kind='stable' ) ]
+	levels = np.split( below, np.flatnonzero( np.diff( snap.depth[below] ) ) + 1 )
+
+	# subtree sizes, bottom-up
+	size = np.zeros( snap.size, dtype=np.int64 )
+	size[nodes] = 1
+	for level in reversed( levels ):
+		size += np.bincount( parent[level], weights=size[level], minlength=snap.size ).astype( np.int64 )
+
+	# pre-order numbers, top-down: siblings take consecutive blocks after their parent
+	pre = np.zeros( snap.size, dtype=np.int32 )
+	roots = nodes[ isRoot ]
+	pre[roots] = np.cumsum( size[roots] ) - size[roots]
+	for level in levels:
+		if not len(level): continue
+		level = level[ np.argsort( parent[level], kind='stable' ) ]
+		before = np.cumsum( size[level] ) - size[level]
+		first = np.flatnonzero( np.r_[ True, parent[level][1:] != parent[level][:-1] ] )
+		groupStart = np.repeat( before[first], np.diff( np.r_[ first, len(level) ] ) )
+		pre[level] = pre[ parent[level] ] + 1 + (before - groupStart)
+
+	post = (pre + size - 1).astype( np.int32 )
+	post[ snap.parent < 0 ] = -1
+	return { "pre": pre, "post": post }
+
+def _buildNormRanks():
+	"""
+	Normalized rank code (see taxid2normRank) of every snapshot node, with the strain
+	heuristic applied. Returns the column keyed by normRankColumns.
+	"""
+	snap = taxSnapshot
+	noRank = normRankCode["no rank"]
+	code = np.array( [ normRankCode[ _normRank(r) ] for r in snap.ranks ], dtype=np.int8 )
+
+	norm = code[snap.rank]
+	norm[ (norm == noRank) & (snap.depth > strainDepth) ] = normRankCode["strain"]
+	norm[ snap.parent < 0 ] = normRankCode["unclassified"]
+	if snap.size > 1 and snap.parent[1] >= 0:
+		norm[1] = normRankCode["root"]
+	return { "norm_rank": norm }
+
+def _normRank( rank ):
+	"""normRanks entry of a node rank, before the strain heuristic."""
+	if rank in rankLevel and rank not in ("root", "replicon", "unclassified", "other rank"):
+		return rank
+	return "other rank"
+
+def _buildLCA():
+	"""
+	Range-minimum index over node depths in pre-order for taxidLCA(): order (pre-order number
+	-> node), their depths, and a sparse table of the shallowest node of every run of 2^k
+	blocks of lcaBlock positions. Queries scan at most two partial blocks, so the table stays
+	small (a few hundred KB for the full NCBI taxonomy).
+	"""
+	snap = _intervals()
+	nodes = np.flatnonzero( snap.parent >= 0 )
+	order = np.zeros( len(nodes), dtype=np.int32 )
+	order[ snap.pre[nodes] ] = nodes
+	depth = np.asarray( snap.depth )[order]
+
+	# shallowest position of each block, then of each run of 2^k blocks
+	nblock = (len(order) + lcaBlock - 1) // lcaBlock
+	padded = np.full( nblock*lcaBlock, np.iinfo(depth.dtype).max, dtype=depth.dtype )
+	padded[:len(depth)] = depth
+	table = [ np.argmin( padded.reshape( nblock, lcaBlock ), axis=1 ) + np.arange( nblock )*lcaBlock ]
+	k = 1
+	while (1 << k) <= nblock:
+		prev = table[-1]
+		half = 1 << (k-1)
+		left = prev[:len(prev)-half]
+		right = prev[half:]
+		table.append( np.where( depth[right] < depth[left], right, left ) )
+		k += 1
+
+	return { "order": order, "depth": depth, "table": table }
+
+def _intervals():
+	"""Pre/post-order columns of the snapshot, numbered on first use unless compiled in."""
+	snap = taxSnapshot
+	if snap.pre is None:
+		with buildLock:
+			if snap.pre is None:
+				if DEBUG: sys.stderr.write( "[INFO] Number taxonomy nodes in pre-order\n" )
+				snap.useIntervals( _buildIntervals() )
+	return snap
+
+def _normRanks():
+	"""Normalized rank column of the snapshot, built on first use unless compiled in."""
+	snap = taxSnapshot
+	if snap.normRank is None:
+		with buildLock:
+			if snap.normRank is None:
+				snap.normRank = _buildNormRanks()["norm_rank"]
+	return snap.normRank
+
+#####################
+#   Array backend   #
+#####################
+
+# Lookups on a snapshot (see compileTaxonomy/loadTaxonomy) walk the integer columns
+# directly instead of going through the string-keyed views. Each _a* function below
+# mirrors the public function of the same name, including its return values.
+
+def _tidx( taxID ):
+	"""
+	Index of taxID in the array backend with merged taxids resolved, or -1 if the array
+	backend is not in use or taxID is not a snapshot node (e.g. a custom taxid).
+	"""
+	snap = taxSnapshot
+	if snap is None or not snap.fast:
+		return -1
+	try:
+		if isinstance( taxID, str ) and not taxID.isdigit():
+			return -1
+		i = int(taxID)
+	except (TypeError, ValueError):
+		return -1
+	if i <= 0 or i >= snap.size:
+		return -1
+	if snap.m[i]:
+		i = snap.m[i]
+	if snap.p[i] < 0:
+		return -1
+	return i
+
+def _aTaxid2rank( i, guess_strain ):
+	snap = taxSnapshot
+	if i == 1:
+		return "root"
+	c = snap.r[i]
+	if c == snap.norank and guess_strain:
+		# a leaf taxonomy is a strain
+		if _aIsLeaf(i):
+			return "strain"
+		elif snap.r[_aNearestMajor(i)] == snap.species:
+			return "species - others"
+		else:
+			return "others"
+	return snap.ranks[c]
+
+def _aIsLeaf( i ):
+	if taxSnapshot.c[i]:
+		return False
+	# custom taxonomy may hang new nodes under a snapshot node
+	return not ( taxNumChilds.extra and str(i) in taxNumChilds.extra )
+
+def _aTaxid2type( i ):
+	snap = taxSnapshot
+	if snap.ancestors is not None:
+		return str(snap.t[i]) if snap.t[i] else 0
+
+	lastID = i
+	tid = snap.p[i]
+	while tid != 1 and snap.r[tid] != snap.species:
+		lastID = tid
+		tid = snap.p[tid]
+
+	if snap.r[tid] != snap.species or lastID == i:
+		return 0
+	return str(lastID)
+
+def _aContains( i, j ):
+	snap = _intervals()
+	return snap.pr[i] <= snap.pr[j] <= snap.po[i]
+
+def _aLCA( i, j ):
+	snap = _intervals()
+	if snap.lca is None:
+		with buildLock:
+			if snap.lca is None:
+				snap.lca = _buildLCA()
+	pi = snap.pr[i]
+	pj = snap.pr[j]
+	if pi > pj:
+		(i, j, pi, pj) = (j, i, pj, pi)
+	if pj <= snap.po[i]:
+		return i
+
+	# the shallowest node in pre-order (pi, pj] is the child of the LCA on the path to j
+	lca = snap.lca
+	depth = lca["depth"]
+	l = pi+1
+	r = pj
+	bl = l // lcaBlock
+	br = r // lcaBlock
+	if bl == br:
+		m = l + int( np.argmin( depth[l:r+1] ) )
+	else:
+		m = l + int( np.argmin( depth[l:(bl+1)*lcaBlock] ) )
+		m2 = br*lcaBlock + int( np.argmin( depth[br*lcaBlock:r+1] ) )
+		if depth[m2] < depth[m]: m = m2
+		if br - bl > 1:
+			k = (br - bl - 1).bit_length() - 1
+			table = lca["table"][k]
+			for m2 in ( table[bl+1], table[br-(1 << k)] ):
+				if depth[m2] < depth[m]: m = int(m2)
+
+	if depth[m] == 0:
+		return 0
+	return snap.p[ lca["order"][m] ]
+
+def _aTaxid2parent( i ):
+	snap = taxSnapshot
+	tid = snap.p[i]
+	while tid != 1 and snap.r[tid] == snap.norank:
+		tid = snap.p[tid]
+	return str(tid)
+
+def _aNearestMajor( i ):
+	snap = taxSnapshot
+	if snap.ancestors is not None:
+		return snap.nm[i]
+
+	tid = snap.p[i]
+	while tid != 1:
+		if snap.major[snap.r[tid]]:
+			return tid
+		tid = snap.p[tid]
+	return 1
+
+def _aTaxid2nameOnRank( i, r ):
+	snap = taxSnapshot
+	if r == "strain" and _aIsLeaf(i):
+		return snap.name(i)
+
+	if r.upper() in snap.ancestorCol:
+		a = snap.a[ i*snap.na + snap.ancestorCol[r.upper()] ]
+		return snap.name(a) if a else ""
+
+	c = snap.rankCode.get( r.upper(), -1 )
+	while True:
+		if snap.r[i] == c: return snap.name(i)
+		if i == 1: break
+		i = snap.p[i]
+
+	return ""
+
+def _aTaxid2taxidOnRank( i, r ):
+	snap = taxSnapshot
+	rank = snap.ranks[snap.r[i]]
+	if r == rank or ( r == 'strain' and rank == 'no rank'): return str(i)
+	if r == "root": return 1
+
+	if r.upper() in snap.ancestorCol:
+		a = snap.a[ i*snap.na + snap.ancestorCol[r.upper()] ]
+		return str(a) if a else ""
+
+	c = snap.rankCode.get( r.upper(), -1 )
+	while True:
+		if snap.r[i] == c: return str(i)
+		if i == 1: break
+		i = snap.p[i]
+
+	return ""
+
+def _aTaxid2fullLineage( i ):
+	snap = taxSnapshot
+	fullLineage = ""
+	while i != 1:
+		name = snap.name(i)
+		if not name: break
+		fullLineage += "%s|%s|%s|"%(snap.ranks[snap.r[i]],i,name)
+		i = snap.p[i]
+	return fullLineage
+
+def _aTaxid2fullLinkDict( i ):
+	snap = taxSnapshot
+	link = {}
+	while i != 1:
+		if not snap.name(i): break
+		parID = snap.p[i]
+		link[str(parID)] = str(i)
+		i = parID
+	return link
+
+def _aLineageLevels( i, orig_rank, level, info ):
+	"""Fill the major rank names/taxids of the lineage of i into level and info (see _taxid2lineage)."""
+	snap = taxSnapshot
+	rank = orig_rank
+	while True:
+		if rank in major_level:
+			name = snap.name(i)
+			level[major_level[rank]] = name
+			info[rank]["name"] = name
+			info[rank]["taxid"] = str(i)
+		i = snap.p[i]
+		if i == 1: break
+		c = snap.r[i]
+		rank = snap.ranks[c] if snap.major[c] else None
+
 def _getTaxDepth( taxID ):
 	taxID = taxid2mergedTid(taxID)
 	return taxDepths[taxID]
@@ -419,6 +1550,10 @@ def _getTaxRank( taxID ):
 #		_die( "Failed to open custom taxonomy file: %s.\n" % custom_taxonomy_file )
 
 def loadRefSeqCatelog( refseq_catelog_file, seq_type="nc" ):
+	"""
+	Load a RefSeq catalog into memory for acc2taxid(). This reads the whole catalog on every
+	run; importRefSeqCatalog() merges it into the accession index once instead.
+	"""
 	try:
 		if refseq_catelog_file.endswith(".gz"):
 			#p = subprocess.Popen(["zcat", refseq_catelog_file], stdout = subprocess.PIPE)
@@ -434,23 +1569,336 @@ def loadRefSeqCatelog( refseq_catelog_file, seq_type="nc" ):
 			if seq_type == "nc" and ( acc[1] == "P" or acc.startswith("NM_") or acc.startswith("NR_") or acc.startswith("XM_") or acc.startswith("XR_") ):
 				continue
 			else:
-				accTid[acc] = temp[0]
+				# acc2taxid() looks accessions up without version number
+				accCatalog[ acc.split('.')[0] ] = temp[0]
 
 		f.close()
 	except IOError:
 		_die( "Failed to open custom RefSeq catelog file: %s.\n" % refseq_catelog_file )
 
-def loadTaxonomy( dbpath=taxonomyDir ):
-	global taxonomyDir
+def loadTaxonomy( dbpath=taxonomyDir, backend="auto", precompute=False, daemon=True, custom=None ):
+	"""
+	Load taxonomy from dbpath. If a lookup service for dbpath is running (see serve()) on
+	$TAXONOMY_SOCKET or dbpath/taxonomy.sock and daemon is True, lookups are forwarded to
+	it and nothing is loaded. Otherwise backend selects how the tree is held in memory:
+	  "auto"  - memory-map the compiled snapshot if there is one, otherwise parse into dicts
+	  "array" - integer-indexed arrays; the memory-mapped snapshot or built from the text files
+	  "dict"  - always parse the text files into string-keyed dicts
+	Either way names stay on disk (snapshot name blob or taxonomy.tsv, memory-mapped) and are
+	only decoded by lookups that return them.
+	With precompute=True the array backend builds the per-rank ancestor table and pre-order
+	intervals (unless the snapshot already carries them) so rank, nearest-major, type and
+	ancestor (taxidContains) lookups become O(1).
+	Custom taxonomy is loaded as an overlay (see loadCustomTaxonomy()) from custom, or from
+	dbpath/taxonomy.custom.tsv by default; a per-project custom file is never sent to a
+	lookup service, so the base taxonomy is then loaded in-process.
+	"""
+	global taxonomyDir, accLookup
 
 	if dbpath:
 		taxonomyDir = dbpath
 
+	# accession lookups reopen their files under the new taxonomyDir
+	accLookup = None
+	for cache in lookupCaches:
+		cache.clear()
+
+	_useDaemon( None )
+	if daemon and backend == "auto" and not custom:
+		client = _connectDaemon( os.environ.get( "TAXONOMY_SOCKET", taxonomyDir+"/"+socketName ) )
+		if client:
+			_useDaemon( client )
+			return
+
 	if DEBUG: sys.stderr.write( "[INFO] Open taxonomy files from: %s\n"% taxonomyDir )
 
+	#parsed taxonomy tsv file
+	cus_taxonomy_file = custom or taxonomyDir+"/taxonomy.custom.tsv"
+
+	# try to load the compiled snapshot (see compileTaxonomy()) before parsing text files
+	if backend == "dict" or not _loadSnapshot( taxonomyDir+"/"+snapshotDirName ):
+		_loadTaxonomyText()
+		if backend == "array":
+			if np is None:
+				_die( "Array taxonomy backend requires numpy.\n" )
+			_useSnapshot( *_buildSnapshot() )
+
+	# try to load custom taxonomy from taxonomy.custom.tsv
+	if custom or os.path.isfile( cus_taxonomy_file ):
+		loadCustomTaxonomy( cus_taxonomy_file )
+
+	if precompute and taxSnapshot and taxSnapshot.ancestors is None:
+		if DEBUG: sys.stderr.write( "[INFO] Precompute taxonomy ancestor table\n" )
+		taxSnapshot.meta["ancestorRanks"] = list( majorRanks )
+		taxSnapshot.useAncestors( _buildAncestors() )
+	if precompute and taxSnapshot:
+		_intervals()
+		_normRanks()
+
+	if DEBUG: sys.stderr.write( "[INFO] Done parsing taxonomy.tab (%d taxons loaded)\n" % len(taxParents) )
+
+	if taxParents["2"] == "1":
+		_die( "Local taxonomy database is out of date." )
+
+def loadCustomTaxonomy( custom_taxonomy_file, replace=True ):
+	"""
+	Load custom taxonomy (taxonomy.tsv format: taxid, depth, parent, rank, name) as an overlay
+	on the loaded base taxonomy. Lookups check the overlay first; the base tables (e.g. a
+	shared, memory-mapped snapshot) are not modified, so each project can load its own custom
+	strains without reloading the base. With replace=True the previous overlay is dropped.
+	"""
+	_checkOverlay()
+	if replace:
+		clearCustomTaxonomy()
+
+	if DEBUG: sys.stderr.write( "[INFO] Open custom taxonomy node file: %s\n"% custom_taxonomy_file)
+	try:
+		with open(custom_taxonomy_file) as f:
+			for line in f:
+				tid, depth, parent, rank, name = line.rstrip('\r\n').split('\t')
+				_overlayTaxon( tid, depth, parent, rank, name )
+			f.close()
+	except IOError:
+		_die( "Failed to open custom taxonomy file: %s.\n" % custom_taxonomy_file )
+
+	_overlayChanged()
+
+def addCustomTaxon( taxID, name, parent=None, rank="no rank" ):
+	"""
+	Add one node to the custom taxonomy overlay. A strain-style taxid "PARENT.SID" (e.g.
+	"562.1") hangs below PARENT unless parent is given.
+	"""
+	_checkOverlay()
+	if parent is None:
+		parent = taxID.split('.')[0]
+	parent = taxid2mergedTid(parent)
+	if not parent in taxParents:
+		_die( "Parent taxid %s of custom taxon %s not found.\n" % (parent, taxID) )
+
+	_overlayTaxon( taxID, str( int(taxDepths[parent])+1 ), parent, rank, name )
+	_overlayChanged()
+
+def clearCustomTaxonomy():
+	"""Drop the custom taxonomy overlay, leaving the base taxonomy."""
+	if not taxOverlay:
+		return
+	for (table, key, had, value) in reversed( taxOverlay ):
+		if had:
+			table[key] = value
+		else:
+			del table[key]
+	del taxOverlay[:]
+	_overlayChanged()
+
+def compileTaxonomy( dbpath=taxonomyDir, ancestors=True ):
+	"""
+	Compile taxonomy.tsv (or names.dmp/nodes.dmp) and the merged taxids under dbpath into a
+	binary snapshot (dbpath/taxonomy.snapshot/) that loadTaxonomy() memory-maps instead of
+	parsing the text files. Custom taxonomy (taxonomy.custom.tsv) is not compiled; it is still
+	loaded on top of the snapshot. The pre-order intervals for ancestor tests and the
+	normalized ranks (taxid2normRank) are saved with it, and with ancestors=True the per-rank
+	ancestor table as well. Taxonomy parsed from the
+	dump files is also written out as dbpath/taxonomy.tsv.
+	"""
+	global taxonomyDir
+
+	if np is None:
+		_die( "Compiling taxonomy snapshot requires numpy.\n" )
+
+	if dbpath:
+		taxonomyDir = dbpath
+
+	sources = _loadTaxonomyText()
+
+	# dumps are only parsed once: save them as taxonomy.tsv next to the snapshot
+	if "nodes.dmp" in sources:
+		_writeTaxonomyTsv( taxonomyDir+"/taxonomy.tsv" )
+		sources = _fileStamps( [taxonomyDir+"/taxonomy.tsv"] + [taxonomyDir+"/"+f for f in sources if not f in ("names.dmp", "nodes.dmp")] )
+
+	return _writeSnapshot( sources, ancestors )
+
+def updateTaxonomy( dump_dir, dbpath=taxonomyDir, report_file=None ):
+	"""
+	Bring the taxonomy under dbpath up to a new NCBI release: read names.dmp, nodes.dmp and
+	merged.dmp from dump_dir, rewrite taxonomy.tsv/taxonomy.merged.tsv and the snapshot, and
+	write a change report (default: dbpath/taxonomy.update.json) listing the added, removed,
+	re-parented, renamed, re-ranked and merged taxids, plus every taxid whose lineage or rank
+	lookups may have changed ("lineage_changed"; see invalidateLineages()). Returns the report.
+	"""
+	global taxonomyDir, taxMerged
+
+	if np is None:
+		_die( "Updating taxonomy snapshot requires numpy.\n" )
+
+	if dbpath:
+		taxonomyDir = dbpath
+
+	_loadTaxonomyText()
+	oldParents = dict( taxParents )
+	oldRanks   = dict( taxRanks )
+	oldNames   = taxNames
+	oldMerged  = dict( taxMerged )
+
+	_resetTaxonomy()
+	if DEBUG: sys.stderr.write( "[INFO] Open taxonomy dump files in: %s\n"% dump_dir )
+	try:
+		_loadTaxonomyDmp( dump_dir+"/names.dmp", dump_dir+"/nodes.dmp" )
+	except IOError:
+		_die( "Failed to open taxonomy files (nodes.dmp and names.dmp) in %s.\n" % dump_dir )
+	if os.path.isfile( dump_dir+"/merged.dmp" ):
+		_loadMergedDmp( dump_dir+"/merged.dmp" )
+	else:
+		taxMerged = oldMerged
+
+	report = {
+		"added"      : sorted( (tid for tid in taxParents if not tid in oldParents), key=int ),
+		"removed"    : sorted( (tid for tid in oldParents if not tid in taxParents), key=int ),
+		"reparented" : [ [tid, oldParents[tid], taxParents[tid]] for tid in sorted( taxParents, key=int ) if tid in oldParents and oldParents[tid] != taxParents[tid] ],
+		"renamed"    : [ [tid, oldNames.get(tid, ""), taxNames.get(tid, "")] for tid in sorted( taxParents, key=int ) if tid in oldParents and oldNames.get(tid) != taxNames.get(tid) ],
+		"reranked"   : [ [tid, oldRanks[tid], taxRanks[tid]] for tid in sorted( taxParents, key=int ) if tid in oldParents and oldRanks[tid] != taxRanks[tid] ],
+		"merged"     : [ [mtid, taxMerged[mtid]] for mtid in sorted( taxMerged, key=int ) if oldMerged.get(mtid) != taxMerged[mtid] ]
+	}
+
+	_writeTaxonomyTsv( taxonomyDir+"/taxonomy.tsv" )
+	_writeMergedTsv( taxonomyDir+"/taxonomy.merged.tsv" )
+	sources = _fileStamps( [taxonomyDir+"/taxonomy.tsv", taxonomyDir+"/taxonomy.merged.tsv"] )
+	snapshot_dir = _writeSnapshot( sources, ancestors=True )
+
+	# lineages change below every moved, renamed or re-ranked node; the leaf status (strain
+	# guess of taxid2rank) may change for parents that gain or lose children
+	snap = _intervals()
+	moved = [ int(row[0]) for key in ("reparented", "renamed", "reranked") for row in report[key] ]
+	cover = np.zeros( snap.size+1, dtype=np.int64 )
+	np.add.at( cover, snap.pre[moved], 1 )
+	np.add.at( cover, snap.post[moved]+1, -1 )
+	nodes = np.flatnonzero( snap.parent >= 0 )
+	changed = set( str(i) for i in nodes[ np.cumsum(cover)[ snap.pre[nodes] ] > 0 ].tolist() )
+	changed.update( report["removed"] )
+	changed.update( row[0] for row in report["merged"] )
+	changed.update( taxParents[tid] for tid in report["added"] )
+	changed.update( oldParents[tid] for tid in report["removed"] if oldParents[tid] in taxParents )
+	changed.update( row[p] for row in report["reparented"] for p in (1, 2) if row[p] in taxParents )
+	report["lineage_changed"] = sorted( changed, key=int )
+
+	report_file = report_file or taxonomyDir+"/taxonomy.update.json"
+	with open( report_file, 'w' ) as f:
+		json.dump( report, f, indent=1 )
+
+	invalidateLineages( report["lineage_changed"] )
+
+	if DEBUG: sys.stderr.write( "[INFO] Taxonomy updated: %d added, %d removed, %d re-parented, %d renamed, %d merged; %d lineages changed\n" % (
+		len(report["added"]), len(report["removed"]), len(report["reparented"]), len(report["renamed"]), len(report["merged"]), len(report["lineage_changed"])) )
+
+	return report
+
+def invalidateLineages( taxids ):
+	"""Drop the cached lineages of taxids, e.g. the "lineage_changed" list of an update report."""
+	for tid in taxids:
+		tidLineage.discard( tid )
+		tidLineageDict.discard( tid )
+
+def _writeSnapshot( sources, ancestors ):
+	"""Build the snapshot of the loaded (text) taxonomy, swap it in and switch to it."""
+	meta, columns, names = _buildSnapshot()
+	meta["sources"] = sources
+
+	_useSnapshot( meta, columns, names )
+	meta["intervals"] = True
+	columns.update( _buildIntervals() )
+	meta["normRanks"] = [ list( normRanks ), strainDepth ]
+	columns.update( _buildNormRanks() )
+	if ancestors:
+		meta["ancestorRanks"] = list( majorRanks )
+		columns.update( _buildAncestors() )
+
+	snapshot_dir = taxonomyDir+"/"+snapshotDirName
+	tmp_dir = "%s.tmp%d" % (snapshot_dir, os.getpid())
+	if os.path.isdir( tmp_dir ): shutil.rmtree( tmp_dir )
+	os.makedirs( tmp_dir )
+
+	for col in snapshotColumns + ancestorColumns + intervalColumns + normRankColumns:
+		if col in columns: np.save( "%s/%s.npy" % (tmp_dir, col), columns[col] )
+	with open( tmp_dir+"/names.bin", 'wb' ) as f:
+		f.write( names )
+	with open( tmp_dir+"/meta.json", 'w' ) as f:
+		json.dump( meta, f, indent=1 )
+
+	# swap the new snapshot in; processes that mapped the old one keep their open pages
+	if os.path.isdir( snapshot_dir ): shutil.rmtree( snapshot_dir )
+	os.rename( tmp_dir, snapshot_dir )
+
+	if DEBUG: sys.stderr.write( "[INFO] Taxonomy snapshot written to %s (%d taxons)\n" % (snapshot_dir, len(taxParents)) )
+
+	return snapshot_dir
+
+def _buildSnapshot():
+	"""Build snapshot columns from the parsed lookup dicts. Returns (meta, columns, name blob)."""
+	size = 2
+	for tid in taxParents:
+		if not tid.isdigit():
+			_die( "Can not compile non-numeric taxid: %s.\n" % tid )
+		if int(tid) >= size: size = int(tid)+1
+		if int(taxParents[tid]) >= size: size = int(taxParents[tid])+1
+	for mtid in taxMerged:
+		if int(mtid) >= size: size = int(mtid)+1
+
+	ranks = sorted( set( taxRanks.values() ) )
+	rankCode = dict( (r, i) for i, r in enumerate(ranks) )
+
+	columns = {
+		"parent"      : np.full( size, -1, dtype=np.int32 ),
+		"depth"       : np.zeros( size, dtype=np.int16 ),
+		"rank"        : np.zeros( size, dtype=np.uint8 ),
+		"nchild"      : np.zeros( size, dtype=np.int32 ),
+		"merged"      : np.zeros( size, dtype=np.int32 ),
+		"name_offset" : np.zeros( size+1, dtype=np.int64 )
+	}
+	parent = columns["parent"]
+	depth  = columns["depth"]
+	rank   = columns["rank"]
+
+	for tid in taxParents:
+		i = int(tid)
+		parent[i] = int(taxParents[tid])
+		depth[i]  = int(taxDepths[tid])
+		rank[i]   = rankCode[taxRanks[tid]]
+	for tid in taxNumChilds:
+		if tid.isdigit(): columns["nchild"][int(tid)] = taxNumChilds[tid]
+	for mtid in taxMerged:
+		columns["merged"][int(mtid)] = int(taxMerged[mtid])
+
+	# name table: one utf-8 blob, taxid i owns bytes offset[i]:offset[i+1]
+	names = []
+	offset = columns["name_offset"]
+	pos = 0
+	for i in range(size):
+		offset[i] = pos
+		tid = str(i)
+		if tid in taxNames:
+			name = taxNames[tid].encode('utf-8')
+			names.append( name )
+			pos += len(name)
+	offset[size] = pos
+
+	meta = {
+		"version" : snapshotVersion,
+		"size"    : size,
+		"taxa"    : len(taxParents),
+		"ranks"   : ranks
+	}
+
+	return meta, columns, b"".join(names)
+
+def _loadTaxonomyText():
+	"""
+	Parse taxonomy.tsv (or names.dmp/nodes.dmp) and the merged taxids into the lookup dicts.
+	Returns {file: [size, mtime]} of the parsed files.
+	"""
+	# start from empty tables, not on top of an earlier load
+	_resetTaxonomy()
+
 	#parsed taxonomy tsv file
 	taxonomy_file = taxonomyDir+"/taxonomy.tsv"
-	cus_taxonomy_file = taxonomyDir+"/taxonomy.custom.tsv"
 	merged_taxonomy_file = taxonomyDir+"/taxonomy.merged.tsv"
 
 	#raw taxonomy dmp files from NCBI
@@ -458,73 +1906,24 @@ def loadTaxonomy( dbpath=taxonomyDir ):
 	nodes_dmp_file = taxonomyDir+"/nodes.dmp"
 	merged_dmp_file = taxonomyDir+"/merged.dmp"
 
+	parsed = []
+
 	# try to load taxonomy from taxonomy.tsv
 	if os.path.isfile( taxonomy_file ):
 		if DEBUG: sys.stderr.write( "[INFO] Open taxonomy file: %s\n"% taxonomy_file )
 		try:
-			with open(taxonomy_file) as f:
-				for line in f:
-					tid, depth, parent, rank, name = line.rstrip('\r\n').split('\t')
-					taxParents[tid] = parent
-					taxDepths[tid] = depth
-					taxRanks[tid] = rank
-					taxNames[tid] = name
-					if parent in taxNumChilds:
-						taxNumChilds[parent] += 1
-					else:
-						taxNumChilds[parent] = 1
-				f.close()
+			_loadTaxonomyTsv( taxonomy_file, lazy_names=True )
+			parsed.append( taxonomy_file )
 		except IOError:
 			_die( "Failed to open taxonomy file: %s.\n" % taxonomy_file )
 	else:
+		if DEBUG: sys.stderr.write( "[INFO] Open taxonomy dump files: %s, %s\n"% (names_dmp_file, nodes_dmp_file) )
 		try:
-			# read name from names.dmp
-			if DEBUG: sys.stderr.write( "[INFO] Open taxonomy name file: %s\n"% names_dmp_file )
-			with open(names_dmp_file) as f:
-				for line in f:
-					tid, name, tmp, nametype = line.rstrip('\r\n').split('\t|\t')
-					if not nametype.startswith("scientific name"):
-						continue 
-					taxNames[tid] = name
-				f.close()
-			
-			# read taxonomy info from nodes.dmp
-			if DEBUG: sys.stderr.write( "[INFO] Open taxonomy node file: %s\n"% nodes_dmp_file )
-			with open(nodes_dmp_file) as f:
-				for line in f:
-					fields = line.rstrip('\r\n').split('\t|\t')
-					tid = fields[0]
-					parent = fields[2]
-					taxParents[tid] = fields[1]
-					taxDepths[tid] = taxDepths[parent]+1 if parent in taxDepths else 0 # could have potiential bug if child node is parsed before parent node.
-					taxRanks[tid] = parent
-					if parent in taxNumChilds:
-						taxNumChilds[tid] += 1
-					else:
-						taxNumChilds[tid] = 1
-				f.close()
+			_loadTaxonomyDmp( names_dmp_file, nodes_dmp_file )
+			parsed.extend( [names_dmp_file, nodes_dmp_file] )
 		except IOError:
 			_die( "Failed to open taxonomy files (taxonomy.tsv, nodes.dmp and names.dmp).\n" )
 
-	# try to load custom taxonomy from taxonomy.custom.tsv
-	if os.path.isfile( cus_taxonomy_file ):
-		if DEBUG: sys.stderr.write( "[INFO] Open custom taxonomy node file: %s\n"% cus_taxonomy_file)
-		try:
-			with open(cus_taxonomy_file) as f:
-				for line in f:
-					tid, depth, parent, rank, name = line.rstrip('\r\n').split('\t')
-					taxParents[tid] = parent
-					taxDepths[tid] = depth
-					taxRanks[tid] = rank
-					taxNames[tid] = name
-					if parent in taxNumChilds:
-						taxNumChilds[parent] += 1
-					else:
-						taxNumChilds[parent] = 1
-				f.close()
-		except IOError:
-			_die( "Failed to open custom taxonomy file: %s.\n" % cus_taxonomy_file )
-
 	#try to load merged taxids
 	if os.path.isfile( merged_taxonomy_file ):
 		if DEBUG: sys.stderr.write( "[INFO] Open merged taxonomy node file: %s\n"% merged_taxonomy_file )
@@ -533,20 +1932,606 @@ def loadTaxonomy( dbpath=taxonomyDir ):
 				mtid, tid = line.rstrip('\r\n').split('\t')
 				taxMerged[mtid] = tid
 			f.close()
+		parsed.append( merged_taxonomy_file )
 	elif os.path.isfile( merged_dmp_file ):
 		if DEBUG: sys.stderr.write( "[INFO] Open merged taxonomy node file: %s\n"% merged_dmp_file )
-		with open(merged_dmp_file) as f:
+		_loadMergedDmp( merged_dmp_file )
+		parsed.append( merged_dmp_file )
+
+	return _fileStamps( parsed )
+
+def _resetTaxonomy():
+	global taxSnapshot, taxDepths, taxParents, taxRanks, taxNames, taxMerged, taxNumChilds
+
+	del taxOverlay[:]
+	taxSnapshot  = None
+	taxDepths    = {}
+	taxParents   = {}
+	taxRanks     = {}
+	taxNames     = {}
+	taxMerged    = {}
+	taxNumChilds = {}
+
+def _loadMergedDmp( merged_dmp_file ):
+	with open(merged_dmp_file) as f:
+		for line in f:
+			fields = line.rstrip('\r\n').split('\t')
+			mtid = fields[0]
+			tid = fields[2]
+			taxMerged[mtid] = tid
+		f.close()
+
+def _loadTaxonomyTsv( taxonomy_file, lazy_names=False ):
+	"""
+	Parse a taxonomy tsv file into the lookup dicts. With lazy_names (and numpy) the names are
+	not read: their offsets are found from the tab positions of the whole file at once, only
+	the first four columns of each line are decoded, and taxNames becomes a _LazyNames view
+	that decodes a name from the file when it is looked up.
+	"""
+	global taxNames
+
+	cuts = _nameColumns( taxonomy_file ) if lazy_names and np is not None else None
+
+	with open(taxonomy_file, 'rb') as f:
+		if cuts is None:
 			for line in f:
-				fields = line.rstrip('\r\n').split('\t')
-				mtid = fields[0]
-				tid = fields[2]
-				taxMerged[mtid] = tid
-			f.close()
+				tid, depth, parent, rank, name = line.decode('utf-8').rstrip('\r\n').split('\t')
+				taxParents[tid] = parent
+				taxDepths[tid] = depth
+				taxRanks[tid] = rank
+				taxNames[tid] = name
+				if parent in taxNumChilds:
+					taxNumChilds[parent] += 1
+				else:
+					taxNumChilds[parent] = 1
+			return
+
+		names = _LazyNames( taxonomy_file )
+		tids = []
+		for (line, cut) in zip( f, cuts[1].tolist() ):
+			tid, depth, parent, rank = line[:cut].decode('utf-8').split('\t')
+			tids.append( tid )
+			taxParents[tid] = parent
+			taxDepths[tid] = depth
+			taxRanks[tid] = rank
+			if parent in taxNumChilds:
+				taxNumChilds[parent] += 1
+			else:
+				taxNumChilds[parent] = 1
+
+	tids = np.array( tids )
+	numeric = np.char.isdigit( tids )
+	names.index( tids[numeric].astype( np.int64 ), cuts[0][numeric] )
+	# custom (non-numeric) taxids keep their names in the dict
+	for k in np.flatnonzero( ~numeric ).tolist():
+		names.extra[ str(tids[k]) ] = names.decode( int(cuts[0][k]) )
+	taxNames = names
+
+def _nameColumns( taxonomy_file ):
+	"""
+	(name offsets in the file, name offsets in their lines minus one) of the lines of a
+	taxonomy tsv file, or None if some line does not have exactly five columns.
+	"""
+	with open( taxonomy_file, 'rb' ) as f:
+		if not os.path.getsize( taxonomy_file ):
+			return ( np.zeros( 0, dtype=np.int64 ), np.zeros( 0, dtype=np.int64 ) )
+		mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+	buf = np.frombuffer( mm, dtype=np.uint8 )
+	lineStart = np.flatnonzero( buf == 10 ) + 1
+	lineStart = np.concatenate( ( [0], lineStart[ lineStart < len(buf) ] ) )
+	tabs = np.flatnonzero( buf == 9 )
+	if len(tabs) != 4*len(lineStart):
+		return None
+	nameStart = tabs[3::4] + 1
+	if np.any( tabs[0::4] < lineStart ) or np.any( lineStart[1:] <= nameStart[:-1] ):
+		return None
+	return ( nameStart, nameStart - lineStart - 1 )
+
+def _overlayTaxon( tid, depth, parent, rank, name ):
+	_overlaySet( taxParents, tid, parent )
+	_overlaySet( taxDepths, tid, depth )
+	_overlaySet( taxRanks, tid, rank )
+	_overlaySet( taxNames, tid, name )
+	_overlaySet( taxNumChilds, parent, taxNumChilds.get( parent, 0 )+1 )
+
+def _overlaySet( table, key, value ):
+	"""Set table[key] and log the previous entry so clearCustomTaxonomy() can undo it."""
+	# views keep overlay entries in their extra dict, over the untouched base columns
+	store = table.extra if isinstance( table, (_SnapshotMap, _LazyNames) ) else table
+	taxOverlay.append( (store, key, key in store, store.get(key)) )
+	store[key] = value
+
+def _overlayChanged():
+	# cached lineages may run through overlay nodes
+	tidLineage.clear()
+	tidLineageDict.clear()
+
+	# custom entries that redefine snapshot nodes are only visible through the views
+	if taxSnapshot:
+		taxSnapshot.fast = not any( taxParents._index(tid) >= 0 for tid in taxParents.extra )
+		if DEBUG and not taxSnapshot.fast: sys.stderr.write( "[INFO] Custom taxonomy overrides snapshot nodes; array lookups disabled\n" )
+
+def _loadTaxonomyDmp( names_dmp_file, nodes_dmp_file ):
+	"""
+	Parse NCBI names.dmp and nodes.dmp into the lookup dicts. Both files are cut into chunks
+	at line boundaries and parsed by parseProcesses worker processes (all cores by default);
+	depths are then assigned top-down from the root, so node order in the files does not matter.
+	"""
+	chunks = [ ("names", names_dmp_file, start, end) for (start, end) in _fileChunks( names_dmp_file ) ] \
+	       + [ ("nodes", nodes_dmp_file, start, end) for (start, end) in _fileChunks( nodes_dmp_file ) ]
+
+	if len(chunks) > 2:
+		pool = multiprocessing.Pool( parseProcesses )
+		try:
+			results = pool.map( _parseDmpChunk, chunks )
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		results = [ _parseDmpChunk(chunk) for chunk in chunks ]
+
+	children = {}
+	for (chunk, rows) in zip( chunks, results ):
+		if chunk[0] == "names":
+			taxNames.update( rows )
+			continue
+		for (tid, parent, rank) in rows:
+			taxParents[tid] = parent
+			taxRanks[tid] = rank
+			if parent in taxNumChilds:
+				taxNumChilds[parent] += 1
+			else:
+				taxNumChilds[parent] = 1
+			if tid != parent:
+				children.setdefault( parent, [] ).append( tid )
+
+	# breadth-first from the root(s): every node is one deeper than its parent
+	level = [ tid for tid in taxParents if taxParents[tid] == tid or not taxParents[tid] in taxParents ]
+	depth = 0
+	while level:
+		nextLevel = []
+		for tid in level:
+			taxDepths[tid] = str(depth)
+			nextLevel.extend( children.get( tid, () ) )
+		level = nextLevel
+		depth += 1
+
+	if len(taxDepths) < len(taxParents):
+		sys.stderr.write( "[WARNING] %d taxa in %s are not connected to the root.\n" % (len(taxParents)-len(taxDepths), nodes_dmp_file) )
+		for tid in taxParents:
+			if not tid in taxDepths: taxDepths[tid] = "0"
+
+def _fileChunks( filename, chunk_size=32*1024*1024 ):
+	"""Split filename into [start, end) byte ranges of about chunk_size that end at a newline."""
+	size = os.path.getsize( filename )
+	bounds = [0]
+	with open( filename, 'rb' ) as f:
+		while bounds[-1] + chunk_size < size:
+			f.seek( bounds[-1] + chunk_size )
+			f.readline()
+			bounds.append( f.tell() )
+	bounds.append( size )
+	return [ (bounds[k], bounds[k+1]) for k in range(len(bounds)-1) if bounds[k] < bounds[k+1] ]
+
+def _parseDmpChunk( chunk ):
+	"""Worker: parse one chunk of names.dmp into (taxid, name) or nodes.dmp into (taxid, parent, rank)."""
+	kind, filename, start, end = chunk
+	with open( filename, 'rb' ) as f:
+		f.seek( start )
+		lines = f.read( end-start ).decode('utf-8').splitlines()
+
+	rows = []
+	if kind == "names":
+		for line in lines:
+			fields = line.split('\t|\t')
+			if len(fields) > 3 and fields[3].startswith("scientific name"):
+				rows.append( (fields[0], fields[1]) )
+	else:
+		for line in lines:
+			fields = line.split('\t|\t')
+			if len(fields) > 2:
+				rows.append( (fields[0], fields[1], fields[2]) )
+	return rows
+
+def _writeTaxonomyTsv( taxonomy_file ):
+	"""Write the loaded taxonomy as taxonomy.tsv, parents before children."""
+	tmp_file = "%s.tmp%d" % (taxonomy_file, os.getpid())
+	with open( tmp_file, 'w' ) as f:
+		for tid in sorted( taxParents, key=lambda tid: int(taxDepths[tid]) ):
+			f.write( "%s\t%s\t%s\t%s\t%s\n" % (tid, taxDepths[tid], taxParents[tid], taxRanks[tid], taxNames.get(tid, "")) )
+	os.rename( tmp_file, taxonomy_file )
+
+def _writeMergedTsv( merged_taxonomy_file ):
+	tmp_file = "%s.tmp%d" % (merged_taxonomy_file, os.getpid())
+	with open( tmp_file, 'w' ) as f:
+		for mtid in sorted( taxMerged, key=int ):
+			f.write( "%s\t%s\n" % (mtid, taxMerged[mtid]) )
+	os.rename( tmp_file, merged_taxonomy_file )
+
+def _useSnapshot( meta, columns, names ):
+	"""Point the lookup tables at snapshot columns (memory-mapped or built in memory)."""
+	global taxSnapshot, taxDepths, taxParents, taxRanks, taxNames, taxMerged, taxNumChilds
+
+	snap = _Snapshot( meta, columns, names )
+
+	del taxOverlay[:]
+	taxSnapshot  = snap
+	taxParents   = _SnapshotMap( snap.parent, -1, meta["taxa"], lambda i: str(snap.p[i]) )
+	taxDepths    = _SnapshotMap( snap.parent, -1, meta["taxa"], lambda i: str(snap.d[i]) )
+	taxRanks     = _SnapshotMap( snap.parent, -1, meta["taxa"], lambda i: snap.ranks[snap.r[i]] )
+	taxNames     = _SnapshotMap( snap.parent, -1, meta["taxa"], snap.name )
+	taxMerged    = _SnapshotMap( snap.merged, 0, None, lambda i: str(snap.m[i]) )
+	taxNumChilds = _SnapshotMap( snap.nchild, 0, None, lambda i: int(snap.c[i]) )
+
+def _fileStamps( files ):
+	stamps = {}
+	for f in files:
+		st = os.stat(f)
+		stamps[os.path.basename(f)] = [st.st_size, int(st.st_mtime)]
+	return stamps
+
+def _loadSnapshot( snapshot_dir ):
+	"""
+	Memory-map a snapshot written by compileTaxonomy() and point the lookup tables at it.
+	Returns False (and leaves the tables alone) if the snapshot is missing or stale.
+	"""
+	meta_file = snapshot_dir+"/meta.json"
+
+	if np is None or not os.path.isfile( meta_file ):
+		return False
 
-	if DEBUG: sys.stderr.write( "[INFO] Done parsing taxonomy.tab (%d taxons loaded)\n" % len(taxParents) )
+	with open(meta_file) as f:
+		meta = json.load(f)
 
-	if taxParents["2"] == "1":
-		_die( "Local taxonomy database is out of date." )
+	if meta.get("version") != snapshotVersion:
+		sys.stderr.write( "[WARNING] Taxonomy snapshot %s has an unsupported version. Parsing text files instead.\n" % snapshot_dir )
+		return False
+
+	try:
+		current = _fileStamps( [taxonomyDir+"/"+f for f in meta["sources"]] )
+	except OSError:
+		current = None
+	if current != meta["sources"]:
+		sys.stderr.write( "[WARNING] Taxonomy snapshot %s is out of date. Parsing text files instead; run \"taxonomy.py compile\" to rebuild it.\n" % snapshot_dir )
+		return False
+
+	if DEBUG: sys.stderr.write( "[INFO] Map taxonomy snapshot: %s\n"% snapshot_dir )
+
+	columns = {}
+	# normalized ranks compiled with another rank table are rebuilt on first use
+	hasNormRanks = meta.get("normRanks") == [ list( normRanks ), strainDepth ]
+	for col in snapshotColumns + ( ancestorColumns if "ancestorRanks" in meta else () ) + ( intervalColumns if meta.get("intervals") else () ) + ( normRankColumns if hasNormRanks else () ):
+		columns[col] = np.load( "%s/%s.npy" % (snapshot_dir, col), mmap_mode='r' )
+	with open( snapshot_dir+"/names.bin", 'rb' ) as f:
+		names = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) if columns["name_offset"][-1] else b""
+
+	_useSnapshot( meta, columns, names )
+
+	return True
+
+#####################
+#   Worker pools    #
+#####################
+
+# Converters that fan per-read work out to threads or a multiprocessing pool should load
+# the taxonomy once, as a TaxonomyDB, in the parent:
+#
+#   db = taxonomy.TaxonomyDB( dbpath, freeze=True )
+#   pool = multiprocessing.Pool( processes, initializer=db.initWorker )
+#   results = pool.map( work, chunks )     # work() calls db.taxid2lineage(), ... (or taxonomy.*)
+#
+# TaxonomyDB loads the array backend and builds all lazily built tables up front, so
+# lookups only read shared state: the tree is in read-only numpy columns (memory-mapped
+# from the snapshot if there is one) and the lookup caches are per thread (see LRUCache).
+# Forked workers (the default on Linux) inherit the columns without copying: there are no
+# per-node Python objects whose reference counts would dirty copy-on-write pages, and with
+# freeze=True the objects that exist at that point are frozen out of the garbage collector.
+# With the spawn start method db pickles as its path, and each worker memory-maps the same
+# snapshot.
+#
+# The tables are the module's, so a process holds one taxonomy at a time: all TaxonomyDB
+# instances in use share it, a TaxonomyDB of another dbpath or custom file raises
+# ValueError, and the methods of a TaxonomyDB raise RuntimeError once the taxonomy was
+# reloaded under it (e.g. by loadTaxonomy()).
+
+class TaxonomyDB(object):
+	"""
+	The taxonomy of dbpath (plus optional custom overlay file), loaded for sharing between
+	threads and worker processes. Lookup functions of this module are available as methods,
+	e.g. db.taxid2lineage( "562" ). With freeze=True the garbage collector of the whole
+	process leaves the objects loaded so far alone (gc.freeze()).
+	"""
+	def __init__( self, dbpath=taxonomyDir, custom=None, freeze=False ):
+		self.dbpath = os.path.realpath( dbpath )
+		self.custom = os.path.realpath( custom ) if custom else None
+		self.snapshot = None
+		for db in list( taxonomyDBs ):
+			if db.current() and db.key() != self.key():
+				raise ValueError( "Taxonomy %s is in use by a TaxonomyDB; a process holds one taxonomy at a time." % db.dbpath )
+		self._attach()
+
+		# keep the garbage collector of forked workers off the pages of the loaded objects
+		if freeze and hasattr( gc, "freeze" ):
+			gc.collect()
+			gc.freeze()
+
+	def key( self ):
+		return ( self.dbpath, self.custom )
+
+	def current( self ):
+		"""True while the taxonomy of the process is the one this TaxonomyDB loaded."""
+		return self.snapshot is not None and self.snapshot is taxSnapshot
+
+	def initWorker( self ):
+		"""Pool initializer: map the taxonomy if this worker was spawned, and start empty caches."""
+		if not self.current():
+			self._attach()
+		for cache in lookupCaches:
+			cache.resetWorker()
+
+	def _attach( self ):
+		"""Use the taxonomy of a TaxonomyDB in use with the same files, or load it."""
+		for db in list( taxonomyDBs ):
+			if db.current() and db.key() == self.key():
+				self.snapshot = db.snapshot
+				break
+		else:
+			loadTaxonomy( self.dbpath, backend="array", precompute=True, daemon=False, custom=self.custom )
+			_prepareShared()
+			self.snapshot = taxSnapshot
+		taxonomyDBs.add( self )
+
+	def __getattr__( self, name ):
+		if name in remoteFunctions or name == "lcaStream":
+			if not self.current():
+				raise RuntimeError( "Taxonomy %s of this TaxonomyDB was replaced by another loadTaxonomy()." % self.dbpath )
+			return globals()[name]
+		raise AttributeError( name )
+
+	def __reduce__( self ):
+		return ( _attachTaxonomyDB, (self.dbpath, self.custom) )
+
+def _attachTaxonomyDB( dbpath, custom ):
+	"""Unpickle a TaxonomyDB: reuse the taxonomy of this process if it is the same one."""
+	db = TaxonomyDB.__new__( TaxonomyDB )
+	db.dbpath = dbpath
+	db.custom = custom
+	db.snapshot = None
+	db.initWorker()
+	return db
+
+def _prepareShared():
+	"""Build every lazily built table now and make the tree columns read-only."""
+	snap = taxSnapshot
+	_intervals()
+	if snap.lca is None:
+		snap.lca = _buildLCA()
+	for r in majorRanks + ("strain",):
+		_rankAncestors( r )
+	_normRanks()
+	if any( os.path.isfile( taxonomyDir+"/"+f ) for f in accessionFiles ):
+		_accessionLookup()
+
+	for col in (snap.parent, snap.depth, snap.rank, snap.nchild, snap.merged, snap.offset, snap.pre, snap.post, snap.normRank):
+		if col is not None and col.flags.writeable:
+			col.flags.writeable = False
+
+#####################
+#  Lookup service   #
+#####################
+
+# "taxonomy.py serve --socket PATH" loads the taxonomy once and answers lookups from other
+# processes over a Unix-domain socket. Each request is one line of JSON,
+#   {"func": "taxid2lineage", "args": ["562"], "kwargs": {}}
+# or, to make many calls in one round trip,
+#   {"func": "taxid2lineage", "calls": [["562"], ["1392"]]}
+# answered by one line {"result": ...} (a list of results for "calls") or
+# {"error": msg, "type": exception class, "args": [...]}; the client raises the same
+# exception (e.g. KeyError for an unknown taxid) as the lookup would in-process.
+# loadTaxonomy() connects to a running service and replaces the lookup functions of this
+# module with stubs that forward to it. The tree is then not loaded in this process: the
+# taxonomy tables (taxParents, taxRanks, ...) raise RuntimeError when used, and so do the
+# functions that are not forwarded (e.g. lcaStream, compileTaxonomy). For throughput,
+# prefer the batch functions.
+
+# module tables that are only filled when the tree is loaded in-process
+servedTables = ( "taxDepths", "taxParents", "taxRanks", "taxNames", "taxMerged", "taxNumChilds" )
+
+remoteFunctions = (
+	"taxidStatus", "taxid2mergedTid", "acc2taxid", "accs2taxid",
+	"taxid2rank", "taxid2normRank", "taxid2name", "taxid2depth", "taxid2type", "taxid2parent",
+	"taxid2nameOnRank", "taxid2taxidOnRank", "taxidIsLeaf", "taxidContains", "taxid2fullLineage",
+	"taxid2fullLinkDict", "taxid2nearestMajorTaxid", "taxid2lineage", "taxid2lineageDICT",
+	"taxids2taxidOnRank", "taxids2nameOnRank", "taxids2name", "taxids2normRank", "taxids2lineage", "taxidsContain",
+	"taxidLCA", "taxidsLCA", "taxidsPairLCA"
+)
+
+def serve( socket_path, dbpath=taxonomyDir, backend="auto", precompute=True ):
+	"""Load the taxonomy from dbpath and answer lookups on socket_path until interrupted."""
+	loadTaxonomy( dbpath, backend, precompute, daemon=False )
+
+	if os.path.exists( socket_path ):
+		if _connectDaemon( socket_path, check_path=False ):
+			_die( "A taxonomy service is already listening on %s.\n" % socket_path )
+		os.unlink( socket_path )
+
+	# requests are answered one at a time (see _TaxonomyServer.lock), all from one cache
+	for cache in lookupCaches:
+		cache.share()
+
+	server = _TaxonomyServer( socket_path, _TaxonomyRequestHandler )
+	# remove the socket on "kill" as well as on Ctrl-C
+	signal.signal( signal.SIGTERM, lambda signum, frame: sys.exit(0) )
+	sys.stderr.write( "[INFO] Serving taxonomy %s on %s\n" % (taxonomyDir, socket_path) )
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.unlink( socket_path )
+
+def _connectDaemon( socket_path, check_path=True ):
+	"""A client for the service on socket_path, or None if there is none serving taxonomyDir."""
+	if not os.path.exists( socket_path ):
+		return None
+	try:
+		client = _TaxonomyClient( socket_path )
+		info = client.call( "_serviceInfo" )
+	except (OSError, ValueError):
+		return None
+
+	if check_path and os.path.realpath( info["taxonomyDir"] ) != os.path.realpath( taxonomyDir ):
+		if DEBUG: sys.stderr.write( "[INFO] Taxonomy service on %s serves %s; loading locally\n" % (socket_path, info["taxonomyDir"]) )
+		client.close()
+		return None
+
+	if DEBUG: sys.stderr.write( "[INFO] Use taxonomy service on %s (%d taxons)\n" % (socket_path, info["taxa"]) )
+	return client
+
+def _useDaemon( client ):
+	"""Forward the lookup functions to client, or restore the in-process ones (client=None)."""
+	global taxDaemon
+	module = globals()
+
+	if not localFunctions:
+		for name in remoteFunctions:
+			localFunctions[name] = module[name]
+
+	if taxDaemon is not None:
+		taxDaemon.close()
+	taxDaemon = client
+
+	for name in remoteFunctions:
+		module[name] = _remoteFunction( client, name ) if client else localFunctions[name]
+
+	# the tables of this process are empty while the service answers the lookups
+	if client or isinstance( taxParents, _ServedTable ):
+		_resetTaxonomy()
+	if client:
+		for name in servedTables:
+			module[name] = _ServedTable( name )
+
+def _remoteFunction( client, name ):
+	def remote( *args, **kwargs ):
+		if name == "taxids2lineage" and kwargs.get( "output_type", args[3] if len(args) > 3 else "DICT" ) == "DATAFRAME":
+			import pandas as pd
+			args = args[:3]
+			kwargs["output_type"] = "DICT"
+			return pd.DataFrame( client.call( name, *args, **kwargs ) )
+		return client.call( name, *args, **kwargs )
+	remote.__name__ = name
+	remote.__doc__ = localFunctions[name].__doc__
+	return remote
+
+def _serviceInfo():
+	return { "taxonomyDir": taxonomyDir, "taxa": len(taxParents) }
+
+def _encodeJSON( obj ):
+	if np is not None:
+		if isinstance( obj, np.ndarray ):
+			return { "__ndarray__": obj.tolist(), "dtype": "object" if obj.dtype.kind in "OSU" else obj.dtype.str }
+		if isinstance( obj, np.generic ):
+			return obj.item()
+	if isinstance( obj, tuple ):
+		return list(obj)
+	raise TypeError( "%r is not JSON serializable" % obj )
+
+def _decodeJSON( obj ):
+	if "__ndarray__" in obj:
+		return np.array( obj["__ndarray__"], dtype=obj["dtype"] )
+	# lineage dicts autovivify like the in-process ones
+	return _autoVivification( obj )
+
+class _TaxonomyServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+	# the lookup caches are not thread-safe
+	lock = threading.Lock()
+
+class _TaxonomyRequestHandler(socketserver.StreamRequestHandler):
+	def handle( self ):
+		for line in self.rfile:
+			try:
+				req = json.loads( line )
+				name = req["func"]
+				if name not in remoteFunctions and name != "_serviceInfo":
+					raise ValueError( "Unknown taxonomy function: %s" % name )
+				func = globals()[name]
+				with self.server.lock:
+					if "calls" in req:
+						result = [ func( *args ) for args in req["calls"] ]
+					else:
+						result = func( *req.get("args", []), **req.get("kwargs", {}) )
+				reply = { "result": result }
+			except (Exception, SystemExit) as e:
+				reply = { "error": str(e) or repr(e), "type": type(e).__name__, "args": _jsonArgs( e.args ) }
+			self.wfile.write( (json.dumps( reply, default=_encodeJSON )+"\n").encode('utf-8') )
+			self.wfile.flush()
+
+class _TaxonomyClient(object):
+	"""Connection to a taxonomy service; call() runs one lookup, callMany() a batch of them."""
+	def __init__( self, socket_path ):
+		self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+		try:
+			self.sock.connect( socket_path )
+		except OSError:
+			self.sock.close()
+			raise
+		self.f = self.sock.makefile( 'rwb' )
+
+	def call( self, name, *args, **kwargs ):
+		return self._request( { "func": name, "args": args, "kwargs": kwargs } )
+
+	def callMany( self, name, calls ):
+		return self._request( { "func": name, "calls": calls } )
+
+	def close( self ):
+		self.f.close()
+		self.sock.close()
+
+	def _request( self, req ):
+		self.f.write( (json.dumps( req, default=_encodeJSON )+"\n").encode('utf-8') )
+		self.f.flush()
+		line = self.f.readline()
+		if not line:
+			raise OSError( "Taxonomy service closed the connection." )
+		reply = json.loads( line, object_hook=_decodeJSON )
+		if "error" in reply:
+			raise _remoteError( reply )
+		return reply["result"]
+
+def _jsonArgs( args ):
+	"""Exception arguments as sent to the client: as they are if JSON can carry them, else as strings."""
+	try:
+		json.dumps( args, default=_encodeJSON )
+		return list( args )
+	except (TypeError, ValueError):
+		return [ str(a) for a in args ]
+
+def _remoteError( reply ):
+	"""The exception of an error reply: the built-in exception class raised by the service, else RuntimeError."""
+	cls = getattr( builtins, reply.get("type") or "", None )
+	if not ( isinstance( cls, type ) and issubclass( cls, BaseException ) ):
+		return RuntimeError( reply["error"] )
+	try:
+		return cls( *reply.get( "args", [reply["error"]] ) )
+	except TypeError:
+		return cls( reply["error"] )
+
+class _ServedTable(object):
+	"""Stands in for a taxonomy table of this module while a taxonomy service answers the lookups."""
+	def __init__( self, name ):
+		self.name = name
+
+	def _fail( self, *args, **kwargs ):
+		raise RuntimeError( "%s is not loaded in this process: the taxonomy is served by %s. Use the lookup functions, or loadTaxonomy( path, daemon=False )." % (self.name, taxonomyDir) )
+
+	__getitem__ = __setitem__ = __contains__ = __iter__ = __len__ = get = keys = values = items = _fail
+
+	def __getattr__( self, name ):
+		if name.startswith( "__" ):
+			raise AttributeError( name )
+		self._fail()
 
 ##########################
 ##  Internal functions  ##
@@ -561,6 +2546,285 @@ class _autoVivification(dict):
 			value = self[item] = type(self)()
 			return value
 
+class _Snapshot(object):
+	"""
+	Columns of a compiled taxonomy snapshot, indexed by integer taxid. The numpy arrays
+	(parent, depth, ...) serve vectorized code; the memoryviews p/d/r/c/m/o over the same
+	buffers give plain ints for scalar tree walks.
+	"""
+	def __init__( self, meta, columns, names ):
+		self.meta   = meta
+		self.size   = meta["size"]
+		self.ranks  = meta["ranks"]
+		self.parent = columns["parent"]
+		self.depth  = columns["depth"]
+		self.rank   = columns["rank"]
+		self.nchild = columns["nchild"]
+		self.merged = columns["merged"]
+		self.offset = columns["name_offset"]
+		self.names  = names
+		self.p = memoryview( self.parent )
+		self.d = memoryview( self.depth )
+		self.r = memoryview( self.rank )
+		self.c = memoryview( self.nchild )
+		self.m = memoryview( self.merged )
+		self.o = memoryview( self.offset )
+
+		# rank enum codes
+		self.rankCode = {}
+		for (c, rank) in enumerate( self.ranks ):
+			self.rankCode.setdefault( rank.upper(), c )
+		self.norank  = self.rankCode.get( "NO RANK", -1 )
+		self.species = self.rankCode.get( "SPECIES", -1 )
+		self.major   = [ rank in major_level for rank in self.ranks ]
+		self.fast    = True
+
+		# rank code -> per-node ancestor column, filled by _rankAncestors()
+		self.rankAncestors = {}
+		self.useAncestors( columns )
+		self.useIntervals( columns )
+		# normalized rank codes, filled by _normRanks() unless compiled in
+		self.normRank = columns.get( "norm_rank" )
+
+	def useAncestors( self, columns ):
+		"""Attach the precomputed ancestor table (see _buildAncestors) if columns has one."""
+		self.ancestors   = None
+		self.ancestorCol = {}
+		if "rank_ancestor" not in columns:
+			return
+		self.ancestors = columns["rank_ancestor"]
+		self.nearest   = columns["nearest_major"]
+		self.type      = columns["type"]
+		self.ancestorCol = dict( (r.upper(), j) for (j, r) in enumerate( self.meta["ancestorRanks"] ) )
+		self.a  = memoryview( self.ancestors.reshape(-1) )
+		self.na = len( self.ancestorCol )
+		self.nm = memoryview( self.nearest )
+		self.t  = memoryview( self.type )
+		self.rankAncestors = {}
+
+	def useIntervals( self, columns ):
+		"""Attach the pre-order interval columns (see _buildIntervals) if columns has them."""
+		# pre is set last: other threads take pre != None to mean the rest is ready
+		pre = columns.get( "pre" )
+		self.post = columns.get( "post" )
+		self.lca  = None
+		if pre is not None:
+			self.pr = memoryview( pre )
+			self.po = memoryview( self.post )
+		self.pre = pre
+
+	def name( self, i ):
+		return self.names[ self.o[i]:self.o[i+1] ].decode('utf-8')
+
+class _AccessionIndex(object):
+	"""
+	Memory-mapped accession index written by compileAccessionIndex(): sorted fixed-width
+	accession keys and their taxids, searched with numpy's binary search.
+	"""
+	def __init__( self, index_dir, meta ):
+		self.meta   = meta
+		self.keys   = np.load( index_dir+"/keys.npy", mmap_mode='r' )
+		self.taxids = np.load( index_dir+"/taxid.npy", mmap_mode='r' )
+		self.width  = self.keys.dtype.itemsize
+		self.extra  = {}
+		with open( index_dir+"/extra.tsv" ) as f:
+			for line in f:
+				acc, tid = line.rstrip('\r\n').split('\t')
+				self.extra[acc] = tid
+
+		# imported RefSeq catalogs (see importRefSeqCatalog) take precedence
+		self.catalogKeys = self.catalogTaxids = None
+		if meta.get("catalogs"):
+			self.catalogKeys   = np.load( index_dir+"/catalog_keys.npy", mmap_mode='r' )
+			self.catalogTaxids = np.load( index_dir+"/catalog_taxid.npy", mmap_mode='r' )
+
+	# Both lookups search the imported catalogs first, then the accession list, whose custom
+	# (non-numeric) taxids are in extra.
+
+	def lookup( self, acc ):
+		"""Taxid (string) of one accession without version number, or "" if not found."""
+		key = acc.encode('utf-8')
+		for (keys, taxids) in ( (self.catalogKeys, self.catalogTaxids), (self.keys, self.taxids) ):
+			if keys is None or not key or len(key) > keys.dtype.itemsize:
+				continue
+			i = int( np.searchsorted( keys, key ) )
+			if i < len(keys) and keys[i] == key:
+				if keys is self.keys and acc in self.extra:
+					return self.extra[acc]
+				return str( taxids[i] )
+		return ""
+
+	def lookupMany( self, accs ):
+		"""
+		Taxids of a list of accessions (version numbers are removed) as an int array, 0 if not
+		found; an object array if some taxids are custom (see accs2taxid).
+		"""
+		query = [ acc.split('.')[0].encode('utf-8') for acc in accs ]
+		tids = np.zeros( len(query), dtype=np.int64 )
+		found = np.zeros( len(query), dtype=bool )
+		for (keys, taxids) in ( (self.catalogKeys, self.catalogTaxids), (self.keys, self.taxids) ):
+			if keys is None or not len(keys):
+				continue
+			width = keys.dtype.itemsize
+			fits = np.array( [ 0 < len(key) <= width for key in query ], dtype=bool )
+			q = np.array( [ key if len(key) <= width else b"" for key in query ], dtype="S%d" % width )
+			pos = np.searchsorted( keys, q )
+			pos[ pos >= len(keys) ] = 0
+			hit = fits & ( keys[pos] == q ) & ~found
+			tids[hit] = taxids[pos][hit]
+			found |= hit
+
+		custom = [ k for k in np.flatnonzero( found & (tids == 0) ).tolist() if query[k].decode('utf-8') in self.extra ]
+		if custom:
+			tids = tids.astype( object )
+			for k in custom:
+				tids[k] = self.extra[ query[k].decode('utf-8') ]
+		return tids
+
+class _SortedAccessionFile(object):
+	"""
+	Lookups in a sorted "accession<TAB>taxid" text file without an index: the file is
+	memory-mapped once and each query is a binary search over its lines.
+	"""
+	def __init__( self, accession2taxid_file ):
+		if DEBUG: sys.stderr.write( "[INFO] acc2taxid from file: %s\n" % accession2taxid_file )
+		with open( accession2taxid_file, 'rb' ) as f:
+			self.mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) if os.path.getsize( accession2taxid_file ) else b""
+
+	def lookup( self, acc ):
+		"""Taxid (string) of one accession without version number, or "" if not found."""
+		mm = self.mm
+		key = acc.encode('utf-8')
+		start = 0
+		end = len(mm)
+
+		while start < end:
+			# the line containing the middle byte
+			mid = (start+end)//2
+			lineStart = mm.rfind( b"\n", 0, mid ) + 1
+			lineEnd = mm.find( b"\n", lineStart )
+			if lineEnd < 0: lineEnd = len(mm)
+			(accCur, tid) = mm[lineStart:lineEnd].split( b"\t" )[:2]
+
+			if accCur < key:
+				start = lineEnd+1
+			elif accCur > key:
+				end = lineStart
+			else:
+				return tid.strip().decode('utf-8')
+
+		return ""
+
+	def lookupMany( self, accs ):
+		tids = [ self.lookup( acc.split('.')[0] ) for acc in accs ]
+		if all( tid.isdigit() or not tid for tid in tids ):
+			return np.array( [ int(tid) if tid else 0 for tid in tids ], dtype=np.int64 )
+		return np.array( [ int(tid) if tid.isdigit() else tid or 0 for tid in tids ], dtype=object )
+
+class _LazyNames(object):
+	"""
+	Taxid -> name view of the last column of a memory-mapped taxonomy.tsv. Only the byte
+	offset of each name is kept, in an array indexed by taxid, and a name is decoded when it
+	is looked up. Assigned entries (custom taxonomy) are kept in a dict, as in _SnapshotMap.
+	"""
+	def __init__( self, taxonomy_file ):
+		with open( taxonomy_file, 'rb' ) as f:
+			self.mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) if os.path.getsize( taxonomy_file ) else b""
+		self.offset = np.zeros( 0, dtype=np.int64 )
+		self.count  = 0
+		self.extra  = {}
+
+	def index( self, taxids, offsets ):
+		"""Set the name offsets of taxids (int arrays)."""
+		self.offset = np.full( int(taxids.max())+1 if len(taxids) else 0, -1, dtype=np.int64 )
+		self.offset[taxids] = offsets
+		self.count  = len(taxids)
+
+	def decode( self, start ):
+		end = self.mm.find( b"\n", start )
+		if end < 0: end = len(self.mm)
+		return self.mm[start:end].rstrip( b"\r" ).decode('utf-8')
+
+	def _index( self, taxID ):
+		try:
+			i = int(taxID)
+		except (TypeError, ValueError):
+			return -1
+		if 0 <= i < len(self.offset) and self.offset[i] >= 0:
+			return i
+		return -1
+
+	def __contains__( self, taxID ):
+		return taxID in self.extra or self._index(taxID) >= 0
+
+	def __getitem__( self, taxID ):
+		if taxID in self.extra:
+			return self.extra[taxID]
+		i = self._index(taxID)
+		if i < 0:
+			raise KeyError(taxID)
+		return self.decode( int( self.offset[i] ) )
+
+	def __setitem__( self, taxID, value ):
+		self.extra[taxID] = value
+
+	def __len__( self ):
+		return self.count + len(self.extra)
+
+	def get( self, taxID, default=None ):
+		return self[taxID] if taxID in self else default
+
+class _SnapshotMap(object):
+	"""
+	A taxid-string keyed, dict-like view of one snapshot column, so the lookup functions work
+	the same on a snapshot as on parsed dicts. Taxid i is present if exists[i] > absent and
+	decode(i) returns its value. Assigned entries (custom taxonomy) are kept in a small dict
+	that shadows the column.
+	"""
+	def __init__( self, exists, absent, count, decode ):
+		self.exists = exists
+		self.absent = absent
+		self.count  = count
+		self.decode = decode
+		self.extra  = {}
+
+	def _index( self, taxID ):
+		try:
+			i = int(taxID)
+		except (TypeError, ValueError):
+			return -1
+		if 0 <= i < len(self.exists) and self.exists[i] > self.absent:
+			return i
+		return -1
+
+	def __contains__( self, taxID ):
+		return taxID in self.extra or self._index(taxID) >= 0
+
+	def __getitem__( self, taxID ):
+		if taxID in self.extra:
+			return self.extra[taxID]
+		i = self._index(taxID)
+		if i < 0:
+			raise KeyError(taxID)
+		return self.decode(i)
+
+	def __setitem__( self, taxID, value ):
+		self.extra[taxID] = value
+
+	def __len__( self ):
+		if self.count is None:
+			self.count = int( np.count_nonzero( self.exists > self.absent ) )
+		return self.count + len(self.extra)
+
+	def get( self, taxID, default=None ):
+		return self[taxID] if taxID in self else default
+
+def _sizeof( obj ):
+	# rough footprint of a cached key or value; lineage dicts are nested
+	if isinstance( obj, dict ):
+		return sys.getsizeof(obj) + sum( _sizeof(k) + _sizeof(v) for (k, v) in obj.items() )
+	return sys.getsizeof(obj)
+
 def _die( msg ):
 	sys.exit(msg)
 
@@ -568,9 +2832,72 @@ def _checkTaxonomy():
 	if not len(taxParents):
 		_die("Taxonomy not loaded. \"loadTaxonomy()\" must be called first.\n")
 
+def _checkOverlay():
+	if taxDaemon is not None:
+		_die("Custom taxonomy can not be added to a taxonomy service: load the taxonomy with \"loadTaxonomy( path, custom=FILE )\" instead.\n")
+	_checkTaxonomy()
+
+def _checkSnapshot():
+	_checkTaxonomy()
+	if taxSnapshot is None:
+		_die("Batch taxonomy lookups need the array backend: compile a snapshot or call \"loadTaxonomy( path, backend=\"array\" )\".\n")
+	return taxSnapshot
+
 if __name__ == '__main__':
+	# taxonomy.py compile [DBPATH]: write DBPATH/taxonomy.snapshot for fast loading
+	if len(sys.argv) > 1 and sys.argv[1] == "compile":
+		snapshot_dir = compileTaxonomy( sys.argv[2] if len(sys.argv) > 2 else "" )
+		sys.stderr.write( "[INFO] Taxonomy snapshot written to %s\n" % snapshot_dir )
+		sys.exit(0)
+
+	# taxonomy.py update DUMP_DIR [DBPATH] [--report FILE]: apply a new NCBI taxonomy release
+	if len(sys.argv) > 2 and sys.argv[1] == "update":
+		args = sys.argv[2:]
+		report_file = None
+		if "--report" in args:
+			i = args.index("--report")
+			report_file = args[i+1] if i+1 < len(args) else None
+			del args[i:i+2]
+		report = updateTaxonomy( args[0], args[1] if len(args) > 1 else "", report_file )
+		sys.stderr.write( "[INFO] Taxonomy updated: %d added, %d removed, %d re-parented, %d renamed, %d re-ranked, %d merged\n" % (
+			len(report["added"]), len(report["removed"]), len(report["reparented"]), len(report["renamed"]), len(report["reranked"]), len(report["merged"])) )
+		sys.exit(0)
+
+	# taxonomy.py serve --socket PATH [DBPATH]: answer lookups for other processes
+	if len(sys.argv) > 1 and sys.argv[1] == "serve":
+		args = sys.argv[2:]
+		socket_path = None
+		if "--socket" in args:
+			i = args.index("--socket")
+			socket_path = args[i+1] if i+1 < len(args) else None
+			del args[i:i+2]
+		dbpath = args[0] if args else taxonomyDir
+		serve( socket_path or dbpath+"/"+socketName, dbpath )
+		sys.exit(0)
+
+	# taxonomy.py import-refseq CATALOG [--seq-type nc|all] [--release N] [DBPATH]: merge a RefSeq catalog into the accession index
+	if len(sys.argv) > 2 and sys.argv[1] == "import-refseq":
+		args = sys.argv[2:]
+		opts = { "--seq-type": "nc", "--release": None }
+		for opt in opts:
+			if opt in args:
+				i = args.index(opt)
+				opts[opt] = args[i+1] if i+1 < len(args) else None
+				del args[i:i+2]
+		if len(args) > 1:
+			taxonomyDir = args[1]
+		index_dir = importRefSeqCatalog( args[0], seq_type=opts["--seq-type"], release=opts["--release"] )
+		sys.stderr.write( "[INFO] RefSeq catalog imported into %s\n" % index_dir )
+		sys.exit(0)
+
+	# taxonomy.py index-acc FILE: index an accession2taxid file for acc2taxid()
+	if len(sys.argv) > 2 and sys.argv[1] == "index-acc":
+		index_dir = compileAccessionIndex( sys.argv[2] )
+		sys.stderr.write( "[INFO] Accession index written to %s\n" % index_dir )
+		sys.exit(0)
+
 	#loading taxonomy
-	loadTaxonomy( sys.argv[1] if len(sys.argv) else "" )
+	loadTaxonomy( sys.argv[1] if len(sys.argv) > 1 else "" )
 
 	print("Enter acc/taxid:")
 
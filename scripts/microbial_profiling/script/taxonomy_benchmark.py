@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# Microbenchmarks for the taxonomy layer (taxonomy.py and the gi2lineage.py wrappers)
+# on synthetic NCBI-shaped trees.
+#
+#   taxonomy_benchmark.py --nodes 100000,1000000 --output bench.json
+#
+# For every tree size a taxonomy database (names.dmp, nodes.dmp, merged.dmp and a sorted
+# accession2taxid.tsv) is generated, then each backend is loaded and timed in a fresh
+# process, so the reported peak RSS is that of the backend alone. Results are printed as
+# JSON: one record per (nodes, backend, benchmark) with ops, seconds, ops/sec and peak RSS.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import resource
+import multiprocessing
+from queue import Empty
+
+libPath = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert( 0, libPath )
+sys.path.insert( 0, libPath+"/../../contig_classifier_by_bwa" )
+
+import taxonomy
+
+# rank, share of all nodes; every node hangs below a random node of the rank above
+treeShape = (
+	( "phylum",        0.0002 ),
+	( "class",         0.0005 ),
+	( "order",         0.0015 ),
+	( "family",        0.004  ),
+	( "genus",         0.02   ),
+	( "species group", 0.005  ),
+	( "species",       0.35   ),
+	( "no rank",       None   )  # strains: the rest of the nodes
+)
+
+def makeTaxonomy( dbpath, nodes, accessions, seed=1 ):
+	"""
+	Write an NCBI-shaped taxonomy of about nodes taxa under dbpath: names.dmp, nodes.dmp,
+	merged.dmp and a sorted accession2taxid.tsv of accessions species and strain accessions.
+	Taxids are sparse and shuffled as in NCBI. Returns the leaf taxids.
+	"""
+	rnd = random.Random( seed )
+	if not os.path.isdir( dbpath ): os.makedirs( dbpath )
+
+	# sparse taxid space, ordered randomly
+	free = list( range( 3, int(nodes*1.5)+10 ) )
+	rnd.shuffle( free )
+	free = iter( free )
+
+	# taxid -> (parent, rank, name)
+	tree = {
+		1      : ( 1, "no rank", "root" ),
+		131567 : ( 1, "no rank", "cellular organisms" ),
+		2      : ( 131567, "superkingdom", "Bacteria" ),
+		2157   : ( 131567, "superkingdom", "Archaea" )
+	}
+	above = [ 2, 2157 ]
+	leaves = []
+	for ( rank, share ) in treeShape:
+		count = int( nodes*share ) if share else nodes-len(tree)
+		level = []
+		for k in range( max(count, 1) ):
+			tid = next( free )
+			while tid in tree: tid = next( free )
+			parent = rnd.choice( above )
+			tree[tid] = ( parent, rank, "%s %s %d" % (rank.capitalize(), "synthetica", tid) )
+			level.append( tid )
+		if rank == "species group":
+			# a few species hang below a species group, most directly below a genus
+			above = above + level
+		else:
+			above = level
+
+	parents = set( p for (p, r, n) in tree.values() )
+	leaves = [ tid for tid in tree if not tid in parents ]
+
+	with open( dbpath+"/nodes.dmp", 'w' ) as f:
+		for tid in tree:
+			f.write( "%d\t|\t%d\t|\t%s\t|\t\t|\t0\t|\n" % (tid, tree[tid][0], tree[tid][1]) )
+	with open( dbpath+"/names.dmp", 'w' ) as f:
+		for tid in tree:
+			f.write( "%d\t|\t%s\t|\t\t|\tscientific name\t|\n" % (tid, tree[tid][2]) )
+			f.write( "%d\t|\t%s sp.\t|\t\t|\tsynonym\t|\n" % (tid, tree[tid][2]) )
+
+	# merged taxids: unused ids that point at existing nodes
+	with open( dbpath+"/merged.dmp", 'w' ) as f:
+		for k in range( max( nodes//100, 1 ) ):
+			f.write( "%d\t|\t%d\t|\n" % (next(free), rnd.choice(leaves)) )
+
+	with open( dbpath+"/accession2taxid.tsv", 'w' ) as f:
+		for k in range( accessions ):
+			f.write( "NC_%09d\t%d\n" % (k*3, rnd.choice(leaves)) )
+
+	return leaves
+
+def runBenchmarks( dbpath, backend, queries, seed, result_queue ):
+	"""Load dbpath with backend and time the lookups; puts a list of result records on result_queue."""
+	import gi2lineage
+
+	rnd = random.Random( seed )
+	results = []
+
+	def record( name, ops, seconds ):
+		results.append( {
+			"backend"     : backend,
+			"benchmark"   : name,
+			"ops"         : ops,
+			"seconds"     : round( seconds, 6 ),
+			"ops_per_sec" : round( ops/seconds, 1 ) if seconds > 0 else None,
+			"peak_rss_mb" : round( _peakRSS(), 1 )
+		} )
+
+	def timeit( name, func, args ):
+		for cache in taxonomy.lookupCaches: cache.clear()
+		start = time.time()
+		for a in args:
+			func( *a )
+		record( name, len(args), time.time()-start )
+
+	def timeBatch( name, func, args ):
+		# one call over all queries; reported per query
+		for cache in taxonomy.lookupCaches: cache.clear()
+		start = time.time()
+		func( *args )
+		record( name, queries, time.time()-start )
+
+	start = time.time()
+	if backend == "array":
+		# arrays built from taxonomy.tsv, not the compiled snapshot
+		taxonomy.snapshotDirName = "taxonomy.snapshot.none"
+		taxonomy.loadTaxonomy( dbpath, "array", daemon=False )
+	elif backend == "snapshot":
+		taxonomy.loadTaxonomy( dbpath, "auto", daemon=False )
+	elif backend == "service":
+		taxonomy.loadTaxonomy( dbpath, "auto" )
+	else:
+		taxonomy.loadTaxonomy( dbpath, "dict", daemon=False )
+	record( "loadTaxonomy", 1, time.time()-start )
+
+	# gi2lineage uses the taxonomy loaded above
+	gi2lineage.taxonomyDir = taxonomy.taxonomyDir
+
+	taxids = [ l.split('\t', 1)[0] for l in open( dbpath+"/taxonomy.tsv" ) ]
+	merged = [ l.split('\t', 1)[0] for l in open( dbpath+"/merged.dmp" ) ]
+	tids = [ (rnd.choice(taxids),) for k in range(queries) ]
+	n_acc = sum( 1 for l in open( dbpath+"/accession2taxid.tsv" ) )
+	hits = [ ("NC_%09d.1" % (rnd.randrange(n_acc)*3),) for k in range(queries) ]
+	misses = [ ("NC_%09d.1" % (rnd.randrange(n_acc)*3+1),) for k in range(queries) ]
+
+	timeit( "acc2taxid_hit", taxonomy.acc2taxid, hits )
+	timeit( "acc2taxid_miss", taxonomy.acc2taxid, misses )
+	timeit( "taxid2name", taxonomy.taxid2name, tids )
+	timeit( "taxid2rank", taxonomy.taxid2rank, tids )
+	timeit( "taxid2lineage", taxonomy.taxid2lineage, tids )
+	timeit( "taxid2lineage_cached", taxonomy.taxid2lineage, tids[:1000]*(queries//1000 or 1) )
+	timeit( "taxid2lineageDICT", taxonomy.taxid2lineageDICT, tids )
+	timeit( "taxid2taxidOnRank_genus", taxonomy.taxid2taxidOnRank, [ (t, "genus") for (t,) in tids ] )
+	timeit( "taxid2taxidOnRank_phylum", taxonomy.taxid2taxidOnRank, [ (t, "phylum") for (t,) in tids ] )
+	timeit( "taxid2mergedTid", taxonomy.taxid2mergedTid, [ (rnd.choice(merged),) for k in range(queries) ] )
+	timeit( "taxidContains", taxonomy.taxidContains, [ (rnd.choice(taxids), t) for (t,) in tids ] )
+	timeit( "taxidLCA", taxonomy.taxidLCA, [ (rnd.choice(taxids), t) for (t,) in tids ] )
+	timeBatch( "rollup", _rollup, ( [ t for (t,) in tids ], ) )
+
+	if taxonomy.taxSnapshot is not None or backend == "service":
+		timeBatch( "accs2taxid_batch", taxonomy.accs2taxid, ( [ a for (a,) in hits ], ) )
+		timeBatch( "taxids2taxidOnRank_batch", taxonomy.taxids2taxidOnRank, ( [ t for (t,) in tids ], "genus" ) )
+		timeBatch( "taxids2lineage_batch", taxonomy.taxids2lineage, ( [ t for (t,) in tids ], ) )
+
+	timeit( "gi2lineage.acc2lineage", gi2lineage.acc2lineage, hits )
+	timeit( "gi2lineage.taxid2rank_genus", gi2lineage.taxid2rank, [ (t, "genus") for (t,) in tids ] )
+
+	result_queue.put( results )
+
+def _rollup( taxids ):
+	"""Add one read per taxid to all of its ancestors, as the profiling converters do."""
+	counts = {}
+	for tid in taxids:
+		while tid and tid != "1":
+			counts[tid] = counts.get( tid, 0 )+1
+			tid = taxonomy.taxid2parent( tid )
+	return counts
+
+def _peakRSS():
+	# ru_maxrss is in KB on Linux, bytes on macOS
+	rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+	return rss/1024.0/1024.0 if sys.platform == "darwin" else rss/1024.0
+
+def _runIsolated( target, args ):
+	"""Run target(*args, queue) in a fresh interpreter and return what it put on the queue."""
+	ctx = multiprocessing.get_context( "spawn" )
+	queue = ctx.Queue()
+	p = ctx.Process( target=target, args=args+(queue,) )
+	p.start()
+	while True:
+		try:
+			result = queue.get( timeout=1 )
+			break
+		except Empty:
+			if not p.is_alive():
+				sys.exit( "[ERROR] Benchmark process %s failed.\n" % target.__name__ )
+	p.join()
+	return result
+
+def _compile( dbpath, result_queue ):
+	start = time.time()
+	taxonomy.loadTaxonomy( dbpath, "dict", daemon=False )
+	loaded = time.time()
+	taxonomy.compileTaxonomy( dbpath )
+	compiled = time.time()
+	taxonomy.compileAccessionIndex( dbpath+"/accession2taxid.tsv" )
+	result_queue.put( [
+		{ "backend": "dmp", "benchmark": "parseDmp", "ops": 1, "seconds": round( loaded-start, 6 ), "ops_per_sec": None, "peak_rss_mb": round( _peakRSS(), 1 ) },
+		{ "backend": "dmp", "benchmark": "compileTaxonomy", "ops": 1, "seconds": round( compiled-loaded, 6 ), "ops_per_sec": None, "peak_rss_mb": round( _peakRSS(), 1 ) },
+		{ "backend": "dmp", "benchmark": "compileAccessionIndex", "ops": 1, "seconds": round( time.time()-compiled, 6 ), "ops_per_sec": None, "peak_rss_mb": round( _peakRSS(), 1 ) }
+	] )
+
+def main():
+	p = argparse.ArgumentParser( description="Benchmark taxonomy.py load and lookup paths on synthetic NCBI-shaped trees; prints JSON." )
+	p.add_argument( "--nodes", default="100000", help="comma-separated tree sizes [default: 100000]" )
+	p.add_argument( "--accessions", type=int, default=None, help="accessions per tree [default: nodes]" )
+	p.add_argument( "--queries", type=int, default=100000, help="lookups per benchmark [default: 100000]" )
+	p.add_argument( "--backends", default="dict,array,snapshot", help="comma-separated: dict, array (built from text), snapshot (memory-mapped), service (a running \"taxonomy.py serve\") [default: dict,array,snapshot]" )
+	p.add_argument( "--workdir", default=None, help="keep the generated databases in this directory" )
+	p.add_argument( "--seed", type=int, default=1 )
+	p.add_argument( "--output", default=None, help="write the JSON report to this file instead of stdout" )
+	args = p.parse_args()
+
+	workdir = args.workdir or tempfile.mkdtemp( prefix="taxonomy_benchmark." )
+	report = {
+		"python"   : platform.python_version(),
+		"platform" : platform.platform(),
+		"queries"  : args.queries,
+		"runs"     : []
+	}
+
+	try:
+		for nodes in [ int(float(n)) for n in args.nodes.split(",") ]:
+			dbpath = "%s/tree%d" % (workdir, nodes)
+			accessions = args.accessions if args.accessions is not None else nodes
+			sys.stderr.write( "[INFO] Generating %d node taxonomy in %s\n" % (nodes, dbpath) )
+			if not os.path.isfile( dbpath+"/accession2taxid.tsv" ):
+				makeTaxonomy( dbpath, nodes, accessions, args.seed )
+			results = _runIsolated( _compile, (dbpath,) )
+
+			for backend in args.backends.split(","):
+				sys.stderr.write( "[INFO] Benchmarking %s backend\n" % backend )
+				results.extend( _runIsolated( runBenchmarks, (dbpath, backend, args.queries, args.seed) ) )
+
+			report["runs"].append( { "nodes": nodes, "accessions": accessions, "results": results } )
+	finally:
+		if not args.workdir:
+			shutil.rmtree( workdir, ignore_errors=True )
+
+	out = open( args.output, 'w' ) if args.output else sys.stdout
+	json.dump( report, out, indent=1 )
+	out.write( "\n" )
+	if args.output: out.close()
+
+if __name__ == '__main__':
+	main()
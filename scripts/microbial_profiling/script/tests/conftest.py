@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+libPath = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) )
+sys.path.insert( 0, libPath )
+sys.path.insert( 0, libPath+"/../../contig_classifier_by_bwa" )
+
+# taxid: (parent, rank, name) -- a human lineage with NCBI clades, and a bacterium with strains
+lineageTree = {
+	1       : ( 1,       "no rank",      "root" ),
+	131567  : ( 1,       "no rank",      "cellular organisms" ),
+	2       : ( 131567,  "superkingdom", "Bacteria" ),
+	1224    : ( 2,       "phylum",       "Pseudomonadota" ),
+	1236    : ( 1224,    "class",        "Gammaproteobacteria" ),
+	91347   : ( 1236,    "order",        "Enterobacterales" ),
+	543     : ( 91347,   "family",       "Enterobacteriaceae" ),
+	561     : ( 543,     "genus",        "Escherichia" ),
+	562     : ( 561,     "species",      "Escherichia coli" ),
+	83333   : ( 562,     "strain",       "Escherichia coli K-12" ),
+	511145  : ( 83333,   "no rank",      "Escherichia coli str. K-12 substr. MG1655" ),
+	2759    : ( 131567,  "superkingdom", "Eukaryota" ),
+	33208   : ( 2759,    "kingdom",      "Metazoa" ),
+	7711    : ( 33208,   "phylum",       "Chordata" ),
+	40674   : ( 7711,    "class",        "Mammalia" ),
+	32525   : ( 40674,   "clade",        "Theria" ),
+	9347    : ( 32525,   "clade",        "Eutheria" ),
+	9443    : ( 9347,    "order",        "Primates" ),
+	9604    : ( 9443,    "family",       "Hominidae" ),
+	9605    : ( 9604,    "genus",        "Homo" ),
+	9606    : ( 9605,    "species",      "Homo sapiens" ),
+	63221   : ( 9606,    "subspecies",   "Homo sapiens neanderthalensis" ),
+}
+lineageMerged = { 668369: 562 }
+
+def writeTaxonomy( dbpath, tree, merged={} ):
+	"""Write tree ({taxid: (parent, rank, name)}) as names.dmp, nodes.dmp and merged.dmp under dbpath."""
+	dbpath = str( dbpath )
+	if not os.path.isdir( dbpath ): os.makedirs( dbpath )
+	with open( dbpath+"/nodes.dmp", 'w' ) as f:
+		for tid in tree:
+			f.write( "%d\t|\t%d\t|\t%s\t|\t\t|\t0\t|\n" % (tid, tree[tid][0], tree[tid][1]) )
+	with open( dbpath+"/names.dmp", 'w' ) as f:
+		for tid in tree:
+			f.write( "%d\t|\t%s\t|\t\t|\tscientific name\t|\n" % (tid, tree[tid][2]) )
+	with open( dbpath+"/merged.dmp", 'w' ) as f:
+		for (old, new) in merged.items():
+			f.write( "%d\t|\t%d\t|\n" % (old, new) )
+	return dbpath
+
+@pytest.fixture
+def lineageDB( tmp_path ):
+	return writeTaxonomy( tmp_path / "taxonomy", lineageTree, lineageMerged )
+
+@pytest.fixture( params=["dict", "array", "snapshot"] )
+def backend( request ):
+	"""Load a taxonomy directory with each backend: text into dicts or arrays, or the compiled snapshot."""
+	import taxonomy
+
+	def load( dbpath ):
+		if request.param == "snapshot":
+			taxonomy.compileTaxonomy( dbpath )
+			taxonomy.loadTaxonomy( dbpath, daemon=False )
+			assert taxonomy.taxSnapshot is not None and taxonomy.taxSnapshot.fast
+		else:
+			taxonomy.loadTaxonomy( dbpath, backend=request.param, daemon=False )
+		return request.param
+
+	return load
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import taxonomy
+
+# accession list: NC_000002 has a custom taxid, NC_000004 a merged one
+accessionList = "NC_000001\t562\nNC_000002\t562.1\nNC_000003\t9606\nNC_000004\t668369\n"
+catalog = "511145\tEscherichia coli str. K-12 substr. MG1655\tNC_000001.3\t1\n" \
+          "9606\tHomo sapiens\tNC_000002.1\t2\n" \
+          "9606\tHomo sapiens\tNP_000005.1\t3\n"
+queries = [ "NC_000001.1", "NC_000002", "NC_000003.9", "NC_000004.1", "NC_999999.1", "NP_000005.1" ]
+
+def lookups( queries ):
+	"""acc2taxid() and accs2taxid() answers, both as strings ("" / "0" if not found)."""
+	single = [ taxonomy.acc2taxid( acc ) or "0" for acc in queries ]
+	batch = [ str(tid) for tid in taxonomy.accs2taxid( queries ).tolist() ]
+	return single, batch
+
+@pytest.fixture( params=["sorted file", "index"] )
+def accessionDB( request, lineageDB ):
+	with open( lineageDB+"/accession2taxid.tsv", 'w' ) as f:
+		f.write( accessionList )
+	if request.param == "index":
+		taxonomy.compileAccessionIndex( lineageDB+"/accession2taxid.tsv" )
+	taxonomy.loadTaxonomy( lineageDB, backend="array", daemon=False )
+	return lineageDB
+
+def test_single_and_batch_lookups_agree( accessionDB ):
+	single, batch = lookups( queries )
+	assert single == batch == [ "562", "562.1", "9606", "562", "0", "0" ]
+	assert taxonomy.accs2taxid( queries[:1] ).dtype.kind == "i"
+
+def test_imported_catalog_takes_precedence( tmp_path, lineageDB ):
+	with open( lineageDB+"/accession2taxid.tsv", 'w' ) as f:
+		f.write( accessionList )
+	(tmp_path / "RefSeq-release1.catalog").write_text( catalog )
+	taxonomy.loadTaxonomy( lineageDB, backend="array", daemon=False )
+	taxonomy.importRefSeqCatalog( str(tmp_path / "RefSeq-release1.catalog") )
+	taxonomy.loadTaxonomy( lineageDB, backend="array", daemon=False )
+
+	single, batch = lookups( queries )
+	# protein accessions are not imported with the default seq_type "nc"
+	assert single == batch == [ "511145", "9606", "9606", "562", "0", "0" ]
+
+def test_loaded_catalog_ignores_version_numbers( tmp_path, accessionDB ):
+	(tmp_path / "refseq.catalog").write_text( catalog )
+	taxonomy.accCatalog.clear()
+	try:
+		taxonomy.loadRefSeqCatelog( str(tmp_path / "refseq.catalog") )
+		single, batch = lookups( queries )
+		assert single == batch == [ "511145", "9606", "9606", "562", "0", "0" ]
+	finally:
+		taxonomy.accCatalog.clear()
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+import taxonomy
+import taxonomy_benchmark
+
+ranks = ( "superkingdom", "phylum", "class", "order", "family", "genus", "species", "strain" )
+
+def readTree( dbpath ):
+	"""{taxid: parent} and {old: new} of a taxonomy written by makeTaxonomy()."""
+	with open( dbpath+"/nodes.dmp" ) as f:
+		parents = dict( line.split("\t|\t")[:2] for line in f )
+	with open( dbpath+"/merged.dmp" ) as f:
+		merged = dict( line.rstrip("\t|\n").split("\t|\t") for line in f )
+	return parents, merged
+
+def load( dbpath, backend ):
+	if backend == "snapshot":
+		taxonomy.compileTaxonomy( dbpath )
+		taxonomy.loadTaxonomy( dbpath, daemon=False )
+		assert taxonomy.taxSnapshot is not None and taxonomy.taxSnapshot.fast
+	else:
+		taxonomy.loadTaxonomy( dbpath, backend=backend, daemon=False )
+
+@pytest.fixture( scope="module" )
+def randomDB( tmp_path_factory ):
+	dbpath = str( tmp_path_factory.mktemp("random") / "taxonomy" )
+	taxonomy_benchmark.makeTaxonomy( dbpath, 400, 10, seed=7 )
+	return dbpath
+
+def answer( lookup, *args ):
+	"""lookup(*args), or the type of the error it raised."""
+	try:
+		return lookup( *args )
+	except Exception as e:
+		return type(e).__name__
+
+def answers( taxids ):
+	"""The single-taxid lookups of every taxid."""
+	lookups = ( taxonomy.taxidStatus, taxonomy.taxid2mergedTid, taxonomy.taxid2name, taxonomy.taxid2rank,
+		taxonomy.taxid2normRank, taxonomy.taxid2depth, taxonomy.taxid2type, taxonomy.taxid2parent,
+		taxonomy.taxidIsLeaf, taxonomy.taxid2fullLineage, taxonomy.taxid2lineage, taxonomy.taxid2nearestMajorTaxid )
+	result = []
+	for tid in taxids:
+		result.append( [ answer( lookup, tid ) for lookup in lookups ] +
+			[ answer( taxonomy.taxid2nameOnRank, tid, r ) for r in ranks ] +
+			[ answer( taxonomy.taxid2taxidOnRank, tid, r ) for r in ranks ] )
+	return result
+
+def backendAnswers( dbpath ):
+	"""answers() (and the batch lookups) of every taxid of dbpath, by backend."""
+	parents, merged = readTree( dbpath )
+	taxids = sorted( parents, key=int ) + sorted( merged, key=int ) + [ "999999999" ]
+
+	results = {}
+	for backend in ("dict", "array", "snapshot"):
+		load( dbpath, backend )
+		results[backend] = answers( taxids )
+		if backend != "dict":
+			results[backend+" batch"] = (
+				taxonomy.taxids2name( taxids ).tolist(),
+				taxonomy.taxids2normRank( taxids ).tolist(),
+				[ taxonomy.taxids2taxidOnRank( taxids, r ).tolist() for r in ranks ]
+			)
+	assert [ a[1] for a in results["dict"][len(parents):-1] ] == [ merged[t] for t in sorted( merged, key=int ) ]
+	return results
+
+def test_backends_give_the_same_answers( randomDB ):
+	results = backendAnswers( randomDB )
+	assert results["dict"] == results["array"] == results["snapshot"]
+	assert results["array batch"] == results["snapshot batch"]
+
+def test_backends_give_the_same_answers_on_clades_and_strains( lineageDB ):
+	results = backendAnswers( lineageDB )
+	assert results["dict"] == results["array"] == results["snapshot"]
+	assert results["array batch"] == results["snapshot batch"]
+
+def lineage( parents, merged, tid ):
+	"""tid and its ancestors up to the root, by walking parents ([] if tid is unknown)."""
+	tid = merged.get( tid, tid )
+	path = []
+	while tid in parents and not path[-1:] == [tid]:
+		path.append( tid )
+		tid = parents[tid]
+	return path
+
+def bruteLCA( parents, merged, taxids ):
+	paths = [ lineage( parents, merged, tid ) for tid in taxids ]
+	paths = [ path for path in paths if path ]
+	if not paths:
+		return ""
+	common = set( paths[0] ).intersection( *paths[1:] )
+	return next( tid for tid in paths[0] if tid in common )
+
+@pytest.mark.parametrize( "backend", ["dict", "array", "snapshot"] )
+def test_lca_matches_brute_force( randomDB, backend ):
+	parents, merged = readTree( randomDB )
+	rng = random.Random( 3 )
+	taxids = sorted( parents, key=int ) + sorted( merged, key=int ) + [ "999999999" ]
+	pairs = [ ( rng.choice(taxids), rng.choice(taxids) ) for k in range(500) ]
+	sets = [ rng.sample( taxids, rng.randint(1, 6) ) for k in range(200) ]
+	load( randomDB, backend )
+
+	expected = [ bruteLCA( parents, merged, pair ) if all( lineage( parents, merged, t ) for t in pair ) else "" for pair in pairs ]
+	assert [ taxonomy.taxidLCA( a, b ) for (a, b) in pairs ] == expected
+	assert [ taxonomy.taxidContains( a, b ) for (a, b) in pairs ] == [ merged.get( a, a ) in lineage( parents, merged, b ) for (a, b) in pairs ]
+	assert [ taxonomy.taxidsLCA( s ) for s in sets ] == [ bruteLCA( parents, merged, s ) for s in sets ]
+	hits = [ ( "q%d" % k, tid ) for (k, s) in enumerate( sets ) for tid in s ]
+	assert list( taxonomy.lcaStream( hits ) ) == [ ( "q%d" % k, bruteLCA( parents, merged, s ) ) for (k, s) in enumerate( sets ) ]
+	if backend != "dict":
+		a, b = zip( *pairs )
+		assert taxonomy.taxidsPairLCA( a, b ).tolist() == [ int( tid or 0 ) for tid in expected ]
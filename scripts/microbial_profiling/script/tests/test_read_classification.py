@@ -0,0 +1,29 @@
+import pytest
+
+import read_classification
+
+pytest.importorskip( "pyarrow" )
+
+rows = [ ("read%d" % i, str(i % 3) if i < 5 else str(i), "1e-%d" % (i+1)) for i in range(11) ]
+
+@pytest.mark.parametrize( "ext", [".arrow", ".parquet"] )
+def test_columnar_round_trip_over_several_batches( tmp_path, ext ):
+	filename = str( tmp_path / ("reads" + ext) )
+	# new taxids keep turning up after the first batch
+	with read_classification.ReadClassificationWriter( filename, batch_size=3 ) as out:
+		for row in rows:
+			out.write( row )
+
+	assert [ (r, t, e) for (r, t, e) in read_classification.readRecords( filename ) ] == [ (r, t, float(e)) for (r, t, e) in rows ]
+	counts, total = read_classification.countValues( filename )
+	assert total == len(rows)
+	assert counts == { "0": 2, "1": 2, "2": 1, "5": 1, "6": 1, "7": 1, "8": 1, "9": 1, "10": 1 }
+
+def test_convert_text_to_arrow_and_back( tmp_path, monkeypatch ):
+	text = tmp_path / "reads.txt"
+	text.write_text( "".join( "\t".join(row) + "\n" for row in rows ) )
+
+	monkeypatch.setattr( read_classification, "batchSize", 4 )
+	assert read_classification.convert( str(text), str(tmp_path / "reads.arrow") ) == len(rows)
+	assert read_classification.convert( str(tmp_path / "reads.arrow"), str(tmp_path / "back.txt") ) == len(rows)
+	assert [ line.split("\t")[:2] for line in (tmp_path / "back.txt").read_text().splitlines() ] == [ list(row[:2]) for row in rows ]
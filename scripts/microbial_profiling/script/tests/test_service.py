@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+import pytest
+
+import taxonomy
+from conftest import libPath
+
+@pytest.fixture
+def service( lineageDB ):
+	"""A taxonomy service for lineageDB on its default socket."""
+	socket_path = lineageDB+"/"+taxonomy.socketName
+	p = subprocess.Popen( [ sys.executable, libPath+"/taxonomy.py", "serve", lineageDB ], stderr=subprocess.DEVNULL )
+	for k in range( 300 ):
+		if os.path.exists( socket_path ) or p.poll() is not None: break
+		time.sleep( 0.1 )
+	assert os.path.exists( socket_path )
+	yield lineageDB
+	taxonomy.loadTaxonomy( lineageDB, daemon=False )
+	p.send_signal( signal.SIGTERM )
+	p.wait()
+
+def lookupError( func, *args ):
+	try:
+		func( *args )
+	except Exception as e:
+		return ( type(e), e.args )
+	return None
+
+def test_service_answers_like_the_process( service ):
+	taxonomy.loadTaxonomy( service, daemon=False )
+	local = [ taxonomy.taxid2lineage( "9606" ), taxonomy.taxidLCA( "9606", "562" ), lookupError( taxonomy.taxid2parent, "999999" ) ]
+	assert local[2] is not None
+
+	taxonomy.loadTaxonomy( service )
+	assert taxonomy.taxDaemon is not None
+	assert [ taxonomy.taxid2lineage( "9606" ), taxonomy.taxidLCA( "9606", "562" ), lookupError( taxonomy.taxid2parent, "999999" ) ] == local
+
+def test_tables_are_not_loaded_in_a_client( service ):
+	taxonomy.loadTaxonomy( service )
+	with pytest.raises( RuntimeError ):
+		"9606" in taxonomy.taxParents
+	with pytest.raises( RuntimeError ):
+		taxonomy.taxRanks["9606"]
+
+	taxonomy.loadTaxonomy( service, daemon=False )
+	assert taxonomy.taxDaemon is None and taxonomy.taxParents["9606"] == "9605"
@@ -0,0 +1,72 @@
+import sys
+import subprocess
+
+import pytest
+
+import taxonomy
+
+from conftest import libPath, lineageTree
+
+def test_normalized_ranks_of_a_clade_lineage( lineageDB, backend ):
+	name = backend( lineageDB )
+
+	assert taxonomy.taxid2normRank( "1" ) == "root"
+	assert taxonomy.taxid2normRank( "40674" ) == "class"
+	# NCBI clades are not report levels, however deep they are
+	assert taxonomy.taxid2normRank( "32525" ) == "other rank"
+	assert taxonomy.taxid2normRank( "9347" ) == "other rank"
+	assert taxonomy.normRank2major["other rank"] == "other rank"
+	assert taxonomy.taxid2normRank( "63221" ) == "subspecies"
+	assert taxonomy.normRank2major["subspecies"] == "species"
+	# a deep "no rank" node is a strain, a shallow one is not
+	assert taxonomy.taxid2normRank( "511145" ) == "strain"
+	assert taxonomy.taxid2normRank( "131567" ) == "no rank"
+	assert taxonomy.taxid2normRank( "668369" ) == "species"
+	assert taxonomy.taxid2normRank( "999999" ) == "unclassified"
+
+	if name == "dict":
+		return
+	taxids = [ "9606", "9347", "511145", "999999" ]
+	assert [ taxonomy.normRanks[c] for c in taxonomy.taxids2normRank( taxids ) ] == [ "species", "other rank", "strain", "unclassified" ]
+	assert [ taxonomy.normRanks[c] for c in taxonomy.taxids2normRank( taxids, major=True ) ] == [ "species", "other rank", "strain", "unclassified" ]
+
+def runConverter( script, dbpath, stdin, *args ):
+	"""Output of a converter script run on stdin with the taxonomy of dbpath."""
+	code = "import sys, runpy, gi2lineage; gi2lineage.taxonomyDir = sys.argv[1]; sys.argv = sys.argv[2:]; runpy.run_path( sys.argv[0], run_name='__main__' )"
+	p = subprocess.run( [ sys.executable, "-c", code, dbpath, script ] + list(args), input=stdin, cwd=libPath,
+	                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True )
+	assert p.returncode == 0, p.stderr
+	return [ line.split("\t") for line in p.stdout.splitlines() ]
+
+def test_converters_skip_clades( lineageDB ):
+	rows = runConverter( "convert_metascope2list.py", lineageDB, "taxaID: 9606\n\tread count: 5\n" )
+	assert [ r[:3] for r in rows[1:] ] == [
+		[ "superkingdom", "Eukaryota", "5" ], [ "phylum", "Chordata", "5" ], [ "class", "Mammalia", "5" ],
+		[ "order", "Primates", "5" ], [ "family", "Hominidae", "5" ], [ "genus", "Homo", "5" ], [ "species", "Homo sapiens", "5" ] ]
+
+	rows = runConverter( "convert_krakenRep2list.py", lineageDB,
+		" 60.00\t6\t0\t-\t9347\t        Eutheria\n 50.00\t5\t5\tS\t9606\t              Homo sapiens\n" )
+	assert [ r[:2] for r in rows[1:] ] == [ [ "species", "Homo sapiens" ] ]
+
+	rows = runConverter( "convert_list2tabTree.py", lineageDB, "LEVEL\tTAXA\tROLLUP\tASSIGNED\tTAXID\nother rank\tEutheria\t6\t\t9347\n" )
+	assert rows == [ [ "6", "root", "Eukaryota", "Chordata", "Mammalia" ] ]
+
+@pytest.mark.parametrize( "ending", ["\n", "\r\n", ""] )
+def test_lazy_names_match_parsed_names( tmp_path, ending ):
+	rows = [ (tid, parent, rank, name) for (tid, (parent, rank, name)) in lineageTree.items() ]
+	rows.append( ("562.1", 562, "strain", "Escherichia coli custom") )
+	lines = [ "%s\t1\t%s\t%s\t%s" % row for row in rows ]
+	tsv = tmp_path / "taxonomy.tsv"
+	tsv.write_bytes( ( "\r\n" if ending == "\r\n" else "\n" ).join( lines ).encode() + ending.encode() )
+
+	taxonomy._resetTaxonomy()
+	taxonomy._loadTaxonomyTsv( str(tsv) )
+	parsed = ( dict(taxonomy.taxNames), dict(taxonomy.taxParents), dict(taxonomy.taxRanks) )
+
+	taxonomy._resetTaxonomy()
+	taxonomy._loadTaxonomyTsv( str(tsv), lazy_names=True )
+	assert isinstance( taxonomy.taxNames, taxonomy._LazyNames )
+	assert len(taxonomy.taxNames) == len(parsed[0])
+	assert { tid: taxonomy.taxNames[tid] for tid in parsed[0] } == parsed[0]
+	assert ( dict(taxonomy.taxParents), dict(taxonomy.taxRanks) ) == parsed[1:]
+	taxonomy._resetTaxonomy()
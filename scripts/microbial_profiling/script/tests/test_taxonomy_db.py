@@ -0,0 +1,56 @@
+import gc
+import pickle
+import multiprocessing
+
+import pytest
+
+import taxonomy
+from conftest import writeTaxonomy, lineageTree
+
+def lineageOf( db, taxid ):
+	return db.taxid2lineage( taxid )
+
+def test_taxonomy_db_shares_one_read_only_taxonomy( lineageDB ):
+	db = taxonomy.TaxonomyDB( lineageDB )
+	assert db.taxid2name( "9606" ) == "Homo sapiens"
+	assert db.taxidLCA( "9606", "562" ) == "131567"
+	assert not taxonomy.taxSnapshot.parent.flags.writeable
+
+	# a second TaxonomyDB of the same files reuses the loaded tables
+	snapshot = taxonomy.taxSnapshot
+	again = taxonomy.TaxonomyDB( lineageDB )
+	assert taxonomy.taxSnapshot is snapshot and again.current()
+
+	# so does a pickled one
+	copy = pickle.loads( pickle.dumps( db ) )
+	assert taxonomy.taxSnapshot is snapshot and copy.taxid2name( "562" ) == "Escherichia coli"
+
+def test_taxonomy_db_of_another_taxonomy_raises( tmp_path, lineageDB ):
+	db = taxonomy.TaxonomyDB( lineageDB )
+	other = writeTaxonomy( tmp_path / "other", lineageTree )
+	with pytest.raises( ValueError ):
+		taxonomy.TaxonomyDB( other )
+	assert db.current() and db.taxid2name( "9606" ) == "Homo sapiens"
+
+	# reloading the module taxonomy behind it makes the instance stale, not silently different
+	taxonomy.loadTaxonomy( other, backend="array", daemon=False )
+	with pytest.raises( RuntimeError ):
+		db.taxid2name( "9606" )
+	assert taxonomy.TaxonomyDB( other ).taxid2name( "9606" ) == "Homo sapiens"
+
+def test_taxonomy_db_freezes_gc_only_on_request( lineageDB ):
+	if not hasattr( gc, "freeze" ):
+		pytest.skip( "no gc.freeze()" )
+	gc.unfreeze()
+	taxonomy.TaxonomyDB( lineageDB )
+	assert gc.get_freeze_count() == 0
+	taxonomy.TaxonomyDB( lineageDB, freeze=True )
+	assert gc.get_freeze_count() > 0
+	gc.unfreeze()
+
+@pytest.mark.parametrize( "method", [ m for m in ("fork", "spawn") if m in multiprocessing.get_all_start_methods() ] )
+def test_taxonomy_db_in_a_worker_pool( lineageDB, method ):
+	db = taxonomy.TaxonomyDB( lineageDB )
+	taxids = [ "9606", "562", "511145", "9347" ]
+	with multiprocessing.get_context( method ).Pool( 2, initializer=db.initWorker ) as pool:
+		assert pool.starmap( lineageOf, [ (db, t) for t in taxids ] ) == [ db.taxid2lineage( t ) for t in taxids ]
@@ -18,6 +18,7 @@ OPTIONS:
    -o      Output directory
    -p      Output prefix
    -t      Number of threads (default: 16)
+   -a      Write the per-read classifications as an Arrow file instead of text (needs pyarrow)
    -h      help
 EOF
 }
@@ -34,8 +35,9 @@ PREFIX=
 OUTPATH=
 THREADS=16
 OPTIONS=
+ARROW=
 
-while getopts "i:d:o:p:t:n:h" OPTION
+while getopts "i:d:o:p:t:n:ah" OPTION
 do
      case $OPTION in
         i) FASTQ=$OPTARG
@@ -50,6 +52,8 @@ do
            ;;
         n) OPTIONS=$OPTARG
            ;;
+        a) ARROW=1
+           ;;
         h) usage
            exit
            ;;
@@ -70,10 +74,21 @@ echo "[BEGIN DIAMOND]"
 
 
 # -f 102 activates the taxonomy classification module of diamond and is required to make this work.
-time diamond blastx -p $THREADS -q $FASTQ -d $REFDB --taxonmap $EDGE_HOME/database/diamond/taxonomy/prot.accession2taxid.gz --taxonnodes $EDGE_HOME/database/diamond/taxonomy/nodes.dmp -f 102 -o $OUTPATH/$PREFIX.diamondRawOutput.txt
-
-# Make the taxonomy list file.
-python $EDGE_HOME/scripts/microbial_profiling/script/convert_diamond2list.py -tp $EDGE_HOME/database/diamond/taxonomy < $OUTPATH/$PREFIX.diamondRawOutput.txt > $OUTPATH/$PREFIX.out.list
+if [ "$ARROW" ]; then
+    # the classifications go straight from diamond into the Arrow file (no text copy on disk);
+    # the rollup then only reads its taxid column
+    set -o pipefail
+    time diamond blastx -p $THREADS -q $FASTQ -d $REFDB --taxonmap $EDGE_HOME/database/diamond/taxonomy/prot.accession2taxid.gz --taxonnodes $EDGE_HOME/database/diamond/taxonomy/nodes.dmp -f 102 \
+        | python $EDGE_HOME/scripts/microbial_profiling/script/read_classification.py convert - $OUTPATH/$PREFIX.diamondRawOutput.arrow
+
+    # Make the taxonomy list file.
+    python $EDGE_HOME/scripts/microbial_profiling/script/convert_diamond2list.py -tp $EDGE_HOME/database/diamond/taxonomy -i $OUTPATH/$PREFIX.diamondRawOutput.arrow > $OUTPATH/$PREFIX.out.list
+else
+    time diamond blastx -p $THREADS -q $FASTQ -d $REFDB --taxonmap $EDGE_HOME/database/diamond/taxonomy/prot.accession2taxid.gz --taxonnodes $EDGE_HOME/database/diamond/taxonomy/nodes.dmp -f 102 -o $OUTPATH/$PREFIX.diamondRawOutput.txt
+
+    # Make the taxonomy list file.
+    python $EDGE_HOME/scripts/microbial_profiling/script/convert_diamond2list.py -tp $EDGE_HOME/database/diamond/taxonomy < $OUTPATH/$PREFIX.diamondRawOutput.txt > $OUTPATH/$PREFIX.out.list
+fi
 
 # Convert for krona plot and generate taxon-based krona plot. Use -s 2 flag for ignoring abundance data and splitting wedge size evenly among all listed taxa (if taxa are listed >1 time,
 # then they will get a larger wedge. This is the same as ktImportText using the tab_tree file.